@@ -2,13 +2,19 @@ from transformers import AutoTokenizer, AutoModel
 import torch
 import argparse
 import json
-from tqdm import tqdm
 import datasets
+from embedding import encode_texts
+from pool import INDEX_TYPES, save_global_pool, save_pool
 
 parser = argparse.ArgumentParser(description='Validate Narrate')
 parser.add_argument('--bge-model', type=str, default='../models/bge-large-en-v1.5', help='model name')
 parser.add_argument("--result-files", type=str, help="result file", dest='result_files', nargs='+')
 parser.add_argument("--output-dataset-prefix", type=str, help="output dataset prefix", dest='output_dataset_prefix')
+parser.add_argument("--pool-format", type=str, help="one global pool or one pool per database", dest='pool_format', choices=["global", "per-db"], default="global")
+parser.add_argument("--index-type", type=str, help="faiss index type", dest='index_type', choices=INDEX_TYPES, default="flat")
+parser.add_argument("--ivf-nlist", type=int, help="ivf centroids, default sqrt(pool size)", dest='ivf_nlist', required=False)
+parser.add_argument("--hnsw-m", type=int, help="hnsw neighbors per node", dest='hnsw_m', default=32)
+parser.add_argument("--hnsw-ef-search", type=int, help="hnsw search depth", dest='hnsw_ef_search', default=64)
 args = parser.parse_args()
 
 input = []
@@ -23,16 +29,14 @@ model.eval()
 
 new_data = {}
 
-for item in tqdm(input):
+# 所有问题的 embedding 按长度分批一次算完，归一化后索引用内积检索
+all_embeddings = encode_texts(tokenizer, model, [item['query'] for item in input])
+
+for item, embeddings in zip(input, all_embeddings):
     db_id = item['db_id']
     sql = item['sql']
     question = item['query']
 
-    with torch.no_grad():
-        inputs = tokenizer(question, return_tensors="pt", padding=True, truncation=True)
-        outputs = model(**inputs)
-        embeddings = outputs[0][:, 0][0].cpu().numpy()
-
     if db_id not in new_data:
         new_data[db_id] = []
 
@@ -45,7 +49,19 @@ for item in tqdm(input):
 
 # 预览第一个数据
 print(new_data[list(new_data.keys())[0]][0])
-    
+
+if args.pool_format == "global":
+    # 所有库存进 {prefix} 一个池，按库分组拼接，每个库的行是连续的，检索时按行区间过滤
+    rows = [x for data in new_data.values() for x in data]
+    global_dataset = datasets.Dataset.from_dict({
+        "db_id": [x['db_id'] for x in rows],
+        "sql": [x['sql'] for x in rows],
+        "question": [x['question'] for x in rows],
+        "embeddings": [x['embeddings'] for x in rows]
+    })
+    save_global_pool(global_dataset, args.output_dataset_prefix, args.index_type, args.ivf_nlist, args.hnsw_m, args.hnsw_ef_search)
+    print(" ".join(new_data.keys()))
+    exit(0)
 
 output_datasets = {}
 for db_id, data in new_data.items():
@@ -68,6 +84,7 @@ for db_id, data in new_data.items():
     # scores, results = output_datasets[db_id].get_nearest_examples('embeddings', embeddings, k=3)
     # print(results)
 
-    output_datasets[db_id].save_to_disk(f"{args.output_dataset_prefix}_{db_id}")
+    # 池和索引一起保存，推理时直接 mmap 索引，不用再重建
+    save_pool(output_datasets[db_id], f"{args.output_dataset_prefix}_{db_id}", args.index_type, args.ivf_nlist, args.hnsw_m, args.hnsw_ef_search)
 
 print(" ".join(output_datasets.keys()))
\ No newline at end of file
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+
+from schema import Database, build_db_from_spider, profile_database
+
+# Database/Table 的结构变了就改这个，老的 catalog 会自动重建
+CATALOG_VERSION = 3
+
+def get_catalog_hash(table_json: str, db_dir: str | None = None, top_k: int = 10) -> str:
+    """
+    catalog 的 key，由 tables.json 的内容和 profile 的参数决定
+    SQLite 文件的内容不计入，数据变了需要删掉 catalog 重新编译
+    """
+    h = hashlib.sha1(f"{CATALOG_VERSION}\0{db_dir}\0{top_k}".encode())
+    with open(table_json, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def compile_catalog(table_json: str, path: str, table_hash: str | None = None, db_dir: str | None = None, top_k: int = 10):
+    """
+    把 tables.json 里所有的库 build 成 Database，每个库单独 pickle 后存进一个 SQLite 文件
+    db_dir 不为 None 时顺便对 {db_dir}/{db_id}/{db_id}.sqlite 做 profile_database，统计结果存在 Table 上
+    先写临时文件再 rename，多个进程同时编译也不会读到写了一半的文件
+    """
+    if table_hash is None:
+        table_hash = get_catalog_hash(table_json, db_dir, top_k)
+    with open(table_json, "r") as f:
+        db_data = json.load(f)
+
+    # db_id 重复时和原来建 dict 的行为一样：位置取第一次出现的，内容取最后一次的
+    schemas = {}
+    for item in db_data:
+        schemas[item["db_id"]] = item
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    conn = sqlite3.connect(tmp_path)
+    conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("CREATE TABLE dbs (db_id TEXT PRIMARY KEY, idx INTEGER, value BLOB)")
+    conn.execute("INSERT INTO meta (key, value) VALUES ('hash', ?)", (table_hash,))
+    for index, (db_id, item) in enumerate(schemas.items()):
+        db = build_db_from_spider(item)
+        if db_dir is not None:
+            db_sqlite_file = os.path.join(db_dir, db_id, f"{db_id}.sqlite")
+            if os.path.exists(db_sqlite_file):
+                profile_database(db, db_sqlite_file, top_k)
+        conn.execute("INSERT INTO dbs (db_id, idx, value) VALUES (?, ?, ?)", (db_id, index, pickle.dumps(db, protocol=pickle.HIGHEST_PROTOCOL)))
+    conn.commit()
+    conn.close()
+    os.replace(tmp_path, path)
+
+def _catalog_hash(path: str) -> str | None:
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'hash'").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+    return row[0] if row is not None else None
+
+
+class SchemaCatalog(object):
+    """
+    编译好的 schema 目录，用法和 {db_id: Database} 的 dict 一样
+    打开时只读 db_id 列表，Database 在第一次访问时才反序列化
+    """
+    def __init__(self, path: str):
+        self.path = path
+        # 只读连接，server.py 在主线程打开、在推理线程里读
+        self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self.db_ids = [row[0] for row in self.conn.execute("SELECT db_id FROM dbs ORDER BY idx")]
+        self.db_id_set = set(self.db_ids)
+        self.loaded = {}
+
+    def __getitem__(self, db_id: str) -> Database:
+        db = self.loaded.get(db_id)
+        if db is None:
+            row = self.conn.execute("SELECT value FROM dbs WHERE db_id = ?", (db_id,)).fetchone()
+            if row is None:
+                raise KeyError(db_id)
+            db = pickle.loads(row[0])
+            self.loaded[db_id] = db
+        return db
+
+    def get(self, db_id: str, default: Database | None = None) -> Database | None:
+        if db_id not in self.db_id_set:
+            return default
+        return self[db_id]
+
+    def __contains__(self, db_id: str) -> bool:
+        return db_id in self.db_id_set
+
+    def __iter__(self):
+        return iter(self.db_ids)
+
+    def __len__(self) -> int:
+        return len(self.db_ids)
+
+    def keys(self) -> list[str]:
+        return list(self.db_ids)
+
+    def values(self):
+        for db_id in self.db_ids:
+            yield self[db_id]
+
+    def items(self):
+        for db_id in self.db_ids:
+            yield db_id, self[db_id]
+
+    def close(self):
+        self.conn.close()
+
+
+def load_catalog(table_json: str, path: str | None = None, db_dir: str | None = None, top_k: int = 10) -> SchemaCatalog:
+    """
+    读取 tables.json 对应的 catalog，不存在或者 tables.json 变了就重新编译
+    path 默认放在 tables.json 旁边，带 profile 的 catalog 单独存一份
+    """
+    if path is None:
+        path = f"{table_json}.catalog" if db_dir is None else f"{table_json}.stats.catalog"
+    table_hash = get_catalog_hash(table_json, db_dir, top_k)
+    if _catalog_hash(path) != table_hash:
+        compile_catalog(table_json, path, table_hash, db_dir, top_k)
+    return SchemaCatalog(path)
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--table-json", dest="table_json", type=str, default="./data/spider/tables.json")
+    parser.add_argument("--catalog", dest="catalog", type=str, required=False)
+    parser.add_argument("--db-dir", dest="db_dir", type=str, required=False)
+    parser.add_argument("--top-k", dest="top_k", type=int, default=10)
+    args = parser.parse_args()
+
+    # 对比直接 build 和从 catalog 读的结果与耗时
+    start_time = time.perf_counter()
+    with open(args.table_json, "r") as f:
+        dbs = {item["db_id"]: build_db_from_spider(item) for item in json.load(f)}
+    build_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    load_catalog(args.table_json, args.catalog, args.db_dir, args.top_k).close()
+    compile_time = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    catalog = load_catalog(args.table_json, args.catalog, args.db_dir, args.top_k)
+    open_time = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    loaded = dict(catalog.items())
+    load_time = time.perf_counter() - start_time
+    mismatched = [db_id for db_id, db in loaded.items() if str(db) != str(dbs[db_id]) or [t.to_ddl() for t in db.tables.values()] != [t.to_ddl() for t in dbs[db_id].tables.values()]]
+
+    print(f"Databases: {len(catalog)}, mismatched: {len(mismatched)}")
+    print(f"Build from json: {build_time * 1000:.1f}ms, compile (or check) catalog: {compile_time * 1000:.1f}ms, open catalog: {open_time * 1000:.1f}ms, load all from catalog: {load_time * 1000:.1f}ms")
+    if args.db_dir is not None:
+        profiled = sum(1 for db in loaded.values() if any(table.row_count is not None for table in db.tables.values()))
+        print(f"Profiled databases: {profiled}")
+    if mismatched:
+        exit(1)
@@ -0,0 +1,47 @@
+import argparse
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from tqdm import tqdm
+
+from sql_check import execute_sql, get_db_path
+from voting import result_eq
+
+def execution_match(db_path: str, reference: str, generated: str, timeout: float) -> bool:
+    """
+    只在 {db_id}.sqlite 这一个库上比执行结果，不做 test suite 的多库和填值，只用于对比解码方式
+    完整的评测还是用 validate.py
+    """
+    gold_flag, gold_rows = execute_sql(db_path, reference, timeout)
+    flag, rows = execute_sql(db_path, generated, timeout)
+    if gold_flag != "result" or flag != "result":
+        return False
+    return result_eq(gold_rows, rows, order_matters="order by" in reference.lower())
+
+if __name__ == "__main__":
+    # 对比几次 infer.py（不同 --decoding）的结果：在共同的样本上比执行准确率和每条样本的解码耗时
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--results", dest="results", type=str, nargs="+", required=True, help="result JSON files written by infer.py")
+    parser.add_argument("--db-dir", dest="db_dir", type=str, required=True)
+    parser.add_argument("--timeout", dest="timeout", type=float, default=30.0)
+    parser.add_argument("--workers", dest="workers", type=int, default=4)
+    args = parser.parse_args()
+
+    all_results = []
+    for path in args.results:
+        with open(path, "r") as f:
+            all_results.append({result["sample_id"]: result for result in json.load(f)})
+    sample_ids = [sample_id for sample_id in all_results[0] if all(sample_id in results for results in all_results[1:])]
+    print(f"{len(sample_ids)} samples in all {len(args.results)} result files")
+
+    with ThreadPoolExecutor(args.workers) as executor:
+        for path, results in zip(args.results, all_results):
+            samples = [results[sample_id] for sample_id in sample_ids]
+            matches = list(tqdm(executor.map(
+                lambda sample: execution_match(get_db_path(args.db_dir, sample["db_id"]), sample["reference"], sample["generated"], args.timeout),
+                samples
+            ), total=len(samples), desc=path))
+            seconds = [sample["decoding"]["seconds"] for sample in samples if "decoding" in sample]
+            latency = f"{np.mean(seconds):.2f}s mean, {np.percentile(seconds, 50):.2f}s p50, {np.percentile(seconds, 90):.2f}s p90" if seconds else "no decoding stats"
+            print(f"{path}: accuracy {np.mean(matches):.2%}, {latency} per sample")
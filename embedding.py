@@ -0,0 +1,30 @@
+import numpy as np
+import torch
+
+def encode_texts(tokenizer, model, texts: list[str], batch_size: int = 64, normalize: bool = True) -> np.ndarray:
+    """
+    用 BGE 批量计算 embedding（取 [CLS]），返回的第 i 行对应 texts[i]
+    先整体分词一次，再按 token 数排序分桶，同一批里长度接近，padding 少
+    normalize 为 True 时做 L2 归一化，点积就是 cosine 相似度
+    """
+    if len(texts) == 0:
+        return np.zeros((0, model.config.hidden_size), dtype=np.float32)
+
+    encoded = tokenizer(texts, truncation=True)
+    order = sorted(range(len(texts)), key=lambda i: len(encoded["input_ids"][i]))
+    embeddings = np.zeros((len(texts), model.config.hidden_size), dtype=np.float32)
+
+    for begin in range(0, len(order), batch_size):
+        batch = order[begin:begin + batch_size]
+        inputs = tokenizer.pad(
+            {key: [encoded[key][i] for i in batch] for key in encoded.keys()},
+            return_tensors="pt"
+        ).to(model.device)
+        with torch.no_grad():
+            outputs = model(**inputs)
+            batch_embeddings = outputs[0][:, 0]
+            if normalize:
+                batch_embeddings = torch.nn.functional.normalize(batch_embeddings, p=2, dim=1)
+        embeddings[batch] = batch_embeddings.float().cpu().numpy()
+
+    return embeddings
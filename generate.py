@@ -2,23 +2,26 @@ from re import template
 import time
 
 from template import SQLTemplate
-from schema import Database, Table, build_db_from_spider
+from schema import Database, Table
+from catalog import load_catalog
 import argparse
 from tqdm import tqdm
 from itertools import permutations, product
 from functools import reduce
 import sqlite3
 import threading
+import heapq
+import random
 
 conns = {}
 
-def generate_sqls_with_timeout(db: Database, db_sqlite_file: str, template: SQLTemplate, timeout: int = 300) -> list[str]:
+def generate_sqls_with_timeout(db: Database, db_sqlite_file: str, template: SQLTemplate, timeout: int = 300, with_elements: bool = False) -> list:
     finished_event = threading.Event()
     result = []
     def generate():
         nonlocal result
         try:
-            result = generate_sqls(db, db_sqlite_file, template)
+            result = generate_sqls(db, db_sqlite_file, template, with_elements=with_elements)
         except Exception as e:
             result = []
         finished_event.set()
@@ -34,10 +37,12 @@ def generate_sqls_with_timeout(db: Database, db_sqlite_file: str, template: SQLT
 def generate_sqls(db: Database, db_sqlite_file: str, template: SQLTemplate,
                   max_literal_length: int = 32, # 最大字面量长度，用于防止诸如 Description 等字段被作为条件
                   no_id_in_literal: bool = True, # 是否在字面量中不包含 ID 及关联的外键，用于防止生成无意义的 SQL，检测 ID 为如下字符串：Id、ID、_id，不直接检测 id 是因为可能会误伤
+                  with_elements: bool = False, # 是否同时返回每条 SQL 用到的表和列，见下
                   # TODO: 加一些其他的约束
-                  ) -> list[str]:
+                  ) -> list:
     """
     从 db 中按照 template 的模式和约束生成所有可行 SQL 语句
+    with_elements 为 True 时返回 [(SQL, 用到的表和列)]，表记作 (TABLE, "*")，列记作 (TABLE, COLUMN)，都是大写
     """
 
     # Step 0: 加载 SQLite 数据库
@@ -56,8 +61,19 @@ def generate_sqls(db: Database, db_sqlite_file: str, template: SQLTemplate,
     
     # 把 tables: dict 转换成 list
     tables = list(tables.values())
+
+    # 模板要求表 i 的某列是指向表 j 的外键时，表 i 至少要有一个外键引用表 j，先按外键图筛掉不可能的表组合
+    required_references = set()
+    for table_index, table_constraint in enumerate(template.columns):
+        for column_constraint in table_constraint:
+            if column_constraint["fk"] and column_constraint["fk_info"] != (-1, -1):
+                required_references.add((table_index, column_constraint["fk_info"][0]))
+    references = db.join_graph().references
+
     for table_combination in permutations(tables, tables_count):
         # print([x.name for x in table_combination])
+        if any(table_combination[j].name not in references[table_combination[i].name] for i, j in required_references):
+            continue
         # 已选定表，寻找其中符合约束的列组合
         all_valid = True
         candidate_columns = []
@@ -162,10 +178,17 @@ def generate_sqls(db: Database, db_sqlite_file: str, template: SQLTemplate,
                 ]
 
                 def get_literal(table_name, column_name):
-                    cursor = conn.cursor()
-                    cursor.execute(f"SELECT {column_name} FROM {table_name} ORDER BY RANDOM() LIMIT 1")
-                    result = cursor.fetchone()[0]
-                    cursor.close()
+                    # catalog 做过 profile 且高频值覆盖了这一列所有的值时，按出现次数（连同 NULL）抽样，和 ORDER BY RANDOM() 的分布一样，不用扫表
+                    # 其他情况（没有 profile、高基数的列）还是直接查 SQLite
+                    stats = db.get_table(table_name.strip("`")).get_column_stats(column_name.strip("`"))
+                    if stats is not None and stats.row_count > 0 and len(stats.frequent_values) == stats.distinct_count:
+                        values, counts = zip(*stats.frequent_values, (None, round(stats.null_fraction * stats.row_count)))
+                        result = random.choices(values, weights=counts)[0]
+                    else:
+                        cursor = conn.cursor()
+                        cursor.execute(f"SELECT {column_name} FROM {table_name} ORDER BY RANDOM() LIMIT 1")
+                        result = cursor.fetchone()[0]
+                        cursor.close()
                     if isinstance(result, str):
                         return f"'{result}'"
                     return str(result)
@@ -184,14 +207,74 @@ def generate_sqls(db: Database, db_sqlite_file: str, template: SQLTemplate,
 
                 sql = template.render(tables, columns, get_literal, max_literal_length=max_literal_length, no_id_in_literal=no_id_in_literal, get_fks=get_fks)
                 # print(sql)
-                if sql is not None:
+                if sql is not None and with_elements:
+                    # 直接用填进模板的表和列，不从 SQL 文本里反推，字面量里的点号、没带表名的表都不会算错
+                    elements = {(table.name.upper(), "*") for table in table_combination}
+                    elements |= {(table.name.upper(), column[0].upper()) for table, table_columns in zip(table_combination, columns_combination) for column in table_columns}
+                    result.append((sql, frozenset(elements)))
+                elif sql is not None:
                     result.append(sql)
 
     return result
 
+def allocate_budget(occurrences: list[int], available: list[int], budget: int) -> list[int]:
+    """
+    按模板出现频率把一个库的 SQL 总预算分给各个模板（最大余数法）
+    available 是每个模板实际能生成的 SQL 数，分不完的预算再按频率分给还有余量的模板
+    """
+    quotas = [0] * len(occurrences)
+    remaining = budget
+    while remaining > 0:
+        open_indexes = [i for i in range(len(occurrences)) if quotas[i] < available[i]]
+        if len(open_indexes) == 0:
+            break
+        total = sum(max(occurrences[i], 1) for i in open_indexes)
+        shares = {i: remaining * max(occurrences[i], 1) / total for i in open_indexes}
+        given = 0
+        for i in open_indexes:
+            add = min(int(shares[i]), available[i] - quotas[i])
+            quotas[i] += add
+            given += add
+        # 整数部分分完后，余数按小数部分从大到小一个一个给
+        for i in sorted(open_indexes, key=lambda i: shares[i] - int(shares[i]), reverse=True):
+            if given >= remaining:
+                break
+            if quotas[i] < available[i]:
+                quotas[i] += 1
+                given += 1
+        if given == 0:
+            break
+        remaining -= given
+    return quotas
+
+def select_with_coverage(sqls: list[str], elements: list[frozenset], quota: int, covered: set) -> list[str]:
+    """
+    从 sqls 中选 quota 条，优先选能覆盖更多还没覆盖到的表和列的 SQL，选中后更新 covered
+    elements[i] 是 sqls[i] 用到的表和列，由 generate_sqls(with_elements=True) 给出
+    收益只会变小，所以用懒惰贪心，不用每轮重新算全部 SQL 的收益
+    """
+    if quota >= len(sqls):
+        for used in elements:
+            covered |= used
+        return list(sqls)
+
+    # 收益相同时随机打破平局
+    heap = [(-len(e - covered), random.random(), i) for i, e in enumerate(elements)]
+    heapq.heapify(heap)
+
+    selected = []
+    while heap and len(selected) < quota:
+        neg_gain, tie, i = heapq.heappop(heap)
+        gain = len(elements[i] - covered)
+        if gain < -neg_gain:
+            heapq.heappush(heap, (-gain, tie, i))
+            continue
+        selected.append(sqls[i])
+        covered |= elements[i]
+    return selected
+
 if __name__ == "__main__":
     import argparse
-    import random
     import json
     from tqdm import tqdm
     import pickle
@@ -205,31 +288,31 @@ if __name__ == "__main__":
     parser.add_argument("--output", dest="output", required=False, type=str)
     parser.add_argument("--maximum-sqls-per-template", dest="maximum_sqls_per_template", type=int, default=-1)
     parser.add_argument("--template-limit", dest="template_limit", type=int, default=-1)
+    parser.add_argument("--sql-budget-per-db", dest="sql_budget_per_db", type=int, default=-1)
     parser.add_argument("--save-interval", dest="save_interval", type=int, default=10)
+    parser.add_argument("--literal-from-stats", dest="literal_from_stats", action="store_true", default=False)
     args = parser.parse_args()
 
-    with open(args.spider_table_json, "r") as f:
-        db_data = json.load(f)
-
-    dbs = []
-    for item in tqdm(db_data):
-        db = build_db_from_spider(item)
-        dbs.append(db)
+    # 编译好的 schema catalog 缓存在 tables.json 旁边，只反序列化用到的库
+    # --literal-from-stats 时用带 profile 的 catalog，第一次编译要对每个库每列做一次 GROUP BY，之后 get_literal 对取值少的列不用扫表
+    dbs = load_catalog(args.spider_table_json, db_dir=args.db_dir if args.literal_from_stats else None)
 
     used_dbs = []
     if args.db_names is None:
-        used_dbs = dbs
+        used_dbs = list(dbs.values())
     else:
-        for db in dbs:
-            if db.name in args.db_names:
-                used_dbs.append(db)
+        for db_name in dbs:
+            if db_name in args.db_names:
+                used_dbs.append(dbs[db_name])
 
     with open(args.templates, "rb") as f:
         templates = pickle.load(f)
 
+    occurrences = [x[1] for x in templates]
     templates = [x[0] for x in templates]
     if args.template_limit != -1:
         templates = templates[:args.template_limit]
+        occurrences = occurrences[:args.template_limit]
 
     generated_sqls = []
 
@@ -240,20 +323,46 @@ if __name__ == "__main__":
 
             if args.template_index == -1:
                 template_list = templates
+                occurrence_list = occurrences
             else:
                 template_list = [templates[args.template_index]]
+                occurrence_list = [occurrences[args.template_index]]
 
             db_path = f"{args.db_dir}/{db.name}/{db.name}.sqlite"
 
+            # 按预算挑选时要知道每条 SQL 用到的表和列
+            with_elements = args.sql_budget_per_db != -1
+            candidates = []
             for template in template_list:
                 try:
-                    sqls = generate_sqls_with_timeout(db,  db_path, template, 120)
+                    sqls = generate_sqls_with_timeout(db,  db_path, template, 120, with_elements=with_elements)
                 except Exception as e:
                     sqls = []
-                if args.maximum_sqls_per_template != -1:
-                    sqls = random.sample(sqls, min(args.maximum_sqls_per_template, len(sqls)))
+                candidates.append(sqls)
+                pbar.update(1)
+
+            def is_valid(sql):
                 # 移除所有含有 <|-1,-1|> 和 (|-1,-1|) 的 SQL
-                sqls = [sql for sql in sqls if "<|-1,-1|>" not in sql and "(|-1,-1|)" not in sql]
+                return "<|-1,-1|>" not in sql and "(|-1,-1|)" not in sql
+
+            def remove_invalid(sqls):
+                return [sql for sql in sqls if is_valid(sql)]
+
+            if args.sql_budget_per_db != -1:
+                # 按模板出现频率分配全库预算，并优先覆盖还没用到的表和列
+                candidates = [[(sql, used) for sql, used in pairs if is_valid(sql)] for pairs in candidates]
+                quotas = allocate_budget(occurrence_list, [len(x) for x in candidates], args.sql_budget_per_db)
+                covered = set()
+                selected = [
+                    select_with_coverage([sql for sql, _ in pairs], [used for _, used in pairs], quota, covered)
+                    for pairs, quota in zip(candidates, quotas)
+                ]
+            elif args.maximum_sqls_per_template != -1:
+                selected = [remove_invalid(random.sample(sqls, min(args.maximum_sqls_per_template, len(sqls)))) for sqls in candidates]
+            else:
+                selected = [remove_invalid(sqls) for sqls in candidates]
+
+            for template, sqls in zip(template_list, selected):
                 for sql in sqls:
                     generated_sqls.append({
                         "db_id": db.name,
@@ -266,8 +375,6 @@ if __name__ == "__main__":
                         with open(args.output, "w") as f:
                             json.dump(generated_sqls, f, indent=4, ensure_ascii=False)
 
-                pbar.update(1)
-
     end_time = time.time()
 
     print(f"SQLs generated: {total_cnt}, Time: {end_time - start_time:.2f}s, Speed: {total_cnt / (end_time - start_time):.2f} SQL/s")
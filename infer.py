@@ -8,46 +8,58 @@ from jinja2 import Template
 from tqdm import tqdm
 import re
 import random
-import datasets
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from llm.glm4 import GLM4
 from llm.llama import Llama
 from llm.llm import LLM
 from llm.qwen import Qwen
-from schema import Database, build_db_from_spider
-from schema_linking import schema_linking
+from llm.stopping import STOP_MODES, template_stop_mode
+from schema import Database, Table
+from catalog import load_catalog
+from embedding import encode_texts
+from pool import ReferencePool, load_reference_pools
+from results import ResultWriter, get_sample_id
+from schema_linking import EmbeddingSchemaLinker, SchemaLinkingCache, schema_linking, schema_linking_batch
+from sql_check import CHECK_MODES, SQLChecker, get_db_path
+from voting import execute_candidates, vote
 
 def generate_prompt(
     db: Database,
     question: str,
     question_embeddings: np.ndarray,
     reference_shot: int,
-    reference_datasets_dict: dict,
+    reference_datasets_dict: dict[str, ReferencePool],
     sl: bool,
     sl_model: LLM,
     sl_template: Template,
     input_template: Template,
+    sl_linker: EmbeddingSchemaLinker | None = None,
+    linked_tables: list[Table] | None = None,
 ):
     # 找相似问题
     if reference_shot > 0:
-        score, nearest_examples = reference_datasets_dict[db.name].get_nearest_examples('embeddings', question_embeddings, k=reference_shot)
-        examples = zip(nearest_examples["question"], nearest_examples["sql"])
-        examples = list(examples)
+        # 全局池里只在这个库的行区间里找
+        examples = reference_datasets_dict[db.name].search(question_embeddings, k=reference_shot, db_id=db.name)
     else:
         examples = []
 
     # Schema linking
     if sl:
-        linked_tables = schema_linking(question, db, sl_model, sl_template)
+        # linked_tables 不为 None 说明已经提前批量做过 schema linking
+        if linked_tables is None and sl_linker is not None:
+            # 用 BGE 打分挑表，不用再调一次 LLM
+            linked_tables = sl_linker.link(question_embeddings, db)
+        elif linked_tables is None:
+            linked_tables = schema_linking(question, db, sl_model, sl_template)
+        tables = [str(table) for table in linked_tables]
+        ddls = [table.to_ddl() for table in linked_tables]
+        fks = [fk for table in linked_tables for fk in table.fk_lines()]
     else:
-        linked_tables = db.tables.values()
-
-    tables = [str(table) for table in linked_tables]
-    ddls = [table.to_ddl() for table in linked_tables]
-    fks = []
-    for table in linked_tables:
-        for fk in table.foreign_keys:
-            fks.append(f"{table.name}({fk[0]}) REFERENCES {fk[1].name}({fk[2]})")
+        # 不做 schema linking 时整个库的片段都是缓存好的
+        tables, ddls, fks = db.signatures(), db.ddls(), db.fk_lines()
 
     prompt = input_template.render(question=question, tables=tables, ddls=ddls, fks=fks, examples=examples, have_fk=len(fks) > 0, have_examples=len(examples) > 0)
 
@@ -65,7 +77,7 @@ def extract_sql(raw_answer: str) -> str:
         return all_sqls[-1]
     
     # 第二种情况，只能先找到最后一个 `SELECT `，然后向后匹配到第一个 `;` 或匹配到结尾
-    sql_pattern = r'SELECT .*?;?'
+    sql_pattern = r'SELECT .*?(?:;|$)'
     all_sqls = []
     for match in re.finditer(sql_pattern, raw_answer, re.DOTALL):
         all_sqls.append(match.group(0).strip())
@@ -80,6 +92,210 @@ def flatten_sql(sql: str) -> str:
     sql = re.sub(r'\s+', ' ', sql)
     return sql.strip()
 
+def build_result(sample: dict, generated_sql: str, dataset_type: str, decoding: dict | None = None) -> dict:
+    if dataset_type == "bird":
+        result = {
+            "sample_id": sample["sample_id"], # For BIRD
+            "difficulty": sample["difficulty"], # For BIRD
+            "db_id": sample["db_id"],
+            "question": sample["question"],
+            "reference": sample["SQL"], # 参考 SQL，标准答案
+            "generated": generated_sql
+        }
+    else:
+        result = {
+            "sample_id": sample["sample_id"],
+            "db_id": sample["db_id"],
+            "question": sample["question"],
+            "reference": sample["query"], # For Spider
+            "generated": generated_sql
+        }
+    if decoding is not None:
+        # 这条样本的解码统计，validate.py 不读
+        result["decoding"] = decoding
+    return result
+
+def schedule_batches(data: list[dict], prompts: list[str], batch_size: int, group_by_db: bool) -> list[tuple[list[int], str | None]]:
+    """
+    把样本分批，返回 [(这一批的样本下标, 这一批共同的 prompt 前缀)]
+    不分组时按 prompt 长度排序后切分，同一批里长度接近，补齐的 padding 少
+    按库分组时一批里只有一个库的样本，前缀取这个库所有 prompt 的公共前缀，同一个库的批挨在一起，前缀的 KV 缓存能一直复用
+    """
+    order = sorted(range(len(data)), key=lambda i: len(prompts[i]))
+    if not group_by_db:
+        return [(order[begin:begin + batch_size], None) for begin in range(0, len(order), batch_size)]
+
+    groups = {}
+    for i in order:
+        groups.setdefault(data[i]["db_id"], []).append(i)
+    batches = []
+    for indexes in groups.values():
+        prefix = os.path.commonprefix([prompts[i] for i in indexes])
+        for begin in range(0, len(indexes), batch_size):
+            batches.append((indexes[begin:begin + batch_size], prefix))
+    return batches
+
+# 所有解码方式共用的生成参数，贪心和 beam search 时关掉采样相关的参数
+DECODE_KWARGS = dict(max_new_tokens=512, do_sample=False, top_p=None, top_k=None, temperature=None)
+
+def generate_answers(llm: LLM, prompts: list[str], prefix: str | None, **kwargs) -> list[str]:
+    if prefix:
+        return llm.infer_batch_with_prefix(prefix, prompts, system_prompt=None, **kwargs)
+    return llm.infer_batch(prompts, system_prompt=None, **kwargs)
+
+def decode_beam(llm: LLM, prompts: list[str], prefix: str | None, num_beams: int = 5, stop_mode: str = "none") -> tuple[list[str], list[dict]]:
+    """
+    所有样本都用 beam search，返回 (每条的 SQL, 每条的解码统计)
+    """
+    start_time = time.perf_counter()
+    answers = generate_answers(llm, prompts, prefix, num_beams=num_beams, stop_mode=stop_mode, **DECODE_KWARGS)
+    seconds = (time.perf_counter() - start_time) / len(prompts)
+    stats = [{"escalated": False, "failure": None, "passes": 1, "seconds": seconds, "escalation_seconds": 0.0} for _ in prompts]
+    return [flatten_sql(extract_sql(answer)) for answer in answers], stats
+
+def decode_greedy_first(
+    llm: LLM,
+    prompts: list[str],
+    prefix: str | None,
+    db_ids: list[str],
+    checker: SQLChecker,
+    escalation: str = "beam",
+    num_beams: int = 5,
+    samples: int = 4,
+    temperature: float = 0.8,
+    stop_mode: str = "none",
+) -> tuple[list[str], list[dict]]:
+    """
+    先贪心解码，抽不出 SQL 或 SQLite 检查不通过的样本再升级重新生成，返回 (每条的 SQL, 每条的解码统计)
+    escalation 为 beam 时没通过的样本做一轮 beam search，结果即使还是没通过也用 beam 的
+    为 sample 时最多采样 samples 轮，每轮只重新生成还没通过的，都没通过就保留贪心的结果
+    一批的耗时平均摊到这一批的每条样本上
+    """
+    start_time = time.perf_counter()
+    answers = generate_answers(llm, prompts, prefix, num_beams=1, stop_mode=stop_mode, **DECODE_KWARGS)
+    seconds = (time.perf_counter() - start_time) / len(prompts)
+    sqls = [flatten_sql(extract_sql(answer)) for answer in answers]
+    stats = [{"escalated": False, "failure": None, "passes": 1, "seconds": seconds, "escalation_seconds": 0.0} for _ in prompts]
+
+    failed = []
+    for i, sql in enumerate(sqls):
+        failure = checker.check(db_ids[i], sql)
+        if failure is not None:
+            stats[i]["escalated"] = True
+            stats[i]["failure"] = failure
+            failed.append(i)
+
+    if escalation == "beam":
+        rounds = [dict(DECODE_KWARGS, num_beams=num_beams)]
+    elif escalation == "sample":
+        rounds = [dict(DECODE_KWARGS, num_beams=1, do_sample=True, temperature=temperature)] * samples
+    else:
+        raise ValueError(f"Unknown escalation: {escalation}")
+
+    for round_kwargs in rounds:
+        if not failed:
+            break
+        # 同一批的 prompt 都以 prefix 开头，其中一部分也一样，前缀缓存照样能用
+        start_time = time.perf_counter()
+        answers = generate_answers(llm, [prompts[i] for i in failed], prefix, stop_mode=stop_mode, **round_kwargs)
+        seconds = (time.perf_counter() - start_time) / len(failed)
+        still_failed = []
+        for i, answer in zip(failed, answers):
+            stats[i]["passes"] += 1
+            stats[i]["seconds"] += seconds
+            stats[i]["escalation_seconds"] += seconds
+            sql = flatten_sql(extract_sql(answer))
+            passed = checker.check(db_ids[i], sql) is None
+            if passed or escalation == "beam":
+                sqls[i] = sql
+            if not passed:
+                still_failed.append(i)
+        failed = still_failed
+    return sqls, stats
+
+def decode_vote(
+    llm: LLM,
+    prompts: list[str],
+    prefix: str | None,
+    db_ids: list[str],
+    db_dir: str,
+    executor: ThreadPoolExecutor | None = None,
+    samples: int = 8,
+    temperature: float = 0.8,
+    timeout: float = 10.0,
+    stop_mode: str = "none",
+) -> tuple[list[str], list[dict]]:
+    """
+    一次 generate 给每条 prompt 采样 samples 个候选，去重后在库上执行，按执行结果投票，返回 (每条的 SQL, 每条的解码统计)
+    生成的耗时平均摊到这一批的每条样本上，执行和投票的耗时按样本分别计
+    """
+    kwargs = dict(DECODE_KWARGS, num_beams=1, do_sample=True, temperature=temperature)
+    start_time = time.perf_counter()
+    if prefix:
+        all_answers = llm.infer_batch_multiple_with_prefix(prefix, prompts, samples, system_prompt=None, stop_mode=stop_mode, **kwargs)
+    else:
+        all_answers = llm.infer_batch_multiple(prompts, samples, system_prompt=None, stop_mode=stop_mode, **kwargs)
+    generate_seconds = (time.perf_counter() - start_time) / len(prompts)
+
+    sqls = []
+    stats = []
+    for answers, db_id in zip(all_answers, db_ids):
+        start_time = time.perf_counter()
+        candidates = [flatten_sql(extract_sql(answer)) for answer in answers]
+        executions = execute_candidates(get_db_path(db_dir, db_id), candidates, timeout, executor)
+        sql, vote_stats = vote(candidates, executions)
+        execution_seconds = time.perf_counter() - start_time
+        sqls.append(sql)
+        stats.append({"passes": 1, "seconds": generate_seconds + execution_seconds, "execution_seconds": execution_seconds, **vote_stats})
+    return sqls, stats
+
+# 估算开销时一条样本生成部分的开销，折算成 prompt 的字符数
+SHARD_SAMPLE_COST = 2000
+
+def shard_samples(data: list[dict], dbs, num_shards: int) -> list[list[dict]]:
+    """
+    把样本确定性地分成 num_shards 份，同样的输入每次分得都一样，各个 worker 自己算也能对上
+    同一个库的样本尽量分在一起（前缀 KV 缓存、schema linking 缓存都按库复用），每份的开销尽量接近
+    开销按 prompt 长度估算：库的 DDL 长度 + 问题长度 + SHARD_SAMPLE_COST
+    """
+    ddl_lengths = {}
+    groups = {}
+    for index, sample in enumerate(data):
+        db_id = sample["db_id"]
+        if db_id not in ddl_lengths:
+            ddl_lengths[db_id] = sum(len(ddl) for ddl in dbs[db_id].ddls())
+        groups.setdefault(db_id, []).append((index, ddl_lengths[db_id] + len(sample["question"]) + SHARD_SAMPLE_COST))
+
+    # 比平均一份还大的库切成几块，每块不超过平均一份
+    total = sum(cost for group in groups.values() for _, cost in group)
+    limit = total / num_shards
+    chunks = []
+    for db_id, group in groups.items():
+        chunk, chunk_cost = [], 0
+        for index, cost in group:
+            if chunk and chunk_cost + cost > limit:
+                chunks.append((chunk_cost, db_id, chunk))
+                chunk, chunk_cost = [], 0
+            chunk.append(index)
+            chunk_cost += cost
+        chunks.append((chunk_cost, db_id, chunk))
+
+    # 开销大的块先分，每次分给当前开销最小的那份
+    loads = [0] * num_shards
+    shards = [[] for _ in range(num_shards)]
+    for chunk_cost, db_id, chunk in sorted(chunks, key=lambda x: (-x[0], x[1], x[2][0])):
+        target = min(range(num_shards), key=lambda i: (loads[i], i))
+        loads[target] += chunk_cost
+        shards[target].extend(chunk)
+
+    return [[data[index] for index in sorted(shard)] for shard in shards]
+
+def save_results(path: str, data: list[dict], results: dict[str, dict]):
+    # 只写已经推理完的样本，顺序和 data 一致
+    output = [results[sample["sample_id"]] for sample in data if sample["sample_id"] in results]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(output, f, ensure_ascii=False, indent=4)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--dataset-type", dest="dataset_type", type=str, required=True)
@@ -89,17 +305,48 @@ if __name__ == "__main__":
     parser.add_argument("--db-name", dest="db_name", type=str, required=False, nargs="*")
     parser.add_argument("--reference-datasets-prefix", dest="reference_datasets_prefix", type=str, required=True)
     parser.add_argument("--reference-shot", dest="reference_shot", type=int, required=True)
+    parser.add_argument("--pool-nprobe", dest="pool_nprobe", type=int, default=8)
+    parser.add_argument("--pool-exact-below", dest="pool_exact_below", type=int, default=4096)
     parser.add_argument("--sl", dest="sl", action="store_true", default=False)
+    parser.add_argument("--sl-method", dest="sl_method", type=str, choices=["llm", "embedding"], default="llm")
+    parser.add_argument("--sl-top-tables", dest="sl_top_tables", type=int, default=3)
+    parser.add_argument("--sl-cache", dest="sl_cache", type=str, required=False)
+    parser.add_argument("--sl-batch-size", dest="sl_batch_size", type=int, default=8)
     parser.add_argument("--base-model", dest="base_model", type=str, required=True)
     parser.add_argument("--base-peft", dest="base_peft", type=str, required=False)
     parser.add_argument("--sl-model", dest="sl_model", type=str, required=False)
     parser.add_argument("--bge-model", dest="bge_model", type=str, required=True)
     parser.add_argument("--output-result", dest="output_result", type=str, required=True)
     parser.add_argument("--save-interval", dest="save_interval", type=int, default=10)
+    parser.add_argument("--resume", dest="resume", action="store_true", default=False)
+    parser.add_argument("--seed", dest="seed", type=int, default=42)
+    # 多个 worker 时只跑第 shard_index 份，分法见 shard_samples，由 launch.py 传入
+    parser.add_argument("--num-shards", dest="num_shards", type=int, default=1)
+    parser.add_argument("--shard-index", dest="shard_index", type=int, default=0)
+    parser.add_argument("--batch-size", dest="batch_size", type=int, default=1)
+    parser.add_argument("--prefix-cache", dest="prefix_cache", action="store_true", default=False)
+    # SQL 写完就停止生成，默认不提前停，auto 用模板开头声明的方式
+    parser.add_argument("--stop-mode", dest="stop_mode", type=str, choices=["auto"] + STOP_MODES, default="none")
+    # beam: 全部用 beam search；greedy-first: 先贪心，检查不通过的再用 --escalation 的方式重新生成
+    # vote: 采样 --vote-samples 个候选，按执行结果投票
+    parser.add_argument("--decoding", dest="decoding", type=str, choices=["beam", "greedy-first", "vote"], default="beam")
+    parser.add_argument("--num-beams", dest="num_beams", type=int, default=5)
+    parser.add_argument("--escalation", dest="escalation", type=str, choices=["beam", "sample"], default="beam")
+    parser.add_argument("--escalation-samples", dest="escalation_samples", type=int, default=4)
+    parser.add_argument("--sample-temperature", dest="sample_temperature", type=float, default=0.8)
+    parser.add_argument("--vote-samples", dest="vote_samples", type=int, default=8)
+    parser.add_argument("--vote-workers", dest="vote_workers", type=int, default=4, help="threads executing the candidates of a sample")
+    parser.add_argument("--vote-timeout", dest="vote_timeout", type=float, default=10.0, help="seconds per candidate execution")
+    parser.add_argument("--db-dir", dest="db_dir", type=str, required=False, help="{db_dir}/{db_id}/{db_id}.sqlite, needed by --decoding greedy-first and vote")
+    parser.add_argument("--check-mode", dest="check_mode", type=str, choices=CHECK_MODES, default="explain")
+    parser.add_argument("--check-timeout", dest="check_timeout", type=float, default=1.0)
+    parser.add_argument("--embedding-batch-size", dest="embedding_batch_size", type=int, default=64)
     parser.add_argument("--preview-prompt", dest="preview_prompt", action="store_true", default=False)
     parser.add_argument("--begin", dest="begin", type=int, required=False, default=0)
     parser.add_argument("--end", dest="end", type=int, required=False, default=-1)
     args = parser.parse_args()
+    if args.decoding != "beam" and args.db_dir is None:
+        parser.error(f"--decoding {args.decoding} needs --db-dir")
 
     ####################################
     # 以下是针对不同模板、模型需要修改的部分
@@ -124,7 +371,7 @@ if __name__ == "__main__":
         base_model = Qwen(args.base_model, "base-model")
 
     # SL LLM
-    if args.sl and args.sl_model is not None:
+    if args.sl and args.sl_method == "llm" and args.sl_model is not None:
         # sl_model = GLM4(args.sl_model, "sl-model")
         sl_model = GLM4(args.sl_model, "sl-model", int4=True)
         # sl_model = Llama(args.sl_model, "sl-model")
@@ -138,13 +385,22 @@ if __name__ == "__main__":
     bge_model = AutoModel.from_pretrained(args.bge_model)
     bge_model.eval()
 
+    sl_linker = None
+    if args.sl and args.sl_method == "embedding":
+        sl_linker = EmbeddingSchemaLinker(bge_tokenizer, bge_model, top_tables=args.sl_top_tables)
+
     # 读数据
     with open(args.test_set, 'r') as f:
         data = json.load(f)
+    for index, sample in enumerate(data):
+        sample["sample_id"] = get_sample_id(sample, index, args.dataset_type)
     with open(input_template_file, "r") as f:
-        input_template = Template(f.read())
+        input_template_source = f.read()
+        input_template = Template(input_template_source)
+    stop_mode = template_stop_mode(input_template_source) if args.stop_mode == "auto" else args.stop_mode
     with open(schema_linking_input_template_file, "r") as f:
-        schema_linking_input_template = Template(f.read())
+        schema_linking_input_template_source = f.read()
+        schema_linking_input_template = Template(schema_linking_input_template_source)
 
     # 筛选出 db_name 对应的数据
     if args.db_name is not None:
@@ -153,94 +409,123 @@ if __name__ == "__main__":
     data = data[args.begin:args.end]
 
     # 读取数据库 schema 信息
-    with open(args.table, "r") as f:
-        table = json.load(f)
+    catalog = load_catalog(args.table)
+
+    if args.num_shards > 1:
+        data = shard_samples(data, catalog, args.num_shards)[args.shard_index]
+
+    # 打乱用固定的种子，中断后 --resume 重跑时顺序不变
+    random.Random(args.seed).shuffle(data)
 
-    dbs = {}
-    for db in table:
-        dbs[db["db_id"]] = build_db_from_spider(db)
+    # 结果每条追加写到 {output_result}.jsonl，--resume 时跳过里面已经有的样本
+    writer = ResultWriter(args.output_result + ".jsonl", resume=args.resume)
+    all_data = data
+    data = [sample for sample in all_data if sample["sample_id"] not in writer]
+    if args.resume:
+        print(f"Resume: {len(all_data) - len(data)} finished, {len(data)} left")
 
     used_dbs = set()
     for sample in data:
         used_dbs.add(sample["db_id"])
 
-    dbs = {k: v for k, v in dbs.items() if k in used_dbs}
-
-    ref_datasets = {}
-
-    for db in dbs.values():
-        ref_path = args.reference_datasets_prefix + "_" + db.name
-        ref_datasets[db.name] = datasets.Dataset.load_from_disk(ref_path)
-        ref_datasets[db.name].add_faiss_index(column='embeddings')
+    # 只反序列化用到的库
+    dbs = {k: catalog[k] for k in catalog if k in used_dbs}
 
+    # build_pool.py 保存的索引直接 mmap 打开，不再每次启动重建
+    # 全局池只打开一个索引，所有库共用；老格式按库读 {prefix}_{db_id}
+    ref_datasets = load_reference_pools(args.reference_datasets_prefix, list(dbs.keys()), nprobe=args.pool_nprobe, exact_below=args.pool_exact_below)
 
-    output = []
 
-    random.shuffle(data)
+    # 一次算好所有问题的 BGE embeddings，第 i 行对应 data[i]
+    all_question_embeddings = encode_texts(bge_tokenizer, bge_model, [sample["question"] for sample in data], batch_size=args.embedding_batch_size)
 
-    with tqdm(data) as bar:
+    # LLM schema linking 按库分组批量做，结果查缓存，第 i 个对应 data[i]
+    all_linked_tables = [None] * len(data)
+    if args.sl and sl_linker is None:
+        sl_cache = SchemaLinkingCache(args.sl_cache, sl_model.model_path, schema_linking_input_template_source) if args.sl_cache is not None else None
+        by_db = {}
         for index, sample in enumerate(data):
-            db = dbs[sample["db_id"]]
-            question = sample["question"]
-            # 参考 SQL，标准答案
-            if args.dataset_type == "bird":
-                reference_sql = sample["SQL"] # For BIRD
+            by_db.setdefault(sample["db_id"], []).append(index)
+        for db_id, indexes in tqdm(by_db.items(), desc="Schema Linking"):
+            results = schema_linking_batch([data[i]["question"] for i in indexes], dbs[db_id], sl_model, schema_linking_input_template, sl_cache, args.sl_batch_size)
+            for i, result in zip(indexes, results):
+                all_linked_tables[i] = result
+        if sl_cache is not None:
+            print(f"Schema linking cache hits: {sl_cache.hits}, misses: {sl_cache.misses}")
+            sl_cache.close()
+
+    # 先把所有样本的 prompt 拼好，LLM 推理再分批做
+    prompts = []
+    for index, sample in enumerate(tqdm(data, desc="Prompt")):
+        db = dbs[sample["db_id"]]
+        question = sample["question"]
+
+        prompt = generate_prompt(
+            db=db,
+            question=question,
+            question_embeddings=all_question_embeddings[index],
+            reference_shot=args.reference_shot,
+            reference_datasets_dict=ref_datasets,
+            sl=args.sl,
+            sl_model=sl_model,
+            sl_template=schema_linking_input_template,
+            input_template=input_template,
+            sl_linker=sl_linker,
+            linked_tables=all_linked_tables[index]
+        )
+
+        if args.preview_prompt:
+            print(prompt)
+
+        prompts.append(prompt)
+
+    # --prefix-cache 时按库分组调度，同一个库的 DDL/外键前缀只 prefill 一次；结果按 data 原来的顺序写回
+    batches = schedule_batches(data, prompts, args.batch_size, args.prefix_cache)
+
+    checker = SQLChecker(args.db_dir, args.check_mode, args.check_timeout) if args.decoding == "greedy-first" else None
+    executor = ThreadPoolExecutor(args.vote_workers) if args.decoding == "vote" and args.vote_workers > 1 else None
+    all_stats = []
+    with tqdm(total=len(data)) as bar:
+        for batch_index, (batch, prefix) in enumerate(batches):
+            batch_prompts = [prompts[i] for i in batch]
+            if checker is not None:
+                sqls, stats = decode_greedy_first(
+                    base_model, batch_prompts, prefix, [data[i]["db_id"] for i in batch], checker,
+                    escalation=args.escalation, num_beams=args.num_beams, samples=args.escalation_samples, temperature=args.sample_temperature, stop_mode=stop_mode
+                )
+            elif args.decoding == "vote":
+                sqls, stats = decode_vote(
+                    base_model, batch_prompts, prefix, [data[i]["db_id"] for i in batch], args.db_dir, executor,
+                    samples=args.vote_samples, temperature=args.sample_temperature, timeout=args.vote_timeout, stop_mode=stop_mode
+                )
             else:
-                reference_sql = sample["query"] # For Spider
-
-            # 计算问题的 BGE embeddings
-            with torch.no_grad():
-                inputs = bge_tokenizer(question, return_tensors="pt", padding=True, truncation=True)
-                outputs = bge_model(**inputs)
-                question_embeddings = outputs[0][:, 0][0].cpu().numpy()
-
-            prompt = generate_prompt(
-                db=db,
-                question=question,
-                question_embeddings=question_embeddings,
-                reference_shot=args.reference_shot,
-                reference_datasets_dict=ref_datasets,
-                sl=args.sl,
-                sl_model=sl_model,
-                sl_template=schema_linking_input_template,
-                input_template=input_template
-            )
-
-            if args.preview_prompt:
-                print(prompt)
-            
-            answer = base_model.infer(prompt, system_prompt=None, max_new_tokens=512, do_sample=False, num_beams=5, top_p=None, top_k=None, temperature=None)
-            generated_sql = flatten_sql(extract_sql(answer))
-
-            if args.dataset_type == "bird":
-                res = {
-                    "sample_id": "bird_" + str(sample["question_id"]), # For BIRD
-                    "difficulty": sample["difficulty"], # For BIRD
-                    "db_id": sample["db_id"],
-                    "question": question,
-                    "reference": reference_sql,
-                    "generated": generated_sql
-                }
-            else:
-                res = {
-                    "db_id": sample["db_id"],
-                    "question": question,
-                    "reference": reference_sql,
-                    "generated": generated_sql
-                }
-
-            output.append(res)
-            bar.update(1)
-
-            if index % args.save_interval == 0:
-                with open(args.output_result, "w", encoding="utf-8") as f:
-                    json.dump(output, f, ensure_ascii=False, indent=4)
-
-    with open(args.output_result, "w", encoding="utf-8") as f:
-        json.dump(output, f, ensure_ascii=False, indent=4)
-
-
-
-
-        
-
+                sqls, stats = decode_beam(base_model, batch_prompts, prefix, num_beams=args.num_beams, stop_mode=stop_mode)
+            for i, sql, stat in zip(batch, sqls, stats):
+                writer.write(build_result(data[i], sql, args.dataset_type, stat))
+            all_stats.extend(stats)
+            # 每批都 flush，每 save_interval 批落一次盘
+            writer.flush(sync=batch_index % args.save_interval == 0)
+            bar.update(len(batch))
+
+    writer.close()
+    if checker is not None:
+        checker.close()
+    if executor is not None:
+        executor.shutdown()
+    # 全部完成后按 data 的顺序写一次完整的 JSON，validate.py 读的是这个
+    save_results(args.output_result, all_data, writer.results)
+
+    prefix_cache = getattr(base_model, "prefix_cache", None)
+    if args.prefix_cache and prefix_cache is not None:
+        print(f"Prefix cache hits: {prefix_cache.hits}, misses: {prefix_cache.misses}, reused prefill tokens: {prefix_cache.reused_tokens}")
+
+    if all_stats:
+        total_seconds = sum(stat["seconds"] for stat in all_stats)
+        print(f"Decoding ({args.decoding}): {len(all_stats)} samples, {total_seconds / len(all_stats):.2f}s per sample")
+        if args.decoding == "greedy-first":
+            escalated = [stat for stat in all_stats if stat["escalated"]]
+            escalation_seconds = sum(stat["escalation_seconds"] for stat in all_stats)
+            print(f"Escalated: {len(escalated)} ({len(escalated) / len(all_stats):.1%}), escalation time: {escalation_seconds:.1f}s of {total_seconds:.1f}s, decode passes: {sum(stat['passes'] for stat in all_stats)}")
+        elif args.decoding == "vote":
+            execution_seconds = sum(stat["execution_seconds"] for stat in all_stats)
+            print(f"Distinct candidates: {np.mean([stat['distinct'] for stat in all_stats]):.2f}, executable: {np.mean([stat['executed'] for stat in all_stats]):.2f}, winning votes: {np.mean([stat['votes'] for stat in all_stats]):.2f} of {args.vote_samples}, execution time: {execution_seconds:.1f}s of {total_seconds:.1f}s")
@@ -0,0 +1,97 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from tqdm import tqdm
+
+from catalog import load_catalog
+from results import get_sample_id, read_results
+
+def count_lines(path: str) -> int:
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb") as f:
+        return sum(chunk.count(b"\n") for chunk in iter(lambda: f.read(1 << 20), b""))
+
+if __name__ == "__main__":
+    # 其余参数原样传给每个 infer.py worker
+    parser = argparse.ArgumentParser(description="Run infer.py in several worker processes and merge their results")
+    parser.add_argument("--workers", dest="workers", type=int, required=True)
+    parser.add_argument("--devices", dest="devices", type=str, nargs="*", help="CUDA_VISIBLE_DEVICES of each worker, e.g. 0 1 or 0,1 2,3; reused round robin")
+    parser.add_argument("--threads", dest="threads", type=int, required=False, help="CPU threads of each worker")
+    parser.add_argument("--shard-dir", dest="shard_dir", type=str, required=False, help="default: {output-result}.shards")
+    parser.add_argument("--poll-interval", dest="poll_interval", type=float, default=5)
+    # 下面这些 launch.py 自己也要用，同时也会传给 worker
+    parser.add_argument("--dataset-type", dest="dataset_type", type=str, required=True)
+    parser.add_argument("--test-set", dest="test_set", type=str, required=True)
+    parser.add_argument("--table", dest="table", type=str, required=True)
+    parser.add_argument("--output-result", dest="output_result", type=str, required=True)
+    parser.add_argument("--db-name", dest="db_name", type=str, required=False, nargs="*")
+    parser.add_argument("--begin", dest="begin", type=int, required=False, default=0)
+    parser.add_argument("--end", dest="end", type=int, required=False, default=-1)
+    args, infer_args = parser.parse_known_args()
+
+    shard_dir = args.shard_dir if args.shard_dir is not None else args.output_result + ".shards"
+    os.makedirs(shard_dir, exist_ok=True)
+
+    # 和 infer.py 一样筛选，只用来算总数和最后合并的顺序
+    with open(args.test_set, "r") as f:
+        data = json.load(f)
+    selected = [get_sample_id(sample, index, args.dataset_type) for index, sample in enumerate(data) if args.db_name is None or sample["db_id"] in args.db_name]
+    selected = selected[args.begin:args.end]
+
+    # 先编译好 catalog，免得每个 worker 同时编译一遍
+    load_catalog(args.table).close()
+
+    common_args = ["--dataset-type", args.dataset_type, "--test-set", args.test_set, "--table", args.table, "--begin", str(args.begin), "--end", str(args.end)]
+    if args.db_name is not None:
+        common_args += ["--db-name", *args.db_name]
+
+    workers = []
+    for shard_index in range(args.workers):
+        env = dict(os.environ)
+        if args.devices:
+            env["CUDA_VISIBLE_DEVICES"] = args.devices[shard_index % len(args.devices)]
+        if args.threads is not None:
+            env["OMP_NUM_THREADS"] = str(args.threads)
+            env["MKL_NUM_THREADS"] = str(args.threads)
+            # tokenizers 自己的线程池不受 OMP_NUM_THREADS 限制，关掉
+            env["TOKENIZERS_PARALLELISM"] = "false"
+        shard_output = os.path.join(shard_dir, f"shard_{shard_index}.json")
+        command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "infer.py"), *common_args, *infer_args,
+                   "--output-result", shard_output, "--num-shards", str(args.workers), "--shard-index", str(shard_index)]
+        # worker 的输出写到各自的 log 里，进度条不会互相打乱
+        log = open(os.path.join(shard_dir, f"shard_{shard_index}.log"), "a")
+        workers.append((subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT), shard_output, log))
+        print(f"Shard {shard_index}: pid {workers[-1][0].pid}, device {env.get('CUDA_VISIBLE_DEVICES', '-')}, log {log.name}")
+
+    # 汇总各个 worker 的 JSONL 行数作为总进度
+    with tqdm(total=len(selected)) as bar:
+        while True:
+            running = [worker for worker, _, _ in workers if worker.poll() is None]
+            done = sum(count_lines(shard_output + ".jsonl") for _, shard_output, _ in workers)
+            bar.update(min(done, bar.total) - bar.n)
+            if len(running) == 0:
+                break
+            time.sleep(args.poll_interval)
+
+    failed = []
+    for shard_index, (worker, _, log) in enumerate(workers):
+        log.close()
+        if worker.returncode != 0:
+            failed.append(shard_index)
+
+    # 按测试集里的顺序合并，没推理完的样本不写
+    results = {}
+    for _, shard_output, _ in workers:
+        results.update(read_results(shard_output + ".jsonl"))
+    output = [results[sample_id] for sample_id in selected if sample_id in results]
+    with open(args.output_result, "w", encoding="utf-8") as f:
+        json.dump(output, f, ensure_ascii=False, indent=4)
+    print(f"Merged {len(output)} / {len(selected)} results into {args.output_result}")
+
+    if failed:
+        print(f"Shards {failed} failed, see their logs; rerun the same command with --resume to finish them")
+        exit(1)
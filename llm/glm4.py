@@ -1,5 +1,7 @@
 import torch
 from .llm import LLM
+from .stopping import apply_stop_mode
+from .prefix_cache import PrefixKVCache, find_chat_prefix, generate_with_prefix
 from transformers import AutoTokenizer, AutoModelForCausalLM
 from peft import PeftModelForCausalLM # type: ignore
 
@@ -10,6 +12,8 @@ class GLM4(LLM):
         
         # 加载 LLM
         self.tokenizer = AutoTokenizer.from_pretrained(path, device_map="cuda")
+        # 批量推理时左边补齐
+        self.tokenizer.padding_side = "left"
 
         if int4:
             self.model = AutoModelForCausalLM.from_pretrained(path, device_map="cuda", load_in_4bit=True)
@@ -24,6 +28,19 @@ class GLM4(LLM):
             )
         
         self.model = self.model.eval()
+        self.prefix_cache = PrefixKVCache()
+
+    def _chat_text(self, input_text, system_prompt) -> str:
+        if system_prompt is None:
+            messages = [
+                {"role": "user", "content": input_text}
+            ]
+        else:
+            messages = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": input_text}
+            ]
+        return self.tokenizer.apply_chat_template(messages, add_generation_prompt=True, tokenize=False)
 
     def infer(self, input_text, system_prompt, **kwargs) -> str:
         if system_prompt is None:
@@ -48,14 +65,42 @@ class GLM4(LLM):
         generate_kwargs = {
             "input_ids": inputs['input_ids'],
             "attention_mask": inputs['attention_mask'],
-            **kwargs
+            **apply_stop_mode(self.tokenizer, kwargs)
         }
 
         out = self.model.generate(**generate_kwargs)
         answer = self.tokenizer.decode(out[0][input_len:], skip_special_tokens=True)
         return answer
+
+    def infer_batch(self, input_texts, system_prompt=None, **kwargs) -> list[str]:
+        texts = [self._chat_text(input_text, system_prompt) for input_text in input_texts]
+        # 对话模板里已经有 [gMASK]<sop> 了，不要再加特殊 token
+        inputs = self.tokenizer(texts, return_tensors="pt", padding=True, add_special_tokens=False).to(self.model.device) # type: ignore
+
+        input_len = inputs['input_ids'].shape[1] # type: ignore
+
+        generate_kwargs = {
+            "input_ids": inputs['input_ids'],
+            "attention_mask": inputs['attention_mask'],
+            **apply_stop_mode(self.tokenizer, kwargs)
+        }
+
+        out = self.model.generate(**generate_kwargs)
+        # num_return_sequences 大于 1 时每条输入的候选挨在一起
+        return [self.tokenizer.decode(out[i][input_len:], skip_special_tokens=True) for i in range(out.shape[0])]
+    
+    def infer_batch_with_prefix(self, prefix, input_texts, system_prompt=None, **kwargs) -> list[str]:
+        texts = [self._chat_text(input_text, system_prompt) for input_text in input_texts]
+        chat_prefix = find_chat_prefix(prefix, input_texts, texts)
+        generated_ids = None
+        if chat_prefix is not None:
+            # 和 infer_batch 一样，对话模板里已经有特殊 token 了
+            generated_ids = generate_with_prefix(self.model, self.tokenizer, self.prefix_cache, chat_prefix, texts, add_special_tokens=False, pad_token_id=self.tokenizer.pad_token_id, **apply_stop_mode(self.tokenizer, kwargs))
+        if generated_ids is None:
+            return self.infer_batch(input_texts, system_prompt, **kwargs)
+        return [self.tokenizer.decode(ids, skip_special_tokens=True) for ids in generated_ids]
     
-    def infer_multiple(self, messages, n, **kwargs) -> str:
+    def infer_multiple(self, messages, n, **kwargs) -> list[str]:
         inputs = self.tokenizer.apply_chat_template(
             messages,
             add_generation_prompt=True,
@@ -70,9 +115,17 @@ class GLM4(LLM):
             "input_ids": inputs['input_ids'],
             "attention_mask": inputs['attention_mask'],
             "num_return_sequences": n,
-            **kwargs
+            **apply_stop_mode(self.tokenizer, kwargs)
         }
 
         out = self.model.generate(**generate_kwargs)
         answer = [self.tokenizer.decode(out[i][input_len:], skip_special_tokens=True) for i in range(n)]
         return answer
+
+    def infer_batch_multiple(self, input_texts, n, system_prompt=None, **kwargs) -> list[list[str]]:
+        answers = self.infer_batch(input_texts, system_prompt, num_return_sequences=n, **kwargs)
+        return [answers[i * n:(i + 1) * n] for i in range(len(input_texts))]
+
+    def infer_batch_multiple_with_prefix(self, prefix, input_texts, n, system_prompt=None, **kwargs) -> list[list[str]]:
+        answers = self.infer_batch_with_prefix(prefix, input_texts, system_prompt, num_return_sequences=n, **kwargs)
+        return [answers[i * n:(i + 1) * n] for i in range(len(input_texts))]
@@ -1,5 +1,6 @@
 import torch
 from .llm import LLM
+from .stopping import apply_stop_mode
 from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
 
 
@@ -15,6 +16,10 @@ class Llama(LLM):
             model_kwargs={"torch_dtype": torch.bfloat16},
             device="cuda",
         )
+        # 批量推理时左边补齐，Llama 没有 pad token，用 eos 代替
+        self.pipe.tokenizer.padding_side = "left"
+        if self.pipe.tokenizer.pad_token is None:
+            self.pipe.tokenizer.pad_token = self.pipe.tokenizer.eos_token
 
     def infer(self, input_text: str, system_prompt: str | None = None, **kwargs) -> str:
         if system_prompt is None:
@@ -27,10 +32,33 @@ class Llama(LLM):
                 {"role": "user", "content": input_text}
             ]
         answer = self.pipe(messages,
-                           num_return_sequences=1, pad_token_id=self.pipe.tokenizer.eos_token_id, **kwargs)[0]["generated_text"][-1]["content"] # type: ignore
+                           num_return_sequences=1, pad_token_id=self.pipe.tokenizer.eos_token_id, **apply_stop_mode(self.pipe.tokenizer, kwargs))[0]["generated_text"][-1]["content"] # type: ignore
         return answer # type: ignore
     
-    def infer_multiple(self, messages, n, **kwargs) -> str:
-        answer = [self.pipe(messages,
-                           num_return_sequences=n, pad_token_id=self.pipe.tokenizer.eos_token_id, **kwargs)[i]["generated_text"][-1]["content"] for i in range(n)] #type: ignore
-        return answer # type: ignore
\ No newline at end of file
+    def infer_multiple(self, messages, n, **kwargs) -> list[str]:
+        # 只调用一次 pipe，一次 generate 生成 n 个候选
+        outputs = self.pipe(messages,
+                            num_return_sequences=n, pad_token_id=self.pipe.tokenizer.eos_token_id, **apply_stop_mode(self.pipe.tokenizer, kwargs))
+        return [output["generated_text"][-1]["content"] for output in outputs] # type: ignore
+
+    def infer_batch(self, input_texts: list[str], system_prompt: str | None = None, **kwargs) -> list[str]:
+        batch = []
+        for input_text in input_texts:
+            if system_prompt is None:
+                batch.append([{"role": "user", "content": input_text}])
+            else:
+                batch.append([{"role": "system", "content": system_prompt}, {"role": "user", "content": input_text}])
+        outputs = self.pipe(batch, batch_size=len(batch),
+                            num_return_sequences=1, pad_token_id=self.pipe.tokenizer.eos_token_id, **apply_stop_mode(self.pipe.tokenizer, kwargs))
+        return [output[0]["generated_text"][-1]["content"] for output in outputs] # type: ignore
+
+    def infer_batch_multiple(self, input_texts: list[str], n: int, system_prompt: str | None = None, **kwargs) -> list[list[str]]:
+        batch = []
+        for input_text in input_texts:
+            if system_prompt is None:
+                batch.append([{"role": "user", "content": input_text}])
+            else:
+                batch.append([{"role": "system", "content": system_prompt}, {"role": "user", "content": input_text}])
+        outputs = self.pipe(batch, batch_size=len(batch),
+                            num_return_sequences=n, pad_token_id=self.pipe.tokenizer.eos_token_id, **apply_stop_mode(self.pipe.tokenizer, kwargs))
+        return [[candidate["generated_text"][-1]["content"] for candidate in output] for output in outputs] # type: ignore
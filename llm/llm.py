@@ -9,6 +9,39 @@ class LLM(ABC):
 
     def infer(self, input_text: str, system_prompt: str | None = None, **kwargs) -> str:
         return NotImplemented
+
+    def infer_batch(self, input_texts: list[str], system_prompt: str | None = None, **kwargs) -> list[str]:
+        """
+        一次推理多条输入，返回顺序和输入一致，没有实现批量的模型逐条调用 infer
+        """
+        return [self.infer(input_text, system_prompt, **kwargs) for input_text in input_texts]
+
+    def infer_batch_with_prefix(self, prefix: str, input_texts: list[str], system_prompt: str | None = None, **kwargs) -> list[str]:
+        """
+        input_texts 都以 prefix 开头，支持的模型复用 prefix 的 past key/values，其余的直接走 infer_batch
+        """
+        return self.infer_batch(input_texts, system_prompt, **kwargs)
+
+    def infer_multiple(self, messages: list[dict], n: int, **kwargs) -> list[str]:
+        return NotImplemented
+
+    def infer_batch_multiple(self, input_texts: list[str], n: int, system_prompt: str | None = None, **kwargs) -> list[list[str]]:
+        """
+        每条输入生成 n 个候选，返回 [[第 i 条输入的 n 个候选]]，没有实现批量的模型逐条调用 infer_multiple
+        """
+        results = []
+        for input_text in input_texts:
+            messages = [{"role": "user", "content": input_text}]
+            if system_prompt is not None:
+                messages.insert(0, {"role": "system", "content": system_prompt})
+            results.append(self.infer_multiple(messages, n, **kwargs))
+        return results
+
+    def infer_batch_multiple_with_prefix(self, prefix: str, input_texts: list[str], n: int, system_prompt: str | None = None, **kwargs) -> list[list[str]]:
+        """
+        同 infer_batch_with_prefix，每条输入生成 n 个候选
+        """
+        return self.infer_batch_multiple(input_texts, n, system_prompt, **kwargs)
     
 
 llm_instance: LLM | None = None
@@ -0,0 +1,105 @@
+import copy
+from collections import OrderedDict
+
+import torch
+from transformers import DynamicCache
+
+
+def _common_length(a: list[int], b: list[int]) -> int:
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
+
+class PrefixKVCache(object):
+    """
+    共享 prompt 前缀的 past key/values 缓存，同一个库的 prompt 都以相同的 DDL/外键开头
+    key 是前缀文本，只保留最近用到的 capacity 个，样本按库分组调度时 1 个就够
+    """
+    def __init__(self, capacity: int = 1):
+        self.capacity = capacity
+        self.entries = OrderedDict() # {前缀文本: (token ids, DynamicCache)}
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0 # 省掉的 prefill token 数
+
+    def get(self, model, tokenizer, prefix_text: str, add_special_tokens: bool = True) -> tuple[list[int], DynamicCache]:
+        if prefix_text in self.entries:
+            self.entries.move_to_end(prefix_text)
+            self.hits += 1
+            return self.entries[prefix_text]
+
+        self.misses += 1
+        # 最后一个 token 和后面的文本拼起来可能被切成别的 token，不放进缓存
+        prefix_ids = tokenizer(prefix_text, add_special_tokens=add_special_tokens)["input_ids"][:-1]
+        past_key_values = DynamicCache()
+        if len(prefix_ids) > 0:
+            with torch.no_grad():
+                past_key_values = model(torch.tensor([prefix_ids], device=model.device), past_key_values=past_key_values, use_cache=True).past_key_values
+        self.entries[prefix_text] = (prefix_ids, past_key_values)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        return self.entries[prefix_text]
+
+    def clear(self):
+        self.entries.clear()
+
+
+def find_chat_prefix(prefix: str, input_texts: list[str], texts: list[str]) -> str | None:
+    """
+    texts 是 input_texts 套上对话模板后的文本，返回 prefix 在对话文本里对应的前缀
+    所有 texts 不共有这个前缀时返回 None
+    """
+    begin = texts[0].find(input_texts[0])
+    if begin < 0:
+        return None
+    chat_prefix = texts[0][:begin + len(prefix)]
+    if not all(text.startswith(chat_prefix) for text in texts):
+        return None
+    return chat_prefix
+
+
+def generate_with_prefix(model, tokenizer, cache: PrefixKVCache, prefix_text: str, texts: list[str], add_special_tokens: bool = True, **kwargs) -> list[list[int]] | None:
+    """
+    texts 都以 prefix_text 开头，前缀部分复用缓存的 past key/values，只对剩下的部分做 prefill
+    剩下的部分长度不同时，pad 补在前缀和剩下的部分之间，attention mask 置 0
+    返回每条（num_return_sequences 大于 1 时每个候选）新生成的 token ids，前缀对不上时返回 None
+    """
+    all_ids = [tokenizer(text, add_special_tokens=add_special_tokens)["input_ids"] for text in texts]
+    prefix_ids, prefix_past = cache.get(model, tokenizer, prefix_text, add_special_tokens)
+
+    # 每条至少要留一个 token 给 generate
+    length = min(min(_common_length(prefix_ids, ids), len(ids) - 1) for ids in all_ids)
+    if length <= 0:
+        return None
+    cache.reused_tokens += length * len(texts)
+
+    suffixes = [ids[length:] for ids in all_ids]
+    max_suffix = max(len(suffix) for suffix in suffixes)
+    input_ids = []
+    attention_mask = []
+    for suffix in suffixes:
+        pad = max_suffix - len(suffix)
+        input_ids.append(prefix_ids[:length] + [tokenizer.pad_token_id] * pad + suffix)
+        attention_mask.append([1] * length + [0] * pad + [1] * len(suffix))
+
+    # generate 会往 cache 里追加，要用拷贝；它不会替传进来的 cache 按 beam 或候选数扩展，要先扩好
+    past_key_values = copy.deepcopy(prefix_past)
+    if length < len(prefix_ids):
+        past_key_values.crop(length)
+    expand = kwargs.get("num_beams") or 1
+    if expand == 1:
+        expand = kwargs.get("num_return_sequences") or 1
+    if len(texts) * expand > 1:
+        past_key_values.batch_repeat_interleave(len(texts) * expand)
+
+    input_ids = torch.tensor(input_ids, device=model.device)
+    generated_ids = model.generate(
+        input_ids=input_ids,
+        attention_mask=torch.tensor(attention_mask, device=model.device),
+        past_key_values=past_key_values,
+        **kwargs
+    )
+    return generated_ids[:, input_ids.shape[1]:].tolist()
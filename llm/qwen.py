@@ -1,4 +1,6 @@
 from .llm import LLM
+from .stopping import apply_stop_mode
+from .prefix_cache import PrefixKVCache, find_chat_prefix, generate_with_prefix
 from transformers import AutoModelForCausalLM, AutoTokenizer
 
 class Qwen(LLM):
@@ -12,9 +14,13 @@ class Qwen(LLM):
         )
 
         self.tokenizer = AutoTokenizer.from_pretrained(path)
+        # 批量推理时左边补齐，生成的部分才能对齐在右边
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.prefix_cache = PrefixKVCache()
 
-
-    def infer(self, input_text, system_prompt, **kwargs) -> str:
+    def _chat_text(self, input_text, system_prompt) -> str:
         if system_prompt is None:
             msgs = [
                 {"role": "user", "content": input_text}
@@ -24,19 +30,66 @@ class Qwen(LLM):
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": input_text}
             ]
-        text = self.tokenizer.apply_chat_template(
+        return self.tokenizer.apply_chat_template(
             msgs,
             tokenize=False,
             add_generation_prompt=True
         )
+
+    def infer(self, input_text, system_prompt, **kwargs) -> str:
+        text = self._chat_text(input_text, system_prompt)
         model_inputs = self.tokenizer([text], return_tensors="pt").to(self.model.device) # type: ignore
 
         generated_ids = self.model.generate(
             **model_inputs,
-            **kwargs
+            **apply_stop_mode(self.tokenizer, kwargs)
         )
         generated_ids = [
             output_ids[len(input_ids):] for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)
         ]
         response = self.tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
         return response
+
+    def infer_batch(self, input_texts, system_prompt=None, **kwargs) -> list[str]:
+        texts = [self._chat_text(input_text, system_prompt) for input_text in input_texts]
+        model_inputs = self.tokenizer(texts, return_tensors="pt", padding=True).to(self.model.device) # type: ignore
+
+        generated_ids = self.model.generate(
+            **model_inputs,
+            pad_token_id=self.tokenizer.pad_token_id,
+            **apply_stop_mode(self.tokenizer, kwargs)
+        )
+        # 左边补齐后所有输入一样长，截掉输入部分就是生成的内容
+        generated_ids = generated_ids[:, model_inputs.input_ids.shape[1]:]
+        return self.tokenizer.batch_decode(generated_ids, skip_special_tokens=True)
+
+    def infer_batch_with_prefix(self, prefix, input_texts, system_prompt=None, **kwargs) -> list[str]:
+        texts = [self._chat_text(input_text, system_prompt) for input_text in input_texts]
+        chat_prefix = find_chat_prefix(prefix, input_texts, texts)
+        generated_ids = None
+        if chat_prefix is not None:
+            generated_ids = generate_with_prefix(self.model, self.tokenizer, self.prefix_cache, chat_prefix, texts, pad_token_id=self.tokenizer.pad_token_id, **apply_stop_mode(self.tokenizer, kwargs))
+        if generated_ids is None:
+            return self.infer_batch(input_texts, system_prompt, **kwargs)
+        return self.tokenizer.batch_decode(generated_ids, skip_special_tokens=True)
+
+    def infer_multiple(self, messages, n, **kwargs) -> list[str]:
+        text = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        model_inputs = self.tokenizer([text], return_tensors="pt").to(self.model.device) # type: ignore
+
+        generated_ids = self.model.generate(
+            **model_inputs,
+            num_return_sequences=n,
+            **apply_stop_mode(self.tokenizer, kwargs)
+        )
+        generated_ids = generated_ids[:, model_inputs.input_ids.shape[1]:]
+        return self.tokenizer.batch_decode(generated_ids, skip_special_tokens=True)
+
+    def infer_batch_multiple(self, input_texts, n, system_prompt=None, **kwargs) -> list[list[str]]:
+        # generate 返回的每条输入的 n 个候选是挨在一起的
+        answers = self.infer_batch(input_texts, system_prompt, num_return_sequences=n, **kwargs)
+        return [answers[i * n:(i + 1) * n] for i in range(len(input_texts))]
+
+    def infer_batch_multiple_with_prefix(self, prefix, input_texts, n, system_prompt=None, **kwargs) -> list[list[str]]:
+        answers = self.infer_batch_with_prefix(prefix, input_texts, system_prompt, num_return_sequences=n, **kwargs)
+        return [answers[i * n:(i + 1) * n] for i in range(len(input_texts))]
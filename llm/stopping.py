@@ -0,0 +1,95 @@
+import re
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList
+
+# none: 不提前停；block: 出现一个完整的 ```sql``` 代码块就停；
+# plain: 行首大写的 SELECT/WITH 之后引号外出现 ; 就停，回答用了代码块时等代码块结束再停
+STOP_MODES = ["none", "block", "plain"]
+
+_SQL_BLOCK = re.compile(r"```sql.*?```", re.DOTALL)
+_ANY_SQL_BLOCK = re.compile(r"```(?:sql)?\s*(?:SELECT|WITH)\b.*?```", re.DOTALL | re.IGNORECASE)
+# 区分大小写且只认行首，不然 "With the schema above" 这样的解释文字也会被当成 SQL 的开头
+_SQL_START = re.compile(r"^[ \t]*(?:SELECT|WITH)\b", re.MULTILINE)
+# 字符串字面量，没闭合的一直算到结尾，里面的 ; 不算
+_QUOTED = re.compile(r"'(?:[^']|'')*(?:'|$)|\"(?:[^\"]|\"\")*(?:\"|$)", re.DOTALL)
+
+# 每步解码新 token 时往前带上这么多个已经解码过的 token，单独解码一个 token 会丢掉开头的空格
+_DECODE_CONTEXT = 8
+
+# prompt 模板开头用 {#- stop: plain -#} 这样的注释声明提前停止的方式
+_TEMPLATE_STOP_MODE = re.compile(r"\{#-?\s*stop:\s*(\w+)")
+
+def template_stop_mode(template_source: str) -> str:
+    """
+    读模板里声明的 stop mode，没有声明就不提前停
+    """
+    match = _TEMPLATE_STOP_MODE.search(template_source)
+    return match.group(1) if match is not None else "none"
+
+def sql_complete(text: str, mode: str) -> bool:
+    """
+    按 mode 判断生成的文本里 SQL 是否已经写完
+    """
+    if mode == "block":
+        return _SQL_BLOCK.search(text) is not None
+    if mode == "plain":
+        if "```" in text:
+            return text.count("```") % 2 == 0 and _ANY_SQL_BLOCK.search(text) is not None
+        start = _SQL_START.search(text)
+        if start is None:
+            return False
+        return ";" in _QUOTED.sub("", text[start.start():])
+    return False
+
+class SQLStoppingCriteria(StoppingCriteria):
+    """
+    SQL 写完的序列就不再生成，beam search 时要所有 beam 都写完才停
+    第一次调用时 input_ids 比 prompt 多一个 token，由此得到 prompt 的长度，所以每次 generate 要新建一个
+    每行记住已经解码的文本和对应的 token 数，每步只解码新 token，不从头重新解码
+    """
+    def __init__(self, tokenizer, mode: str):
+        self.tokenizer = tokenizer
+        self.mode = mode
+        self.prompt_length = None
+        self.last_ids = None
+        self.states = [] # 每行 (已经确定的文本, 对应的生成 token 数)
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        if self.prompt_length is None:
+            self.prompt_length = input_ids.shape[1] - 1
+            states = [("", 0)] * input_ids.shape[0]
+        else:
+            # beam search 每步会重排行，按生成的 token 找到每行是接着上一步的哪一行
+            matches = (input_ids[:, None, self.prompt_length:-1] == self.last_ids[None, :, self.prompt_length:]).all(dim=-1)
+            states = [self.states[parent] for parent in matches.int().argmax(dim=1).tolist()]
+        generated_length = input_ids.shape[1] - self.prompt_length
+        contexts, tails = [], []
+        for row, (_, offset) in zip(input_ids, states):
+            context_start = max(0, offset - _DECODE_CONTEXT)
+            tail = row[self.prompt_length + context_start:].tolist()
+            contexts.append(tail[:offset - context_start])
+            tails.append(tail)
+        olds = self.tokenizer.batch_decode(contexts, skip_special_tokens=True)
+        news = self.tokenizer.batch_decode(tails, skip_special_tokens=True)
+
+        self.states, texts = [], []
+        for (text, offset), old, new in zip(states, olds, news):
+            delta = new[len(old):]
+            texts.append(text + delta)
+            # 多字节字符还没生成完时结尾是替换字符，先不记下来，下一步从这里重新解码
+            self.states.append((text, offset) if new.endswith("\ufffd") else (text + delta, generated_length))
+        self.last_ids = input_ids
+        return torch.tensor([sql_complete(text, self.mode) for text in texts], dtype=torch.bool, device=input_ids.device)
+
+def apply_stop_mode(tokenizer, kwargs: dict) -> dict:
+    """
+    把 llm 接口上的 stop_mode 参数换成 generate 用的 stopping_criteria
+    """
+    kwargs = dict(kwargs)
+    mode = kwargs.pop("stop_mode", "none")
+    if mode not in STOP_MODES:
+        raise ValueError(f"Unknown stop mode: {mode}")
+    if mode != "none":
+        kwargs["stopping_criteria"] = StoppingCriteriaList([SQLStoppingCriteria(tokenizer, mode)])
+    return kwargs
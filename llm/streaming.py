@@ -0,0 +1,39 @@
+from typing import Callable
+
+import torch
+from transformers.generation.streamers import BaseStreamer
+
+class BatchTextStreamer(BaseStreamer):
+    """
+    批量 generate 时把每一行新生成的文本增量交给对应的回调，TextStreamer 只支持一行
+    generate 第一次 put 的是输入的 token，跳过；之后每步 put 的是每一行新生成的一个 token
+    beam search 时 generate 不支持 streamer，只能用于贪心或采样
+    """
+    def __init__(self, tokenizer, callbacks: list[Callable[[str], None] | None]):
+        self.tokenizer = tokenizer
+        self.callbacks = callbacks
+        self.token_ids = [[] for _ in callbacks]
+        self.texts = [""] * len(callbacks)
+        self.skip_prompt = True
+
+    def put(self, value: torch.Tensor):
+        if self.skip_prompt:
+            self.skip_prompt = False
+            return
+        for i, token_id in enumerate(value.reshape(len(self.callbacks), -1)[:, -1].tolist()):
+            self.token_ids[i].append(token_id)
+            self._emit(i, final=False)
+
+    def end(self):
+        for i in range(len(self.callbacks)):
+            self._emit(i, final=True)
+
+    def _emit(self, i: int, final: bool):
+        text = self.tokenizer.decode(self.token_ids[i], skip_special_tokens=True)
+        # 多字节字符还没生成完时结尾是替换字符，等下一个 token 再发，生成结束时不再等
+        if (text.endswith("\ufffd") and not final) or len(text) <= len(self.texts[i]):
+            return
+        delta = text[len(self.texts[i]):]
+        self.texts[i] = text
+        if self.callbacks[i] is not None:
+            self.callbacks[i](delta)
@@ -0,0 +1,23 @@
+from .llm import LLM
+
+class StubLLM(LLM):
+    """
+    不加载模型，对任何输入都返回同一个回答，没有 GPU 和模型权重时用来跑通 server.py 之类的流程
+    calls 记录每次批量调用的输入条数，可以看出请求是怎么分批的
+    """
+    def __init__(self, answer: str = "```sql\nSELECT 1\n```", name: str = "stub"):
+        super().__init__("stub", "stub", name)
+        self.answer = answer
+        self.calls = []
+
+    def infer(self, input_text, system_prompt=None, **kwargs) -> str:
+        self.calls.append(1)
+        return self.answer
+
+    def infer_batch(self, input_texts, system_prompt=None, **kwargs) -> list[str]:
+        self.calls.append(len(input_texts))
+        return [self.answer] * len(input_texts)
+
+    def infer_multiple(self, messages, n, **kwargs) -> list[str]:
+        self.calls.append(1)
+        return [self.answer] * n
@@ -5,7 +5,7 @@ from tqdm import tqdm
 import re
 
 from llm.glm4 import GLM4
-from schema import build_db_from_spider
+from catalog import load_catalog
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--input", dest="input", type=str, required=True)
@@ -31,12 +31,7 @@ with open(args.input, 'r') as f:
     data = json.load(f)
 
 # 读取数据库 schema 信息
-with open(args.table, "r") as f:
-    table = json.load(f)
-
-dbs = {}
-for db in table:
-    dbs[db["db_id"]] = build_db_from_spider(db)
+dbs = load_catalog(args.table)
 
 output = []
 
@@ -47,7 +42,7 @@ with tqdm(data) as bar:
         db_id = sample["db_id"]
         sql = sample["sql"]
 
-        ddls = [table.to_ddl() for table in dbs[db_id].tables.values()]
+        ddls = dbs[db_id].ddls()
 
         input_text = input_template.render(
             ddls=ddls,
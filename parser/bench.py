@@ -0,0 +1,55 @@
+import argparse
+import json
+import time
+
+from parser import parse as sql_parse
+from parser.parse import GRAMMAR_MODULES, extract_select_stmt, parse_tree, set_grammar
+from parser.utils import get_children_with_type
+
+def bench(name: str, queries: list[str], parse) -> float:
+    failed = 0
+    start_time = time.perf_counter()
+    for query in queries:
+        try:
+            parse(query)
+        except Exception:
+            failed += 1
+    elapsed = time.perf_counter() - start_time
+    print(f"{name:>16}: {elapsed:.2f}s, {len(queries) / elapsed:.1f} query/s, {failed} failed")
+    return elapsed
+
+if __name__ == "__main__":
+    # python -m parser.bench --spider-json data/spider/train_spider.json
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--spider-json", dest="spider_json", type=str, nargs="+", default=["./data/spider/train_spider.json"])
+    parser.add_argument("--limit", dest="limit", type=int, default=-1)
+    parser.add_argument("--rounds", dest="rounds", type=int, default=1)
+    parser.add_argument("--grammar", dest="grammar", type=str, nargs="+", choices=list(GRAMMAR_MODULES), default=["full"])
+    args = parser.parse_args()
+
+    queries = []
+    for spider_json in args.spider_json:
+        with open(spider_json, "r") as f:
+            queries.extend([item["query"] for item in json.load(f)])
+    if args.limit != -1:
+        queries = queries[:args.limit]
+
+    print(f"Queries: {len(queries)}")
+    for grammar in args.grammar:
+        print(f"Grammar: {grammar}")
+        set_grammar(grammar)
+        for round in range(args.rounds):
+            # 第一轮包含 DFA 预热的开销，后面几轮反映热缓存下的速度
+            baseline = bench("LL + recovery", queries, lambda q: parse_tree(q, two_stage=False))
+            two_stage = bench("SLL -> LL", queries, lambda q: parse_tree(q, two_stage=True))
+            print(f"Round {round}: speedup {baseline / two_stage:.2f}x")
+
+        # 只计 extract_select_stmt 的开销，语法树提前解析好
+        # 切换语法后 SQLiteParser 会被替换，所以从模块里取当前的
+        trees = []
+        for query in queries:
+            try:
+                trees.append((query, get_children_with_type(parse_tree(query), sql_parse.SQLiteParser.Select_stmtContext)[0]))
+            except Exception:
+                pass
+        bench("extract", trees, lambda x: extract_select_stmt(x[0], x[1]))
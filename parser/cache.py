@@ -0,0 +1,81 @@
+import hashlib
+import os
+import re
+import sqlite3
+
+# 序列化格式或 key 的规范化方式变了就改这个，老缓存会自动失效
+SERIALIZE_VERSION = 2
+
+GRAMMAR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "grammar")
+
+def get_grammar_version(grammar_files: list[str] = ["SQLiteLexer.g4", "SQLiteParser.g4", "select/SQLiteParser.g4"]) -> str:
+    """
+    用语法文件内容的 hash 作为语法版本，语法改了缓存就不会再命中
+    """
+    h = hashlib.sha1(str(SERIALIZE_VERSION).encode())
+    for grammar_file in grammar_files:
+        with open(os.path.join(GRAMMAR_DIR, grammar_file), "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+# 引号括起来的字面量和标识符（没闭合的算到结尾），或者一段空白
+_QUOTED_OR_SPACE = re.compile(r"'(?:[^']|'')*'?|\"(?:[^\"]|\"\")*\"?|`[^`]*`?|\[[^\]]*\]?|\s+")
+
+def normalize_query(query: str) -> str:
+    # 只合并引号外的空白，不改大小写，因为字面量是大小写敏感的，字面量里的空白也要原样保留
+    return _QUOTED_OR_SPACE.sub(lambda m: " " if m.group(0)[0].isspace() else m.group(0), query).strip()
+
+
+class ParseCache(object):
+    """
+    parse_sql 结果的磁盘缓存，存在一个 SQLite 文件里，读的时候走 mmap
+    key 是 (语法版本, 规范化后的 query) 的 hash，value 是 ParsedSQL.serialize() 的结果
+    """
+    def __init__(self, path: str, grammar_version: str | None = None, mmap_size: int = 1 << 30, commit_interval: int = 1000):
+        self.path = path
+        self.grammar_version = grammar_version if grammar_version is not None else get_grammar_version()
+        self.commit_interval = commit_interval
+        self.pending = 0
+        self.hits = 0
+        self.misses = 0
+
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(f"PRAGMA mmap_size = {mmap_size}")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = OFF")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS parsed (key BLOB PRIMARY KEY, ok INTEGER, value TEXT) WITHOUT ROWID")
+        self.conn.commit()
+
+    def key(self, query: str) -> bytes:
+        return hashlib.sha1(f"{self.grammar_version}\0{normalize_query(query)}".encode()).digest()
+
+    def get(self, query: str) -> tuple[bool, str] | None:
+        """
+        返回 (是否解析成功, 序列化结果或错误信息)，没命中返回 None
+        """
+        row = self.conn.execute("SELECT ok, value FROM parsed WHERE key = ?", (self.key(query),)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return bool(row[0]), row[1]
+
+    def put(self, query: str, ok: bool, value: str):
+        self.conn.execute("INSERT OR REPLACE INTO parsed (key, ok, value) VALUES (?, ?, ?)", (self.key(query), int(ok), value))
+        self.pending += 1
+        if self.pending >= self.commit_interval:
+            self.flush()
+
+    def flush(self):
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def __enter__(self) -> "ParseCache":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,515 @@
+import re
+
+from parser.parse import BaseConstraintExpr, ParsedSQL, alter_text_by_table
+from parser.grammar.gen.SQLiteLexer import SQLiteLexer
+
+# 手写的递归下降解析器，只覆盖 extract_select_stmt 能处理的那部分 SELECT 语法，直接产出和 ANTLR 路径一样的 ParsedSQL
+# 遇到不认识或者有歧义的写法（关键字当名字、注释、WITH、语法错误等）就抛 UnsupportedSyntax，由调用方退回 ANTLR
+# 所以这里宁可多退回，也不能产出和 ANTLR 不一样的结果；extract_select_stmt 里的一些怪行为（比如 LIKE 永远是 NOT_LIKE）也照抄
+
+class UnsupportedSyntax(Exception):
+    pass
+
+# 关键字直接从生成的 lexer 里拿，和语法保持一致
+KEYWORDS = frozenset(
+    name.strip("'") for name in SQLiteLexer.literalNames
+    if name.startswith("'") and name.strip("'").replace("_", "").isalpha()
+)
+
+_TOKEN_PATTERN = re.compile(r"""
+    (?P<ws>[ \x0b\t\r\n]+)
+  | (?P<comment>--|/\*)
+  | (?P<str>'(?:[^']|'')*'|"(?:[^"]|"")*")
+  | (?P<id>`(?:[^`]|``)*`|\[[^\]]*\])
+  | (?P<num>0[xX][0-9a-fA-F]+|(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+)(?:[eE][-+]?[0-9]+)?)
+  | (?P<word>[A-Za-z_\u007f-\uffff][A-Za-z_0-9\u007f-\uffff]*)
+  | (?P<op>\|\||<<|>>|<=|>=|==|!=|<>|[;.(),=*+\-~/%&|<>])
+""", re.VERBOSE)
+
+def tokenize(query: str) -> list[tuple[str, str]]:
+    """
+    返回 [(类型, 原文), ...]，类型是 KW / ID / NUM / STR / OP，KW 的原文统一转成大写方便比较
+    和 SQLiteLexer 一样按最长匹配切分
+    """
+    tokens = []
+    pos = 0
+    length = len(query)
+    while pos < length:
+        match = _TOKEN_PATTERN.match(query, pos)
+        if match is None:
+            raise UnsupportedSyntax(f"Unexpected character {query[pos]!r}")
+        kind = match.lastgroup
+        text = match.group()
+        pos = match.end()
+        if kind == "ws":
+            continue
+        if kind == "comment":
+            raise UnsupportedSyntax("Comment")
+        if kind == "word":
+            if pos < length and query[pos] in "'\"" and text.upper() == "X":
+                raise UnsupportedSyntax("Blob literal")
+            if text.upper() in KEYWORDS:
+                tokens.append(("KW", text.upper()))
+                continue
+            tokens.append(("ID", text))
+        elif kind == "id":
+            tokens.append(("ID", text))
+        elif kind == "num":
+            tokens.append(("NUM", text))
+        elif kind == "str":
+            tokens.append(("STR", text))
+        else:
+            tokens.append(("OP", text))
+    return tokens
+
+COMPARE_OPERATORS = frozenset(["=", "==", "!=", "<>", ">", ">=", ">>", "<", "<=", "<<"])
+
+# 约束表达式的 AST，每个节点对应 ANTLR 语法树里的一个 constraint_expr 节点
+# ("base", kind, left, args...) / ("paren", inner) / ("not", inner) / ("bin", op, left, right)
+
+class _Parser(object):
+    def __init__(self, tokens: list[tuple[str, str]]):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self, offset: int = 0) -> tuple[str, str]:
+        index = self.pos + offset
+        if index < len(self.tokens):
+            return self.tokens[index]
+        return ("EOF", "")
+
+    def is_kw(self, word: str, offset: int = 0) -> bool:
+        return self.peek(offset) == ("KW", word)
+
+    def is_op(self, op: str, offset: int = 0) -> bool:
+        return self.peek(offset) == ("OP", op)
+
+    def next(self) -> tuple[str, str]:
+        token = self.peek()
+        if token[0] == "EOF":
+            raise UnsupportedSyntax("Unexpected end of query")
+        self.pos += 1
+        return token
+
+    def expect_kw(self, word: str):
+        if not self.is_kw(word):
+            raise UnsupportedSyntax(f"Expected {word}, got {self.peek()[1]!r}")
+        self.pos += 1
+
+    def expect_op(self, op: str):
+        if not self.is_op(op):
+            raise UnsupportedSyntax(f"Expected {op}, got {self.peek()[1]!r}")
+        self.pos += 1
+
+    def text(self, start: int, end: int) -> str:
+        # 和 ANTLR 的 getText() 一样，直接拼接 token 原文，不带空白
+        return "".join(text for _, text in self.tokens[start:end])
+
+    def name(self) -> str:
+        # 只接受 IDENTIFIER，关键字当名字、(name) 这类写法都交给 ANTLR
+        kind, text = self.next()
+        if kind != "ID":
+            raise UnsupportedSyntax(f"Expected a name, got {text!r}")
+        return text
+
+    # select_stmt: select_core (compound_operator select_core)* order_by_stmt? limit_stmt?
+    def parse(self) -> dict:
+        while self.is_op(";"):
+            self.pos += 1
+        if self.is_kw("WITH"):
+            raise UnsupportedSyntax("Common table expression")
+        stmt = self.select_core()
+        while True:
+            if self.is_kw("UNION"):
+                self.pos += 1
+                if self.is_kw("ALL"):
+                    self.pos += 1
+            elif self.is_kw("INTERSECT") or self.is_kw("EXCEPT"):
+                self.pos += 1
+            else:
+                break
+            # 后面的 select_core 不参与抽取，但也要完整解析，保证语法和 ANTLR 一致
+            self.select_core()
+
+        stmt["order_by"] = None
+        if self.is_kw("ORDER"):
+            self.pos += 1
+            self.expect_kw("BY")
+            if self.peek()[0] == "ID" and self.is_op("(", 1):
+                column = self.function_table_column()
+            else:
+                column = self.table_column()
+            ordering = None
+            if self.is_kw("ASC") or self.is_kw("DESC"):
+                ordering = self.next()[1]
+            stmt["order_by"] = (column, ordering)
+
+        stmt["limit"] = None
+        if self.is_kw("LIMIT"):
+            self.pos += 1
+            kind, text = self.next()
+            if kind != "NUM":
+                raise UnsupportedSyntax("LIMIT without number")
+            stmt["limit"] = text
+
+        while self.is_op(";"):
+            self.pos += 1
+        if self.peek()[0] != "EOF":
+            raise UnsupportedSyntax(f"Unexpected {self.peek()[1]!r} after statement")
+        return stmt
+
+    # select_core: SELECT DISTINCT? result_columns FROM from_tables (WHERE where_expr)? (GROUP BY group_by_columns (HAVING having_expr)?)?
+    def select_core(self) -> dict:
+        self.expect_kw("SELECT")
+        if self.is_kw("DISTINCT"):
+            self.pos += 1
+        result_columns = [self.result_column()]
+        while self.is_op(","):
+            self.pos += 1
+            result_columns.append(self.result_column())
+
+        self.expect_kw("FROM")
+        tables = [self.table_or_subquery()]
+        join_constraints = []
+        while True:
+            if self.is_op(","):
+                self.pos += 1
+            elif self.is_kw("JOIN") or self.is_kw("INNER") or self.is_kw("CROSS"):
+                if not self.is_kw("JOIN"):
+                    self.pos += 1
+                self.expect_kw("JOIN")
+            elif self.is_kw("NATURAL") or self.is_kw("LEFT") or self.is_kw("RIGHT") or self.is_kw("FULL"):
+                if self.is_kw("NATURAL"):
+                    self.pos += 1
+                if self.is_kw("LEFT") or self.is_kw("RIGHT") or self.is_kw("FULL"):
+                    self.pos += 1
+                    if self.is_kw("OUTER"):
+                        self.pos += 1
+                elif self.is_kw("INNER") or self.is_kw("CROSS"):
+                    self.pos += 1
+                self.expect_kw("JOIN")
+            else:
+                break
+            tables.append(self.table_or_subquery())
+            if self.is_kw("ON"):
+                self.pos += 1
+                join_constraints.append(self.constraint_expr())
+
+        where = None
+        if self.is_kw("WHERE"):
+            self.pos += 1
+            where = self.constraint_expr()
+
+        group_by = []
+        having = None
+        if self.is_kw("GROUP"):
+            self.pos += 1
+            self.expect_kw("BY")
+            group_by.append(self.table_column())
+            while self.is_op(","):
+                self.pos += 1
+                group_by.append(self.table_column())
+            if self.is_kw("HAVING"):
+                self.pos += 1
+                having = self.constraint_expr()
+
+        return {
+            "result_columns": result_columns,
+            "tables": tables,
+            "join_constraints": join_constraints,
+            "where": where,
+            "group_by": group_by,
+            "having": having,
+        }
+
+    # result_column: STAR | function_table_column | table_column
+    def result_column(self) -> tuple:
+        if self.is_op("*"):
+            self.pos += 1
+            return ("star",)
+        if self.peek()[0] == "ID" and self.is_op("(", 1):
+            return ("function", self.function_table_column())
+        return ("column", self.table_column())
+
+    # table_column: ((schema_name DOT)? table_name DOT)? column_name
+    def table_column(self) -> tuple[str | None, str]:
+        names = [self.name()]
+        while self.is_op(".") and len(names) < 3:
+            self.pos += 1
+            names.append(self.name())
+        if len(names) == 1:
+            return None, names[0]
+        return names[-2], names[-1]
+
+    # function_table_column: function_name OPEN_PAR DISTINCT_? (table_column | STAR) CLOSE_PAR
+    def function_table_column(self) -> tuple[str, bool, tuple[str | None, str] | None]:
+        start = self.pos
+        function_name = self.name()
+        self.expect_op("(")
+        if self.is_kw("DISTINCT"):
+            self.pos += 1
+        if self.is_op("*"):
+            self.pos += 1
+            column = None
+        else:
+            column = self.table_column()
+        self.expect_op(")")
+        # extract_function_table_column 判断的是整段文本里有没有 *
+        return function_name, "*" in self.text(start, self.pos), column
+
+    # table_or_subquery: (schema_name DOT)? table_name (AS_ table_alias)?
+    def table_or_subquery(self) -> tuple[str, str | None]:
+        table_name = self.name()
+        if self.is_op("."):
+            self.pos += 1
+            table_name = self.name()
+        alias = None
+        if self.is_kw("AS"):
+            self.pos += 1
+            alias = self.name()
+        if self.is_kw("INDEXED") or (self.is_kw("NOT") and self.is_kw("INDEXED", 1)):
+            raise UnsupportedSyntax("INDEXED BY")
+        return table_name, alias
+
+    # constraint_expr 是左递归的：AND 优先级高于 OR，都是左结合；NOT 优先级最低，会吞掉后面整个表达式
+    def constraint_expr(self, min_precedence: int = 1) -> tuple:
+        if self.is_kw("NOT"):
+            self.pos += 1
+            left = ("not", self.constraint_expr(1))
+        elif self.is_op("("):
+            self.pos += 1
+            left = ("paren", self.constraint_expr(1))
+            self.expect_op(")")
+        else:
+            left = self.base_constraint_expr()
+
+        while True:
+            if self.is_kw("AND") and min_precedence <= 3:
+                self.pos += 1
+                left = ("bin", "AND", left, self.constraint_expr(4))
+            elif self.is_kw("OR") and min_precedence <= 2:
+                self.pos += 1
+                left = ("bin", "OR", left, self.constraint_expr(3))
+            else:
+                return left
+
+    def literal_value(self) -> str:
+        kind, text = self.next()
+        if kind not in ["NUM", "STR"]:
+            raise UnsupportedSyntax(f"Unsupported literal {text!r}")
+        return text
+
+    def base_constraint_expr(self) -> tuple:
+        if self.peek()[0] == "ID" and self.is_op("(", 1):
+            # function_table_column 只能接比较运算符
+            left = ("function", self.function_table_column())
+            kind, operator = self.next()
+            if kind != "OP" or operator not in COMPARE_OPERATORS:
+                raise UnsupportedSyntax(f"Unsupported operator {operator!r}")
+            return ("base", "compare", left, operator, self.compare_value())
+
+        left = ("column", self.table_column())
+        kind, text = self.peek()
+        if kind == "OP" and text in COMPARE_OPERATORS:
+            self.pos += 1
+            return ("base", "compare", left, text, self.compare_value())
+        if self.is_kw("IS"):
+            self.pos += 1
+            if self.is_kw("NOT"):
+                self.pos += 1
+            if not (self.is_kw("NULL") or self.is_kw("NOTNULL")):
+                raise UnsupportedSyntax("IS without NULL")
+            self.pos += 1
+            return ("base", "is_null", left)
+        if self.is_kw("NOT"):
+            self.pos += 1
+        if self.is_kw("BETWEEN"):
+            self.pos += 1
+            value1 = self.literal_value()
+            self.expect_kw("AND")
+            value2 = self.literal_value()
+            return ("base", "between", left, value1, value2)
+        if self.is_kw("LIKE"):
+            self.pos += 1
+            return ("base", "like", left, self.literal_value())
+        raise UnsupportedSyntax(f"Unsupported condition near {text!r}")
+
+    def compare_value(self) -> tuple:
+        kind, text = self.peek()
+        if kind == "ID":
+            return ("column", self.table_column())
+        return ("literal", self.literal_value())
+
+
+def _extract_base(node: tuple, alt_table: list) -> BaseConstraintExpr:
+    # 对应 extract_base_constraint_expr
+    def alt_text(text):
+        return alter_text_by_table(text, alt_table)
+    _, kind, left = node[:3]
+    if left[0] == "column":
+        table_name, column_name = left[1]
+        aggregate_func = None
+    else:
+        table_name, column_name, aggregate_func = _function_column(left[1])
+
+    if kind == "compare":
+        operator, value = node[3], node[4]
+        if value[0] == "column":
+            value_table_name, value_column_name = value[1]
+            return BaseConstraintExpr(alt_text(table_name), column_name, operator, (alt_text(value_table_name), value_column_name), aggregate_func)
+        literal = value[1]
+        if literal[0] == "'" or literal[0] == '"':
+            literal = literal[1:-1]
+        return BaseConstraintExpr(alt_text(table_name), column_name, operator, literal, aggregate_func)
+    # extract_base_constraint_expr 里 getChildCount 没有加括号，下面三种永远走 NOT 分支
+    if kind == "is_null":
+        return BaseConstraintExpr(alt_text(table_name), column_name, "IS_NOT_NULL", None)
+    if kind == "between":
+        return BaseConstraintExpr(alt_text(table_name), column_name, "NOT_BETWEEN", (node[3], node[4]))
+    return BaseConstraintExpr(alt_text(table_name), column_name, "NOT_LIKE", node[3])
+
+def _extract_constraint(node: tuple, alt_table: list) -> BaseConstraintExpr | tuple:
+    # 对应 extract_constraint_expr
+    if node[0] == "base":
+        return _extract_base(node, alt_table)
+    if node[0] == "bin":
+        return node[1], _extract_constraint(node[2], alt_table), _extract_constraint(node[3], alt_table)
+    if node[0] == "not":
+        return "NOT", _extract_constraint(node[1], alt_table)
+    return _extract_constraint(node[1], alt_table)
+
+def _preorder(node: tuple, nodes: list) -> list:
+    # collect_select_parts 会把 ON 里嵌套的 constraint_expr 也按先序收集进来
+    nodes.append(node)
+    if node[0] == "bin":
+        _preorder(node[2], nodes)
+        _preorder(node[3], nodes)
+    elif node[0] in ["not", "paren"]:
+        _preorder(node[1], nodes)
+    return nodes
+
+def _function_column(function_column: tuple) -> tuple[str | None, str, str]:
+    # 对应 extract_function_table_column
+    function_name, has_star, column = function_column
+    if has_star:
+        return ("*", "*", function_name)
+    return (column[0], column[1], function_name)
+
+def fast_parse_sql(query: str) -> ParsedSQL:
+    """
+    不支持的写法抛 UnsupportedSyntax，调用方应退回 ANTLR
+    """
+    stmt = _Parser(tokenize(query)).parse()
+
+    from_tables = stmt["tables"]
+    alt_table = [(b, a) for a, b in from_tables]
+    def alt_text(text):
+        return alter_text_by_table(text, alt_table)
+
+    from_join_clauses = []
+    for constraint in stmt["join_constraints"]:
+        for node in _preorder(constraint, []):
+            from_join_clauses.append(_extract_constraint(node, alt_table))
+
+    result_columns = []
+    for column in stmt["result_columns"]:
+        if column[0] == "star":
+            result_columns.append(("*", "*", None))
+            break
+        if column[0] == "column":
+            table_name, column_name = column[1]
+            result_columns.append((alt_text(table_name), column_name, None))
+        else:
+            table_name, column_name, function_name = _function_column(column[1])
+            result_columns.append((alt_text(table_name), column_name, function_name))
+
+    where_condition = None
+    if stmt["where"] is not None:
+        where_condition = _extract_constraint(stmt["where"], alt_table)
+
+    group_by_columns = [(alt_text(table_name), column_name) for table_name, column_name in stmt["group_by"]]
+
+    having_condition = None
+    if stmt["having"] is not None:
+        having_condition = _extract_constraint(stmt["having"], alt_table)
+
+    order_by_column = None
+    ordering = None
+    if stmt["order_by"] is not None:
+        column, ordering = stmt["order_by"]
+        if len(column) == 2:
+            order_by_column = (alt_text(column[0]), column[1], None)
+        else:
+            table_name, column_name, function_name = _function_column(column)
+            order_by_column = (alt_text(table_name), column_name, function_name)
+        ordering = "ASC" if ordering is None else ordering
+
+    limit = None
+    if stmt["limit"] is not None:
+        limit = int(stmt["limit"])
+
+    return ParsedSQL(
+        query=query,
+        result_columns=result_columns,
+        from_tables=[a for a, _ in from_tables],
+        from_join_clauses=from_join_clauses,
+        where_condition=where_condition,
+        group_by_columns=group_by_columns,
+        having_condition=having_condition,
+        order_by_column=order_by_column,
+        ordering=ordering,
+        limit=limit
+    )
+
+if __name__ == "__main__":
+    # 差分测试：python -m parser.fast --spider-json data/spider/train_spider.json data/spider/dev.json
+    import argparse
+    import json
+    import time
+    from parser.parse import encode_parsed, parse_sql
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--spider-json", dest="spider_json", type=str, nargs="+", default=["./data/spider/train_spider.json"])
+    args = parser.parse_args()
+
+    queries = []
+    for spider_json in args.spider_json:
+        with open(spider_json, "r") as f:
+            queries.extend([item["query"] for item in json.load(f)])
+
+    fast_cnt = 0
+    fallback_cnt = 0
+    mismatch_cnt = 0
+    fast_time = 0.0
+    antlr_time = 0.0
+    for query in queries:
+        start_time = time.perf_counter()
+        try:
+            fast_result = encode_parsed(fast_parse_sql(query))
+        except UnsupportedSyntax:
+            fast_result = None
+        except Exception as e:
+            fast_result = f"{type(e).__name__}"
+        fast_time += time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        try:
+            antlr_result = encode_parsed(parse_sql(query))
+        except Exception as e:
+            antlr_result = f"{type(e).__name__}"
+        antlr_time += time.perf_counter() - start_time
+
+        if fast_result is None:
+            fallback_cnt += 1
+            continue
+        fast_cnt += 1
+        if fast_result != antlr_result:
+            mismatch_cnt += 1
+            print("Mismatch:", query)
+            print("  fast: ", fast_result)
+            print("  antlr:", antlr_result)
+
+    print(f"Queries: {len(queries)}, fast path: {fast_cnt}, fallback: {fallback_cnt}, mismatch: {mismatch_cnt}")
+    print(f"Fast parser: {fast_time:.2f}s, ANTLR: {antlr_time:.2f}s")
+    if mismatch_cnt != 0:
+        exit(1)
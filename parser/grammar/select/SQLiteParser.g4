@@ -0,0 +1,397 @@
+/*
+ * The MIT License (MIT)
+ *
+ * Copyright (c) 2014 by Bart Kiers
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+ * associated documentation files (the "Software"), to deal in the Software without restriction,
+ * including without limitation the rights to use, copy, modify, merge, publish, distribute,
+ * sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+ * furnished to do so, subject to the following conditions:
+ *
+ * The above copyright notice and this permission notice shall be included in all copies or
+ * substantial portions of the Software.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+ * NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+ * NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+ * DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+ * OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+ *
+ * Project : sqlite-parser; an ANTLR4 grammar for SQLite https://github.com/bkiers/sqlite-parser
+ * Developed by:
+ *     Bart Kiers, bart@big-o.nl
+ *     Martin Mirchev, marti_2203@abv.bg
+ *     Mike Lische, mike@lischke-online.de
+ */
+
+// $antlr-format alignTrailingComments on, columnLimit 130, minEmptyLines 1, maxEmptyLinesToKeep 1, reflowComments off
+// $antlr-format useTab off, allowShortRulesOnASingleLine off, allowShortBlocksOnASingleLine on, alignSemicolons ownLine
+
+// Trimmed variant of ../SQLiteParser.g4 that only keeps the rules reachable from `parse`,
+// i.e. what parser/parse.py extract_select_stmt consumes. Kept rules are copied verbatim so that
+// error recovery (and therefore ParsedSQL) stays identical to the full grammar.
+// Generate with `make generate-antlr-select`.
+
+parser grammar SQLiteParser;
+
+options {
+    tokenVocab = SQLiteLexer;
+}
+
+parse
+    : SCOL* select_stmt SCOL* EOF
+;
+
+select_stmt
+    : common_table_stmt? select_core (compound_operator select_core)* order_by_stmt? limit_stmt?
+;
+
+common_table_stmt
+    : //additional structures
+    WITH_ RECURSIVE_? common_table_expression (COMMA common_table_expression)*
+;
+
+common_table_expression
+    : table_name (OPEN_PAR column_name ( COMMA column_name)* CLOSE_PAR)? AS_ OPEN_PAR select_stmt CLOSE_PAR
+;
+
+select_core
+    : (
+        SELECT_ (DISTINCT_)? result_columns 
+        (FROM_ from_tables) (WHERE_ where_expr)? 
+        (GROUP_ BY_ group_by_columns (HAVING_ having_expr)?)?
+    )
+;
+
+where_expr
+    : constraint_expr
+;
+
+result_columns
+    : result_column (COMMA result_column)*
+;
+
+result_column
+    : STAR
+    | function_table_column
+    | table_column
+;
+
+function_table_column
+    : function_name OPEN_PAR DISTINCT_? (table_column | STAR) CLOSE_PAR
+;
+
+from_tables
+    : table_or_subquery (COMMA table_or_subquery)*
+    | join_clause
+;
+
+table_or_subquery
+    : (
+        (schema_name DOT)? table_name_with_alias 
+        (INDEXED_ BY_ index_name | NOT_ INDEXED_)?
+    )
+    // | (schema_name DOT)? table_function_name OPEN_PAR expr (COMMA expr)* CLOSE_PAR (
+    //     AS_? table_alias
+    // )?
+    // | OPEN_PAR (table_or_subquery (COMMA table_or_subquery)* | join_clause) CLOSE_PAR
+    // | OPEN_PAR select_stmt CLOSE_PAR (AS_? table_alias)?
+;
+
+table_name_with_alias
+    : table_name (AS_ table_alias)?
+;
+
+join_clause
+    : table_or_subquery (join_operator table_or_subquery join_constraint?)*
+;
+
+join_operator
+    : COMMA
+    | NATURAL_? ((LEFT_ | RIGHT_ | FULL_) OUTER_? | INNER_ | CROSS_)? JOIN_
+;
+
+join_constraint
+    : ON_ constraint_expr
+    // | USING_ OPEN_PAR column_name ( COMMA column_name)* CLOSE_PAR
+;
+
+compound_operator
+    : UNION_ ALL_?
+    | INTERSECT_
+    | EXCEPT_
+;
+
+order_by_stmt
+    : ORDER_ BY_ ordering_term
+;
+
+ordering_term
+    : (table_column | function_table_column) asc_desc? 
+;
+
+asc_desc
+    : ASC_
+    | DESC_
+;
+
+limit_stmt
+    : LIMIT_ NUMERIC_LITERAL
+;
+
+constraint_expr
+    : base_constraint_expr
+    | OPEN_PAR constraint_expr CLOSE_PAR
+    | constraint_expr AND_ constraint_expr
+    | constraint_expr OR_ constraint_expr
+    | NOT_ constraint_expr
+;
+
+base_constraint_expr
+    : table_column compare_operator (table_column | literal_value)
+    | table_column is_null_operator (NULL_ | NOTNULL_)
+    // | table_column is_from_operator table_column
+    | table_column between_operator literal_value AND_ literal_value
+    | table_column match_like_operator literal_value
+    // | table_column in_operator OPEN_PAR (select_stmt) CLOSE_PAR
+    | function_table_column compare_operator (table_column | literal_value)
+;
+
+compare_operator
+    : ASSIGN
+    | EQ
+    | NOT_EQ1
+    | NOT_EQ2
+    | GT
+    | GT_EQ
+    | GT2
+    | LT
+    | LT_EQ
+    | LT2
+;
+
+is_null_operator
+    : ( IS_ | IS_ NOT_ ) 
+;
+
+between_operator
+    : BETWEEN_
+    | NOT_ BETWEEN_
+;
+
+match_like_operator
+    : NOT_? (LIKE_)
+;
+
+group_by_columns
+    : table_column (COMMA table_column)*
+;
+
+having_expr
+    : constraint_expr
+;
+
+table_column
+    : ((schema_name DOT)? table_name DOT)? column_name
+;
+
+literal_value
+    : NUMERIC_LITERAL
+    | STRING_LITERAL
+    | BLOB_LITERAL
+    | NULL_
+    | TRUE_
+    | FALSE_
+    | CURRENT_TIME_
+    | CURRENT_DATE_
+    | CURRENT_TIMESTAMP_
+;
+
+keyword
+    : ABORT_
+    | ACTION_
+    | ADD_
+    | AFTER_
+    | ALL_
+    | ALTER_
+    | ANALYZE_
+    | AND_
+    | AS_
+    | ASC_
+    | ATTACH_
+    | AUTOINCREMENT_
+    | BEFORE_
+    | BEGIN_
+    | BETWEEN_
+    | BY_
+    | CASCADE_
+    | CASE_
+    | CAST_
+    | CHECK_
+    | COLLATE_
+    | COLUMN_
+    | COMMIT_
+    | CONFLICT_
+    | CONSTRAINT_
+    | CREATE_
+    | CROSS_
+    | CURRENT_DATE_
+    | CURRENT_TIME_
+    | CURRENT_TIMESTAMP_
+    | DATABASE_
+    | DEFAULT_
+    | DEFERRABLE_
+    | DEFERRED_
+    | DELETE_
+    | DESC_
+    | DETACH_
+    | DISTINCT_
+    | DROP_
+    | EACH_
+    | ELSE_
+    | END_
+    | ESCAPE_
+    | EXCEPT_
+    | EXCLUSIVE_
+    | EXISTS_
+    | EXPLAIN_
+    | FAIL_
+    | FOR_
+    | FOREIGN_
+    | FROM_
+    | FULL_
+    | GLOB_
+    | GROUP_
+    | HAVING_
+    | IF_
+    | IGNORE_
+    | IMMEDIATE_
+    | IN_
+    | INDEX_
+    | INDEXED_
+    | INITIALLY_
+    | INNER_
+    | INSERT_
+    | INSTEAD_
+    | INTERSECT_
+    | INTO_
+    | IS_
+    | ISNULL_
+    | JOIN_
+    | KEY_
+    | LEFT_
+    | LIKE_
+    | LIMIT_
+    | MATCH_
+    | NATURAL_
+    | NO_
+    | NOT_
+    | NOTNULL_
+    | NULL_
+    | OF_
+    | OFFSET_
+    | ON_
+    | OR_
+    | ORDER_
+    | OUTER_
+    | PLAN_
+    | PRAGMA_
+    | PRIMARY_
+    | QUERY_
+    | RAISE_
+    | RECURSIVE_
+    | REFERENCES_
+    | REGEXP_
+    | REINDEX_
+    | RELEASE_
+    | RENAME_
+    | REPLACE_
+    | RESTRICT_
+    | RIGHT_
+    | ROLLBACK_
+    | ROW_
+    | ROWS_
+    | SAVEPOINT_
+    | SELECT_
+    | SET_
+    | TABLE_
+    | TEMP_
+    | TEMPORARY_
+    | THEN_
+    | TO_
+    | TRANSACTION_
+    | TRIGGER_
+    | UNION_
+    | UNIQUE_
+    | UPDATE_
+    | USING_
+    | VACUUM_
+    | VALUES_
+    | VIEW_
+    | VIRTUAL_
+    | WHEN_
+    | WHERE_
+    | WITH_
+    | WITHOUT_
+    | FIRST_VALUE_
+    | OVER_
+    | PARTITION_
+    | RANGE_
+    | PRECEDING_
+    | UNBOUNDED_
+    | CURRENT_
+    | FOLLOWING_
+    | CUME_DIST_
+    | DENSE_RANK_
+    | LAG_
+    | LAST_VALUE_
+    | LEAD_
+    | NTH_VALUE_
+    | NTILE_
+    | PERCENT_RANK_
+    | RANK_
+    | ROW_NUMBER_
+    | GENERATED_
+    | ALWAYS_
+    | STORED_
+    | TRUE_
+    | FALSE_
+    | WINDOW_
+    | NULLS_
+    | FIRST_
+    | LAST_
+    | FILTER_
+    | GROUPS_
+    | EXCLUDE_
+;
+
+function_name
+    : any_name
+;
+
+schema_name
+    : any_name
+;
+
+table_name
+    : any_name
+;
+
+column_name
+    : any_name
+;
+
+index_name
+    : any_name
+;
+
+table_alias
+    : any_name
+;
+
+any_name
+    : IDENTIFIER
+    | keyword
+    | OPEN_PAR any_name CLOSE_PAR
+;
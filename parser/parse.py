@@ -1,15 +1,44 @@
-from antlr4 import CommonTokenStream, InputStream
+import importlib
+import json
+import time
+from antlr4 import CommonTokenStream, InputStream, ParserRuleContext, PredictionMode, Token
+from antlr4.error.ErrorStrategy import BailErrorStrategy, DefaultErrorStrategy
+from antlr4.error.Errors import ParseCancellationException
+from antlr4.tree.Tree import ParseTreeListener
 from parser.utils import *
+from parser.cache import ParseCache
 from parser.grammar.gen.SQLiteLexer import SQLiteLexer
 from parser.grammar.gen.SQLiteParser import SQLiteParser
 
+# 可选的语法，"select" 是只保留 SELECT 相关规则的裁剪版（make generate-antlr-select）
+GRAMMAR_MODULES = {
+    "full": "parser.grammar.gen",
+    "select": "parser.grammar.gen.select",
+}
+
+def set_grammar(name: str):
+    """
+    运行时切换解析用的语法，两种语法抽出来的 ParsedSQL 是一样的，只是解析速度不同
+    """
+    global SQLiteLexer, SQLiteParser, _lexer, _parser
+    module = GRAMMAR_MODULES[name]
+    SQLiteLexer = importlib.import_module(f"{module}.SQLiteLexer").SQLiteLexer
+    SQLiteParser = importlib.import_module(f"{module}.SQLiteParser").SQLiteParser
+    _lexer = None
+    _parser = None
+
+def _first_child_with_type(node: RuleContext, ttype: type) -> RuleContext | None:
+    for child in node.children or ():
+        if isinstance(child, ttype):
+            return child
+    return None
+
+# 下面这几个节点的目标子节点都是直接子节点（语法保证），不用再做整棵子树的 DFS
 def extract_table_column(table_column: RuleContext) -> tuple[str | None, str]:
-    table_name = find_children_with_type(table_column, SQLiteParser.Table_nameContext)
-    if len(table_name) == 0:
-        table_name = None
-    else:
-        table_name = table_name[0].getText().strip()
-    column_name = find_children_with_type(table_column, SQLiteParser.Column_nameContext)[0].getText().strip()
+    table_name = _first_child_with_type(table_column, SQLiteParser.Table_nameContext)
+    if table_name is not None:
+        table_name = table_name.getText().strip()
+    column_name = _first_child_with_type(table_column, SQLiteParser.Column_nameContext).getText().strip()
     return table_name, column_name
 
 def extract_function_table_column(function_table_column: RuleContext) -> tuple[str | None, str, str]:
@@ -17,18 +46,16 @@ def extract_function_table_column(function_table_column: RuleContext) -> tuple[s
     if "*" in function_table_column.getText():
         return ("*", "*", function_name)
     else:
-        table_column = find_children_with_type(function_table_column, SQLiteParser.Table_columnContext)[0]
+        table_column = _first_child_with_type(function_table_column, SQLiteParser.Table_columnContext)
         table_name, column_name = extract_table_column(table_column)
         return (table_name, column_name, function_name)
 
 def extract_table_or_subquery(table_or_subquery: RuleContext) -> tuple[str, str | None]:
-    table_name_with_alias = find_children_with_type(table_or_subquery, SQLiteParser.Table_name_with_aliasContext)[0]
+    table_name_with_alias = _first_child_with_type(table_or_subquery, SQLiteParser.Table_name_with_aliasContext)
     table_name = table_name_with_alias.getChild(0).getText().strip()
-    alias = find_children_with_type(table_name_with_alias, SQLiteParser.Table_aliasContext)
-    if len(alias) == 0:
-        alias = None
-    else:
-        alias = alias[0].getText().strip()
+    alias = _first_child_with_type(table_name_with_alias, SQLiteParser.Table_aliasContext)
+    if alias is not None:
+        alias = alias.getText().strip()
     return table_name, alias
 
 class BaseConstraintExpr():
@@ -43,6 +70,13 @@ class BaseConstraintExpr():
         if self.aggregate_func is not None:
             return f"({self.aggregate_func}({self.table_name}.{self.column_name}) {self.operator} {self.value})"
         return f"({self.table_name}.{self.column_name} {self.operator} {self.value})"
+
+    def serialize(self) -> str:
+        return json.dumps(encode_parsed(self), ensure_ascii=False, separators=(",", ":"))
+
+    @staticmethod
+    def deserialize(data: str) -> "BaseConstraintExpr":
+        return decode_parsed(json.loads(data))
     
 def alter_text_by_table(alias, alt_table) -> str:
     for a, b in alt_table:
@@ -151,24 +185,129 @@ class ParsedSQL(object):
         self.ordering = ordering
         self.limit = limit
 
-
-def extract_select_stmt(query: str, select_stmt: RuleContext) -> ParsedSQL:
+    def serialize(self) -> str:
+        return json.dumps(encode_parsed(self), ensure_ascii=False, separators=(",", ":"))
+
+    @staticmethod
+    def deserialize(data: str) -> "ParsedSQL":
+        return decode_parsed(json.loads(data))
+
+def encode_parsed(obj):
+    """
+    把 ParsedSQL / BaseConstraintExpr 及其中的 tuple、list 编码成 JSON 能存的嵌套 list
+    非字面量统一编码成 [标记, ...]，字面量（str、int、None）原样保留
+    """
+    if isinstance(obj, ParsedSQL):
+        return ["P", obj.query, encode_parsed(obj.result_columns), encode_parsed(obj.from_tables),
+                encode_parsed(obj.from_join_clauses), encode_parsed(obj.where_condition),
+                encode_parsed(obj.group_by_columns), encode_parsed(obj.having_condition),
+                encode_parsed(obj.order_by_column), obj.ordering, obj.limit]
+    if isinstance(obj, BaseConstraintExpr):
+        return ["B", obj.table_name, obj.column_name, obj.operator, encode_parsed(obj.value), obj.aggregate_func]
+    if isinstance(obj, tuple):
+        return ["T"] + [encode_parsed(x) for x in obj]
+    if isinstance(obj, list):
+        return ["L"] + [encode_parsed(x) for x in obj]
+    return obj
+
+def decode_parsed(data):
+    if not isinstance(data, list):
+        return data
+    tag, items = data[0], data[1:]
+    if tag == "P":
+        return ParsedSQL(
+            query=items[0],
+            result_columns=decode_parsed(items[1]),
+            from_tables=decode_parsed(items[2]),
+            from_join_clauses=decode_parsed(items[3]),
+            where_condition=decode_parsed(items[4]),
+            group_by_columns=decode_parsed(items[5]),
+            having_condition=decode_parsed(items[6]),
+            order_by_column=decode_parsed(items[7]),
+            ordering=items[8],
+            limit=items[9]
+        )
+    if tag == "B":
+        return BaseConstraintExpr(items[0], items[1], items[2], decode_parsed(items[3]), items[4])
+    if tag == "T":
+        return tuple(decode_parsed(x) for x in items)
+    return [decode_parsed(x) for x in items]
+
+
+class SelectParts(object):
+    """
+    一次遍历 select_stmt 收集到的各部分节点，extract_select_stmt 只从这里取，不再反复 DFS
+    """
+    def __init__(self):
+        self.from_tables = None
+        self.table_or_subqueries = []
+        self.join_constraints = []
+        self.result_columns = []
+        self.where_expr = None
+        self.group_by_columns = []
+        self.having_expr = None
+        self.order_by_stmt = None
+        self.limit_stmt = None
+
+def collect_select_parts(select_stmt: RuleContext) -> SelectParts:
     # select_stmt: common_table_stmt? select_core (compound_operator select_core)* order_by_stmt? limit_stmt?
+    parts = SelectParts()
+    first_select_core = None
+    for child in select_stmt.children:
+        if isinstance(child, SQLiteParser.Select_coreContext):
+            if first_select_core is None:
+                # 就先只处理第一个 select_core
+                first_select_core = child
+        elif isinstance(child, SQLiteParser.Order_by_stmtContext):
+            if parts.order_by_stmt is None:
+                parts.order_by_stmt = child
+        elif isinstance(child, SQLiteParser.Limit_stmtContext):
+            if parts.limit_stmt is None:
+                parts.limit_stmt = child
+
+    for child in first_select_core.children:
+        if isinstance(child, SQLiteParser.Result_columnsContext):
+            parts.result_columns = [x for x in child.children if isinstance(x, SQLiteParser.Result_columnContext)]
+        elif isinstance(child, SQLiteParser.From_tablesContext):
+            if parts.from_tables is not None:
+                continue
+            parts.from_tables = child
+            # FROM 里的 JOIN 会嵌套，这里用显式栈做先序遍历，顺序和原来的递归 DFS 一致
+            # 嵌套的 constraint_expr（比如 ON a AND b 里的 a、b）也会被收集，行为和原来保持一致
+            stack = [child]
+            while stack:
+                node = stack.pop()
+                if isinstance(node, SQLiteParser.Table_or_subqueryContext):
+                    parts.table_or_subqueries.append(node)
+                    continue
+                if isinstance(node, SQLiteParser.Constraint_exprContext):
+                    parts.join_constraints.append(node)
+                elif isinstance(node, SQLiteParser.Base_constraint_exprContext):
+                    continue
+                if isinstance(node, ParserRuleContext) and node.children:
+                    stack.extend(reversed(node.children))
+        elif isinstance(child, SQLiteParser.Where_exprContext):
+            if parts.where_expr is None:
+                parts.where_expr = child
+        elif isinstance(child, SQLiteParser.Group_by_columnsContext):
+            if len(parts.group_by_columns) == 0:
+                parts.group_by_columns = [x for x in child.children if isinstance(x, SQLiteParser.Table_columnContext)]
+        elif isinstance(child, SQLiteParser.Having_exprContext):
+            if parts.having_expr is None:
+                parts.having_expr = child
+    return parts
 
-
-    select_core_stmts = get_children_with_type(select_stmt, SQLiteParser.Select_coreContext)
-
-    # 就先只处理第一个 select_core
-    first_select_core = select_core_stmts[0]
+def extract_select_stmt(query: str, select_stmt: RuleContext) -> ParsedSQL:
+    parts = collect_select_parts(select_stmt)
+    if parts.from_tables is None:
+        # 语法保证一定有 FROM，没有说明是错误恢复出来的残缺语法树
+        raise ValueError(f"FROM clause not found in query: {query}")
 
     # 处理 FROM 部分
     from_tables = [] # [(table_name, alias), ...]
     from_join_clauses = [] # 所有的 JOIN ON 条件
 
-    l_from_tables = get_children_with_type(first_select_core, SQLiteParser.From_tablesContext)[0] # 一定有，语法保证
-    all_table_or_subqueries = find_children_with_type(l_from_tables, SQLiteParser.Table_or_subqueryContext) # 会把 JOIN 里面的也自动提取出来
-    all_constraints = find_children_with_type(l_from_tables, SQLiteParser.Constraint_exprContext)
-    for table_or_subquery in all_table_or_subqueries:
+    for table_or_subquery in parts.table_or_subqueries:
         table_name, alias = extract_table_or_subquery(table_or_subquery)
         from_tables.append((table_name, alias))
 
@@ -181,13 +320,12 @@ def extract_select_stmt(query: str, select_stmt: RuleContext) -> ParsedSQL:
     
     from_tables = [a for a, _ in from_tables] # 只保留 table_name
 
-    for constraint in all_constraints:
+    for constraint in parts.join_constraints:
         from_join_clauses.append(extract_constraint_expr(constraint, alt_table))
 
     # 处理 SELECT 部分
     result_columns = [] # [(table_name, column_name, func), ...]
-    l_result_columns = find_children_with_type(first_select_core, SQLiteParser.Result_columnContext)
-    for column in l_result_columns:
+    for column in parts.result_columns:
         if column.getText().strip() == "*":
             result_columns.append(("*", "*", None))
             break # 如果有 *，那么就不需要再处理了，因为所有列都给它选了
@@ -203,38 +341,32 @@ def extract_select_stmt(query: str, select_stmt: RuleContext) -> ParsedSQL:
             result_columns.append((table_name, column_name, function_name))
 
     # 处理 WHERE 部分
-    where_constraint_exprs = get_children_with_type(first_select_core, SQLiteParser.Where_exprContext)
-    if len(where_constraint_exprs) == 0:
+    if parts.where_expr is None:
         where_condition = None
     else:
-        constraint_expr = where_constraint_exprs[0].getChild(0)
+        constraint_expr = parts.where_expr.getChild(0)
         where_condition = extract_constraint_expr(constraint_expr, alt_table)
 
     # 处理 GROUP BY 部分
     group_by_columns = []
-    l_group_by_columns = get_children_with_type(first_select_core, SQLiteParser.Group_by_columnsContext)
-    if len(l_group_by_columns) != 0:
-        columns = find_children_with_type(l_group_by_columns[0], SQLiteParser.Table_columnContext)
-        for column in columns:
-            table_name, column_name = extract_table_column(column)
-            table_name = alt_text(table_name)
-            group_by_columns.append((table_name, column_name))
+    for column in parts.group_by_columns:
+        table_name, column_name = extract_table_column(column)
+        table_name = alt_text(table_name)
+        group_by_columns.append((table_name, column_name))
 
-    having = get_children_with_type(first_select_core, SQLiteParser.Having_exprContext)
-    if len(having) == 0:
+    if parts.having_expr is None:
         having_expr = None
     else:
-        constraint_expr = having[0].getChild(0)
+        constraint_expr = parts.having_expr.getChild(0)
         having_expr = extract_constraint_expr(constraint_expr, alt_table)
 
 
     # ORDER BY 部分
-    order_by_stmts = get_children_with_type(select_stmt, SQLiteParser.Order_by_stmtContext)
-    if len(order_by_stmts) == 0:
+    if parts.order_by_stmt is None:
         order_by_column = None
         ordering = None
     else:
-        order_by_stmt = order_by_stmts[0]
+        order_by_stmt = parts.order_by_stmt
         ordering_term = order_by_stmt.getChild(2) # 0: ORDER 1: BY
         if isinstance(ordering_term.getChild(0), SQLiteParser.Table_columnContext):
             table_name, column_name = extract_table_column(ordering_term.getChild(0))
@@ -254,11 +386,10 @@ def extract_select_stmt(query: str, select_stmt: RuleContext) -> ParsedSQL:
             ordering = "ASC"
             
 
-    limit_stmts = get_children_with_type(select_stmt, SQLiteParser.Limit_stmtContext)
-    if len(limit_stmts) == 0:
+    if parts.limit_stmt is None:
         limit = None
     else:
-        limit_stmt = limit_stmts[0]
+        limit_stmt = parts.limit_stmt
         limit = int(limit_stmt.getChild(1).getText().strip())
 
 
@@ -276,30 +407,191 @@ def extract_select_stmt(query: str, select_stmt: RuleContext) -> ParsedSQL:
     )
     
 
-def parse_sql(query: str) -> ParsedSQL:
-    lexer = SQLiteLexer(InputStream(query))
-    stream = CommonTokenStream(lexer)
-    parser = SQLiteParser(stream)
-    tree = parser.parse()
+class ParseBudget(object):
+    """
+    单次解析的预算，超出时抛 ParseBudgetExceeded，None 表示不限制
+    max_depth 是语法树的深度（规则嵌套层数），max_seconds 包含 SLL 和 LL 两次尝试的总时间
+    """
+    def __init__(self, max_tokens: int | None = None, max_depth: int | None = None, max_seconds: float | None = None):
+        self.max_tokens = max_tokens
+        self.max_depth = max_depth
+        self.max_seconds = max_seconds
+
+class CachedParseError(ValueError):
+    """
+    缓存里记录的解析失败，type_name 是第一次解析时抛出的异常的类名
+    """
+    def __init__(self, type_name: str, message: str):
+        super().__init__(message)
+        self.type_name = type_name
+
+def failure_reason(e: Exception) -> str:
+    """
+    解析失败的原因（异常类名），命中缓存的失败和第一次解析时一样
+    """
+    return e.type_name if isinstance(e, CachedParseError) else type(e).__name__
+
+class ParseBudgetExceeded(Exception):
+    def __init__(self, kind: str, limit, query: str):
+        super().__init__(f"Parse budget exceeded: {kind} > {limit}")
+        # kind 是 "tokens"、"depth" 或 "time"
+        self.kind = kind
+        self.limit = limit
+        self.query = query
+
+class _BudgetListener(ParseTreeListener):
+    """
+    挂在 parser 上，每进入一条规则检查一次深度和时间，错误恢复时也检查时间
+    """
+    def __init__(self, budget: ParseBudget, query: str):
+        self.budget = budget
+        self.query = query
+        self.deadline = None
+        if budget.max_seconds is not None:
+            self.deadline = time.perf_counter() + budget.max_seconds
+
+    def check_time(self):
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise ParseBudgetExceeded("time", self.budget.max_seconds, self.query)
+
+    def enterEveryRule(self, ctx: ParserRuleContext):
+        # 左递归规则的 enter/exit 事件不成对，不能靠计数，直接沿 parentCtx 数当前深度
+        if self.budget.max_depth is not None and ctx.depth() > self.budget.max_depth:
+            raise ParseBudgetExceeded("depth", self.budget.max_depth, self.query)
+        self.check_time()
+
+    def visitErrorNode(self, node):
+        self.check_time()
+
+def _check_token_budget(stream: CommonTokenStream, budget: ParseBudget | None, query: str):
+    if budget is None or budget.max_tokens is None:
+        return
+    # 先把 token 全部读出来，parser 之后直接用，不会重复 lex
+    stream.fill()
+    # 空白在 hidden channel 上不算，EOF 也不算
+    num_tokens = sum(1 for token in stream.tokens if token.channel == Token.DEFAULT_CHANNEL and token.type != Token.EOF)
+    if num_tokens > budget.max_tokens:
+        raise ParseBudgetExceeded("tokens", budget.max_tokens, query)
+
+def _budget_listener(budget: ParseBudget | None, query: str) -> _BudgetListener | None:
+    # 不限深度和时间时不挂 listener，省掉每条规则的回调开销
+    if budget is None or (budget.max_depth is None and budget.max_seconds is None):
+        return None
+    return _BudgetListener(budget, query)
+
+# 复用同一组 lexer/parser，DFA 缓存是类级别共享的，复用实例还能省掉每次构造 ATN 模拟器的开销
+_lexer: SQLiteLexer | None = None
+_parser: SQLiteParser | None = None
+
+def parse_tree(query: str, two_stage: bool = True, budget: ParseBudget | None = None) -> RuleContext:
+    """
+    先用 SLL + BailErrorStrategy 快速解析，失败了再用完整的 LL + 默认错误恢复重试
+    有些 Spider 查询要靠错误恢复才能抽出 ParsedSQL，所以 LL 这一步不能 bail
+    two_stage 为 False 时退回到原来的做法：每次新建 lexer/parser 直接走 LL
+    budget 不为 None 时超出预算抛 ParseBudgetExceeded
+    """
+    global _lexer, _parser
+    listener = _budget_listener(budget, query)
+    if not two_stage:
+        lexer = SQLiteLexer(InputStream(query))
+        stream = CommonTokenStream(lexer)
+        _check_token_budget(stream, budget, query)
+        parser = SQLiteParser(stream)
+        if listener is not None:
+            parser.addParseListener(listener)
+        return parser.parse()
+
+    if _lexer is None or _parser is None:
+        _lexer = SQLiteLexer(InputStream(""))
+        _lexer.removeErrorListeners()
+        _parser = SQLiteParser(CommonTokenStream(_lexer))
+        _parser.removeErrorListeners()
+
+    _lexer.inputStream = InputStream(query)
+    stream = CommonTokenStream(_lexer)
+    _check_token_budget(stream, budget, query)
+    # setTokenStream 里的 reset 在挂着 listener 时会出错（runtime 的 setTrace 问题），所以先摘掉，设置完再挂上
+    _parser.removeParseListeners()
+    _parser.setTokenStream(stream)
+    if listener is not None:
+        _parser.addParseListener(listener)
+    _parser._errHandler = BailErrorStrategy()
+    _parser._interp.predictionMode = PredictionMode.SLL
+    try:
+        return _parser.parse()
+    except ParseCancellationException:
+        pass
+
+    # SLL 失败不一定是语法错误，可能只是 SLL 的能力不够，用 LL 再来一次
+    stream.seek(0)
+    _parser.removeParseListeners()
+    _parser.setTokenStream(stream)
+    if listener is not None:
+        _parser.addParseListener(listener)
+    _parser._errHandler = DefaultErrorStrategy()
+    _parser._interp.predictionMode = PredictionMode.LL
+    return _parser.parse()
+
+def _parse_sql(query: str, fast_path: bool = False, budget: ParseBudget | None = None) -> ParsedSQL:
+    if fast_path:
+        # 先试手写的快速解析器，不支持的写法再走 ANTLR
+        from parser.fast import UnsupportedSyntax, fast_parse_sql
+        try:
+            return fast_parse_sql(query)
+        except UnsupportedSyntax:
+            pass
+    tree = parse_tree(query, budget=budget)
     tree = get_children_with_type(tree, SQLiteParser.Select_stmtContext)[0]
     return extract_select_stmt(query, tree)
 
+def parse_sql(query: str, cache: ParseCache | None = None, fast_path: bool = False, budget: ParseBudget | None = None) -> ParsedSQL:
+    """
+    cache 不为 None 时先查磁盘缓存，解析失败的结果也会缓存，再次遇到时直接抛 CachedParseError，用 failure_reason 取原来的异常类名
+    fast_path 为 True 时优先用 parser.fast 里手写的解析器，结果和 ANTLR 一致
+    budget 只限制 ANTLR 的解析，超出预算抛 ParseBudgetExceeded，这种失败和预算有关，不写进缓存
+    """
+    if cache is None:
+        return _parse_sql(query, fast_path, budget)
+
+    cached = cache.get(query)
+    if cached is not None:
+        ok, value = cached
+        if not ok:
+            type_name, _, message = value.partition(": ")
+            raise CachedParseError(type_name, message)
+        result = ParsedSQL.deserialize(value)
+        result.query = query
+        return result
+
+    try:
+        result = _parse_sql(query, fast_path, budget)
+    except ParseBudgetExceeded:
+        raise
+    except Exception as e:
+        cache.put(query, False, f"{type(e).__name__}: {e}")
+        raise
+    cache.put(query, True, result.serialize())
+    return result
+
 if __name__ == "__main__":
     import argparse
     import json
     parser = argparse.ArgumentParser()
     parser.add_argument("--spider-json", type=str, default="../data/spider/train_spider.json")
+    parser.add_argument("--parse-cache", type=str, required=False)
     args = parser.parse_args()
 
     with open(args.spider_json, "r") as f:
         data = json.load(f)
 
+    cache = ParseCache(args.parse_cache) if args.parse_cache else None
+
     for item in data:
         question = item["question"]
         query = item["query"]
         
         try:
-            result = parse_sql(query)
+            result = parse_sql(query, cache)
             print(question)
             print(query)
             print("Result columns:", result.result_columns)
@@ -320,4 +612,5 @@ if __name__ == "__main__":
                 
             print("")
 
-
+    if cache is not None:
+        cache.close()
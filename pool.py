@@ -0,0 +1,203 @@
+import json
+import os
+
+import datasets
+import faiss
+import numpy as np
+
+# 参考池的 FAISS 索引类型，都是归一化向量上的内积（即 cosine）
+INDEX_TYPES = ["flat", "ivf", "hnsw"]
+
+def get_index_path(pool_path: str) -> str:
+    """
+    索引存在池目录旁边：{prefix}_{db_id} -> {prefix}_{db_id}.faiss
+    """
+    return pool_path + ".faiss"
+
+def get_ranges_path(pool_path: str) -> str:
+    """
+    全局池里每个库占的行区间：{prefix} -> {prefix}.ranges.json
+    """
+    return pool_path + ".ranges.json"
+
+def build_index(embeddings: np.ndarray, index_type: str = "flat", nlist: int | None = None, hnsw_m: int = 32, hnsw_ef_search: int = 64) -> faiss.Index:
+    """
+    embeddings 须已做 L2 归一化
+    ivf 的聚类中心数默认取 sqrt(n)，且不超过样本数，小库上退化成接近 flat
+    """
+    n, dim = embeddings.shape
+    if index_type == "flat":
+        spec = "Flat"
+    elif index_type == "ivf":
+        nlist = max(1, min(nlist or int(np.sqrt(n)), n))
+        spec = f"IVF{nlist},Flat"
+    elif index_type == "hnsw":
+        spec = f"HNSW{hnsw_m},Flat"
+    else:
+        raise ValueError(f"Unknown index type: {index_type}")
+
+    index = faiss.index_factory(dim, spec, faiss.METRIC_INNER_PRODUCT)
+    if not index.is_trained:
+        index.train(embeddings)
+    index.add(embeddings)
+    if index_type == "hnsw":
+        # efSearch 会跟着索引一起保存
+        index.hnsw.efSearch = hnsw_ef_search
+    return index
+
+def read_index(path: str) -> faiss.Index:
+    """
+    只读 mmap 打开，向量和倒排表按需从磁盘换页，启动时间和池大小无关
+    """
+    return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+
+class ReferencePool(object):
+    """
+    参考池：问题和 SQL 在 datasets 里（arrow 本身就是 mmap 的），embedding 在 FAISS 索引里
+    全局池的行按 db_id 连续存放，ranges 记录每个库的 [begin, end)，检索时只看这个区间
+    ranges 为 None 的是按库分开保存的老格式，整个池就是一个库
+    近似索引加过滤时，探查的桶或图上的邻居大多属于别的库，小区间召回很差
+    所以不超过 exact_below 行的库直接读这段 embedding 精确算内积
+    """
+    def __init__(self, dataset: datasets.Dataset, index: faiss.Index, nprobe: int = 8, ranges: dict[str, tuple[int, int]] | None = None, exact_below: int = 4096):
+        self.dataset = dataset.select_columns(["question", "sql"])
+        self.vectors = dataset.select_columns(["embeddings"]).with_format("numpy")
+        self.index = index
+        self.ranges = ranges
+        self.exact_below = exact_below
+        self.nprobe = nprobe
+        if isinstance(index, faiss.IndexIVF):
+            self.nprobe = min(nprobe, index.nlist)
+            index.nprobe = self.nprobe
+
+    def __len__(self) -> int:
+        return self.index.ntotal
+
+    def _search_params(self, begin: int, end: int) -> faiss.SearchParameters:
+        # 传了 params 时 index 上的 nprobe / efSearch 不生效，要在 params 里再设一次
+        selector = faiss.IDSelectorRange(begin, end)
+        if isinstance(self.index, faiss.IndexIVF):
+            return faiss.SearchParametersIVF(sel=selector, nprobe=self.nprobe)
+        if isinstance(self.index, faiss.IndexHNSW):
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=self.index.hnsw.efSearch)
+        return faiss.SearchParameters(sel=selector)
+
+    def search(self, query: np.ndarray, k: int, db_id: str | None = None) -> list[tuple[str, str]]:
+        """
+        返回和 query 最相似的 k 条 (question, sql)，按相似度从高到低
+        query 不要求归一化；全局池必须给 db_id，池里没有这个库时返回空
+        """
+        begin, end = 0, self.index.ntotal
+        if self.ranges is not None:
+            if db_id not in self.ranges:
+                return []
+            begin, end = self.ranges[db_id]
+
+        k = min(k, end - begin)
+        if k <= 0:
+            return []
+        query = np.array(query, dtype=np.float32).reshape(1, -1)
+        faiss.normalize_L2(query)
+
+        if self.ranges is None:
+            _, ids = self.index.search(query, k)
+        elif end - begin <= self.exact_below and not isinstance(self.index, faiss.IndexFlat):
+            scores = self.vectors[begin:end]["embeddings"] @ query[0]
+            ids = [begin + np.argsort(-scores, kind="stable")[:k]]
+        else:
+            _, ids = self.index.search(query, k, params=self._search_params(begin, end))
+        # IVF 探查的桶里不够 k 条时会返回 -1
+        ids = [int(i) for i in ids[0] if i >= 0]
+        rows = self.dataset[ids]
+        return list(zip(rows["question"], rows["sql"]))
+
+def save_pool(dataset: datasets.Dataset, path: str, index_type: str = "flat", nlist: int | None = None, hnsw_m: int = 32, hnsw_ef_search: int = 64):
+    """
+    保存池和它的索引，dataset 的 embeddings 列须已归一化
+    """
+    dataset.save_to_disk(path)
+    embeddings = np.array(dataset["embeddings"], dtype=np.float32)
+    index = build_index(embeddings, index_type, nlist, hnsw_m, hnsw_ef_search)
+    faiss.write_index(index, get_index_path(path))
+
+def save_global_pool(dataset: datasets.Dataset, path: str, index_type: str = "flat", nlist: int | None = None, hnsw_m: int = 32, hnsw_ef_search: int = 64):
+    """
+    所有库存成一个池：一个 embedding 矩阵、一个索引，外加每个库的行区间
+    dataset 里同一个 db_id 的行必须是连续的
+    """
+    ranges = {}
+    for row, db_id in enumerate(dataset["db_id"]):
+        if db_id not in ranges:
+            ranges[db_id] = [row, row + 1]
+        elif ranges[db_id][1] == row:
+            ranges[db_id][1] = row + 1
+        else:
+            raise ValueError(f"Rows of {db_id} are not contiguous")
+
+    save_pool(dataset, path, index_type, nlist, hnsw_m, hnsw_ef_search)
+    with open(get_ranges_path(path), "w") as f:
+        json.dump(ranges, f)
+
+def load_pool(path: str, nprobe: int = 8, exact_below: int = 4096) -> ReferencePool:
+    ranges = None
+    if os.path.exists(get_ranges_path(path)):
+        with open(get_ranges_path(path), "r") as f:
+            ranges = {db_id: tuple(rng) for db_id, rng in json.load(f).items()}
+
+    dataset = datasets.Dataset.load_from_disk(path)
+    index_path = get_index_path(path)
+    if os.path.exists(index_path):
+        index = read_index(index_path)
+    else:
+        # 老格式的池没有保存索引，embedding 也没归一化，只能现场归一化后建 flat 索引
+        embeddings = np.array(dataset["embeddings"], dtype=np.float32)
+        faiss.normalize_L2(embeddings)
+        index = build_index(embeddings)
+    return ReferencePool(dataset, index, nprobe, ranges, exact_below)
+
+def load_reference_pools(prefix: str, db_ids: list[str], nprobe: int = 8, exact_below: int = 4096) -> dict[str, ReferencePool]:
+    """
+    {prefix} 是全局池时所有库共用一个 ReferencePool，否则按老格式读 {prefix}_{db_id}
+    """
+    if os.path.exists(get_ranges_path(prefix)):
+        pool = load_pool(prefix, nprobe, exact_below)
+        return {db_id: pool for db_id in db_ids}
+    return {db_id: load_pool(f"{prefix}_{db_id}", nprobe, exact_below) for db_id in db_ids}
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pool", dest="pool", type=str, required=True)
+    parser.add_argument("--k", dest="k", type=int, default=5)
+    parser.add_argument("--nprobe", dest="nprobe", type=int, default=8)
+    parser.add_argument("--queries", dest="queries", type=int, default=200)
+    args = parser.parse_args()
+
+    # 用池里的向量当查询，对比保存的索引和暴力搜索的召回率与耗时；全局池只在查询所属的库里比
+    start_time = time.perf_counter()
+    pool = load_pool(args.pool, args.nprobe)
+    load_time = time.perf_counter() - start_time
+
+    dataset = datasets.Dataset.load_from_disk(args.pool)
+    embeddings = np.array(dataset["embeddings"], dtype=np.float32)
+    faiss.normalize_L2(embeddings)
+    db_ids = dataset["db_id"]
+    rows = np.linspace(0, len(embeddings) - 1, min(args.queries, len(embeddings))).astype(int)
+
+    search_time = 0
+    recalls = []
+    for row in rows:
+        query = embeddings[row:row + 1]
+        begin, end = pool.ranges[db_ids[row]] if pool.ranges is not None else (0, len(embeddings))
+        params = pool._search_params(begin, end) if pool.ranges is not None else None
+        k = min(args.k, end - begin)
+
+        start_time = time.perf_counter()
+        _, approx = pool.index.search(query, k, params=params)
+        search_time += time.perf_counter() - start_time
+        exact = begin + np.argsort(-(embeddings[begin:end] @ query[0]), kind="stable")[:k]
+        recalls.append(len(set(approx[0].tolist()) & set(exact.tolist())) / k)
+
+    print(f"Index: {type(pool.index).__name__}, size: {len(pool)}, databases: {len(pool.ranges) if pool.ranges is not None else 1}, load: {load_time * 1000:.1f}ms")
+    print(f"Search {len(rows)} queries: {search_time * 1000:.1f}ms, recall@{args.k}: {np.mean(recalls):.2%}")
@@ -0,0 +1,80 @@
+import json
+import os
+
+def get_sample_id(sample: dict, index: int, dataset_type: str) -> str:
+    """
+    结果文件里用来去重和 resume 的 id，BIRD 自带 question_id，Spider 没有，用样本在测试集文件里的位置
+    """
+    if dataset_type == "bird":
+        return "bird_" + str(sample["question_id"])
+    return f"{dataset_type}_{index}"
+
+def _read_lines(path: str, key: str) -> tuple[dict[str, dict], int]:
+    """
+    返回 ({sample_id: 结果}, 完整的行一共多少字节)
+    最后一行没写完（进程中途被杀）就忽略
+    """
+    results = {}
+    valid_size = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            results[result[key]] = result
+            valid_size += len(line)
+    return results, valid_size
+
+def read_results(path: str, key: str = "sample_id") -> dict[str, dict]:
+    """
+    读 JSONL 结果文件，返回 {sample_id: 结果}，同一个 sample_id 出现多次时以最后一次为准
+    """
+    if not os.path.exists(path):
+        return {}
+    return _read_lines(path, key)[0]
+
+class ResultWriter(object):
+    """
+    追加写的 JSONL 结果文件，每推理完一条写一行，不用每次重写整个文件
+    resume 为 True 时保留已有的结果，可以跳过已经推理完的样本；否则清空重写
+    """
+    def __init__(self, path: str, resume: bool = False, key: str = "sample_id"):
+        self.path = path
+        self.key = key
+        self.results = {}
+
+        if resume and os.path.exists(path):
+            self.results, valid_size = _read_lines(path, key)
+            # 截掉写了一半的最后一行，后面追加的内容才不会接在它后面
+            with open(path, "r+b") as f:
+                f.truncate(valid_size)
+
+        self.file = open(path, "a" if resume else "w", encoding="utf-8")
+
+    def __contains__(self, sample_id: str) -> bool:
+        return sample_id in self.results
+
+    def __len__(self) -> int:
+        return len(self.results)
+
+    def write(self, result: dict):
+        self.file.write(json.dumps(result, ensure_ascii=False) + "\n")
+        self.results[result[self.key]] = result
+
+    def flush(self, sync: bool = False):
+        self.file.flush()
+        if sync:
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.flush(sync=True)
+        self.file.close()
+
+    def __enter__(self) -> "ResultWriter":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -1,93 +1,267 @@
+import hashlib
+import sqlite3
+
+# 外键在 prompt 里的默认写法
+FK_FORMAT = "{table}({column}) REFERENCES {ref_table}({ref_column})"
+
+def _tokenizer_key(tokenizer) -> str:
+    # 同一个模型的 tokenizer 结果一样，按模型名缓存
+    return getattr(tokenizer, "name_or_path", None) or str(id(tokenizer))
+
+def _count_tokens(tokenizer, text: str) -> int:
+    return len(tokenizer.encode(text, add_special_tokens=False))
+
+class ColumnStats:
+    """
+    从 SQLite 里统计出来的列的取值情况，见 profile_database
+    """
+    __slots__ = ("row_count", "distinct_count", "null_fraction", "min_value", "max_value", "frequent_values", "avg_text_length")
+
+    def __init__(self, row_count: int, distinct_count: int, null_fraction: float, min_value, max_value, frequent_values: tuple, avg_text_length: float | None):
+        self.row_count = row_count
+        self.distinct_count = distinct_count
+        self.null_fraction = null_fraction
+        self.min_value = min_value
+        self.max_value = max_value
+        self.frequent_values = frequent_values # ((value, count), ...)，按出现次数从多到少
+        self.avg_text_length = avg_text_length # 只算 TEXT 类型的值，没有文本时为 None
+
+    def __repr__(self) -> str:
+        return f"ColumnStats(rows={self.row_count}, distinct={self.distinct_count}, null={self.null_fraction:.2f}, min={self.min_value!r}, max={self.max_value!r}, avg_len={self.avg_text_length})"
+
 class Database:
+    __slots__ = ("name", "tables", "_table_index", "_fragments")
+
     def __init__(self, name: str):
         self.name = name
         self.tables = {}
+        self._table_index = {} # {TABLE_NAME: table_name}，大小写不敏感的索引，同名时保留先加入的
+        self._fragments = {} # 拼 prompt 用的片段缓存，加表或者表结构变了就清空
 
     def __str__(self) -> str:
-        return f"{self.name}({', '.join([str(table) for table in self.tables.values()])})"
+        return f"{self.name}({', '.join(self.signatures())})"
 
     def add_table(self, table: "Table"):
         self.tables[table.name] = table
+        self._table_index.setdefault(table.name.upper(), table.name)
         table.database = self
+        self._fragments.clear()
 
     def get_table(self, name: str) -> "Table":
         name = name.upper()
-        for table_name, table in self.tables.items():
-            if table_name.upper() == name:
-                return table
-        raise ValueError(f"Table {name} not found in database {self.name}")
+        table_name = self._table_index.get(name)
+        if table_name is None:
+            raise ValueError(f"Table {name} not found in database {self.name}")
+        return self.tables[table_name]
+
+    def ddls(self) -> tuple[str, ...]:
+        """
+        所有表的 DDL，按表的顺序
+        """
+        if "ddls" not in self._fragments:
+            self._fragments["ddls"] = tuple(table.to_ddl() for table in self.tables.values())
+        return self._fragments["ddls"]
+
+    def signatures(self) -> tuple[str, ...]:
+        """
+        所有表的 str(table)，即 table(col1, col2, ...)
+        """
+        if "signatures" not in self._fragments:
+            self._fragments["signatures"] = tuple(str(table) for table in self.tables.values())
+        return self._fragments["signatures"]
+
+    def schema_hash(self) -> str:
+        """
+        库结构的 hash，由所有表的 DDL 和外键决定，用作按库缓存结果的 key
+        """
+        if "schema_hash" not in self._fragments:
+            h = hashlib.sha1(self.name.encode())
+            for line in self.ddls() + self.fk_lines():
+                h.update(b"\0" + line.encode())
+            self._fragments["schema_hash"] = h.hexdigest()
+        return self._fragments["schema_hash"]
+
+    def fk_lines(self, fmt: str = FK_FORMAT) -> tuple[str, ...]:
+        """
+        所有表的外键描述，fmt 里可以用 table、column、ref_table、ref_column
+        """
+        key = ("fk_lines", fmt)
+        if key not in self._fragments:
+            self._fragments[key] = tuple(line for table in self.tables.values() for line in table.fk_lines(fmt))
+        return self._fragments[key]
+
+    def join_graph(self) -> "JoinGraph":
+        """
+        外键连成的 join 图，第一次用的时候构建，schema 变了会重建
+        """
+        if "join_graph" not in self._fragments:
+            self._fragments["join_graph"] = JoinGraph(self)
+        return self._fragments["join_graph"]
+
+    def join_path(self, table_a: str, table_b: str) -> tuple[tuple[str, str, str, str], ...] | None:
+        """
+        table_a 到 table_b 最短的 join 路径，每一步是 (表, 列, 下一张表, 列)，不连通时返回 None
+        """
+        return self.join_graph().paths[self.get_table(table_a).name].get(self.get_table(table_b).name)
+
+    def connected_components(self) -> tuple[tuple[str, ...], ...]:
+        return self.join_graph().components
+
+    def ddl_token_count(self, tokenizer) -> int:
+        """
+        所有表的 DDL 的 token 数之和，按 tokenizer 缓存
+        """
+        key = ("ddl_tokens", _tokenizer_key(tokenizer))
+        if key not in self._fragments:
+            self._fragments[key] = sum(table.ddl_token_count(tokenizer) for table in self.tables.values())
+        return self._fragments[key]
     
+class JoinGraph:
+    """
+    把外键当作无向边的表图，构建时从每张表 BFS 一次，算好所有表对之间的最短 join 路径和连通分量
+    两张表之间有多个外键时用第一个，自己引用自己的外键不算
+    """
+    __slots__ = ("adjacency", "references", "paths", "components", "component_index")
+
+    def __init__(self, db: "Database"):
+        self.adjacency = {} # {table_name: {neighbor_name: (column, neighbor_column)}}
+        self.references = {} # {table_name: frozenset(被它的外键引用的表)}，有方向
+        for table in db.tables.values():
+            self.adjacency[table.name] = {}
+        for table in db.tables.values():
+            referenced = set()
+            for col, ref_table, ref_col in table.foreign_keys:
+                referenced.add(ref_table.name)
+                if ref_table.name == table.name or ref_table.name not in self.adjacency:
+                    continue
+                self.adjacency[table.name].setdefault(ref_table.name, (col, ref_col))
+                self.adjacency[ref_table.name].setdefault(table.name, (ref_col, col))
+            self.references[table.name] = frozenset(referenced)
+
+        self.paths = {} # {table_name: {table_name: ((表, 列, 下一张表, 列), ...)}}，自己到自己是空路径
+        self.components = []
+        self.component_index = {} # {table_name: 连通分量编号}
+        for source in self.adjacency:
+            self.paths[source] = self._shortest_paths(source)
+            if source not in self.component_index:
+                # BFS 顺序是确定的，分量里的表按 db.tables 的顺序排
+                component = tuple(name for name in self.adjacency if name in self.paths[source])
+                for name in component:
+                    self.component_index[name] = len(self.components)
+                self.components.append(component)
+        self.components = tuple(self.components)
+
+    def _shortest_paths(self, source: str) -> dict:
+        paths = {source: ()}
+        queue = [source]
+        for current in queue:
+            for neighbor, (col, neighbor_col) in self.adjacency[current].items():
+                if neighbor not in paths:
+                    paths[neighbor] = paths[current] + ((current, col, neighbor, neighbor_col),)
+                    queue.append(neighbor)
+        return paths
+
+    def is_connected(self, table_names: list[str]) -> bool:
+        return len(set(self.component_index[name] for name in table_names)) <= 1
+
 def build_db_from_spider(spider_db_schema: dict) -> Database:
     db = Database(spider_db_schema["db_id"])
-    table_columns_indexes = {} # {table_name: [column_index, ...]}
-    for index, table_name in enumerate(spider_db_schema["table_names_original"]):
-        table = Table(table_name)
+    table_names = spider_db_schema["table_names_original"]
+    column_names = spider_db_schema["column_names_original"]
+    column_types = spider_db_schema["column_types"]
+    # 复合主键在 BIRD 里是嵌套的 list，原来用 in 判断时不会命中，这里也只收单列主键
+    primary_keys = set(x for x in spider_db_schema["primary_keys"] if isinstance(x, int))
 
-        for col_index, col in enumerate(spider_db_schema["column_names_original"]):
-            if col[0] == index:
-                # 记录下每张表在 Spider 那个 schema 中的列索引
-                table_columns_indexes[table_name] = table_columns_indexes.get(table_name, []) + [col_index]
-                table.add_column(col[1], spider_db_schema["column_types"][col_index], col_index in spider_db_schema["primary_keys"])
-        
-        db.add_table(table)
+    # 一次遍历把列按表分好，col_index -> (table_name, column_name) 也一起记下来
+    table_columns = [[] for _ in table_names] # [[column_index, ...], ...]
+    col_index_to_name = {} # {column_index: (table_name, column_name)}
+    for col_index, col in enumerate(column_names):
+        if 0 <= col[0] < len(table_names):
+            table_columns[col[0]].append(col_index)
+            col_index_to_name[col_index] = (table_names[col[0]], col[1])
 
-    for foreign_key_pair in spider_db_schema["foreign_keys"]:
-        def col_index_to_name(col_index) -> tuple[str, str]: # (table_name, column_name)
-            for table_name, indexes in table_columns_indexes.items():
-                if col_index in indexes:
-                    return table_name, spider_db_schema["column_names_original"][col_index][1]
-            return ("", "") # 应该不会走到这里
-        def add_foreign_key(a: int, b:int):
-            ta, ca = col_index_to_name(a)
-            tb, cb = col_index_to_name(b)
-            db.get_table(ta).set_foreign_key(ca, db.get_table(tb), cb)
-
-        a = foreign_key_pair[0]
-        b = foreign_key_pair[1]
+    for index, table_name in enumerate(table_names):
+        table = Table(table_name)
+        for col_index in table_columns[index]:
+            table.add_column(column_names[col_index][1], column_types[col_index], col_index in primary_keys)
+        db.add_table(table)
 
-        add_foreign_key(a, b)
+    for a, b in spider_db_schema["foreign_keys"]:
+        ta, ca = col_index_to_name.get(a, ("", "")) # 应该不会找不到
+        tb, cb = col_index_to_name.get(b, ("", ""))
+        db.get_table(ta).set_foreign_key(ca, db.get_table(tb), cb)
 
     return db
 
 
 
 class Table:
+    __slots__ = ("database", "name", "columns", "primary_keys", "foreign_keys", "row_count", "_primary_key_set", "_foreign_key_map", "_column_info", "_fragments", "_column_stats")
+
     def __init__(self, name: str, database: "Database | None" = None):
         self.database = database
         self.name = name
         self.columns = [] # [(name, type), ...]
         self.primary_keys = [] # [column, ...]
         self.foreign_keys = [] # [(column, table, column), ...]
+        self._primary_key_set = set()
+        self._foreign_key_map = {} # {column: (table, column)}，一列有多个外键时保留第一个
+        self._column_info = None # {COLUMN_NAME: get_column_info 的结果}，第一次查询时构建，schema 变了就清空
+        self._fragments = {} # DDL、str 等片段的缓存，schema 变了就清空
+        self.row_count = None # 没有做过 profile_database 时为 None
+        self._column_stats = {} # {COLUMN_NAME: ColumnStats}
+
+    def _invalidate(self):
+        self._column_info = None
+        self._fragments.clear()
+        if self.database is not None:
+            self.database._fragments.clear()
 
     def add_column(self, name: str, type: str, primary_key: bool = False):
         self.columns.append((name, type))
         if primary_key:
             self.primary_keys.append(name)
+            self._primary_key_set.add(name)
+        self._invalidate()
 
     def set_foreign_key(self, column: str, table: "Table", ref_column: str):
         self.foreign_keys.append((column, table, ref_column))
+        self._foreign_key_map.setdefault(column, (table, ref_column))
+        self._invalidate()
 
-    def get_column_info(self, column_name: str) -> tuple[str, str, bool, bool, tuple[str, str] | None] | None: # (stdname, type, pk?, fk?, (fktn, fkcn))
+    def _build_column_info(self) -> dict:
+        column_info = {}
         for col, col_type in self.columns:
-            if col.upper() == column_name.upper():
-                fk = None
-                for fk_col, fk_table, fk_ref_col in self.foreign_keys:
-                    if fk_col == col:
-                        fk = (fk_table.name, fk_ref_col)
-                        break
-                return col, col_type, col in self.primary_keys, fk is not None, fk
-            
-        return None # 不存在这个列
+            fk = self._foreign_key_map.get(col)
+            if fk is not None:
+                fk = (fk[0].name, fk[1])
+            # 同名（大小写不敏感）的列保留第一个
+            column_info.setdefault(col.upper(), (col, col_type, col in self._primary_key_set, fk is not None, fk))
+        return column_info
+
+    def get_column_info(self, column_name: str) -> tuple[str, str, bool, bool, tuple[str, str] | None] | None: # (stdname, type, pk?, fk?, (fktn, fkcn))
+        if self._column_info is None:
+            self._column_info = self._build_column_info()
+        return self._column_info.get(column_name.upper()) # 不存在这个列时返回 None
+
+
+    def set_column_stats(self, column_name: str, stats: ColumnStats):
+        self._column_stats[column_name.upper()] = stats
 
+    def get_column_stats(self, column_name: str) -> ColumnStats | None:
+        """
+        列的取值统计，大小写不敏感，没有做过 profile_database 时返回 None
+        """
+        return self._column_stats.get(column_name.upper())
 
     def __str__(self):
-        column_strings = []
-        fk_list = [x for x, _, _ in self.foreign_keys]
-        for col, col_type in self.columns:
-            column_strings.append(f"{col}")
-        return f"{self.name}({', '.join(column_strings)})"
+        if "signature" not in self._fragments:
+            self._fragments["signature"] = f"{self.name}({', '.join(col for col, _ in self.columns)})"
+        return self._fragments["signature"]
     
     def to_ddl(self) -> str:
+        if "ddl" in self._fragments:
+            return self._fragments["ddl"]
         ddl = f"CREATE TABLE {self.name} (\n"
         for col, col_type in self.columns:
             ddl += f"    {col} {col_type},\n"
@@ -97,8 +271,72 @@ class Table:
         for col, table, ref_col in self.foreign_keys:
             ddl += f"    FOREIGN KEY ({col}) REFERENCES {table.name}({ref_col}),\n"
         ddl = ddl[:-2] + "\n);"
+        self._fragments["ddl"] = ddl
         return ddl
 
+    def fk_lines(self, fmt: str = FK_FORMAT) -> tuple[str, ...]:
+        key = ("fk_lines", fmt)
+        if key not in self._fragments:
+            self._fragments[key] = tuple(fmt.format(table=self.name, column=col, ref_table=table.name, ref_column=ref_col) for col, table, ref_col in self.foreign_keys)
+        return self._fragments[key]
+
+    def ddl_token_count(self, tokenizer) -> int:
+        key = ("ddl_tokens", _tokenizer_key(tokenizer))
+        if key not in self._fragments:
+            self._fragments[key] = _count_tokens(tokenizer, self.to_ddl())
+        return self._fragments[key]
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+def profile_table(table: Table, conn: sqlite3.Connection, top_k: int = 10):
+    """
+    统计一张表每一列的行数、不同值个数、空值比例、最值、高频值和平均文本长度
+    除高频值外所有列的统计在一次扫描里完成
+    """
+    if len(table.columns) == 0:
+        return
+    aggregates = []
+    for col, _ in table.columns:
+        c = _quote(col)
+        aggregates.append(f"COUNT(DISTINCT {c}), SUM({c} IS NULL), MIN({c}), MAX({c}), AVG(CASE WHEN typeof({c}) = 'text' THEN length({c}) END)")
+    row = conn.execute(f"SELECT COUNT(*), {', '.join(aggregates)} FROM {_quote(table.name)}").fetchone()
+    row_count = row[0]
+    table.row_count = row_count
+
+    for index, (col, _) in enumerate(table.columns):
+        distinct_count, null_count, min_value, max_value, avg_text_length = row[1 + index * 5: 6 + index * 5]
+        frequent_values = conn.execute(
+            f"SELECT {_quote(col)}, COUNT(*) AS cnt FROM {_quote(table.name)} WHERE {_quote(col)} IS NOT NULL GROUP BY {_quote(col)} ORDER BY cnt DESC LIMIT ?",
+            (top_k,)
+        ).fetchall()
+        table.set_column_stats(col, ColumnStats(
+            row_count=row_count,
+            distinct_count=distinct_count,
+            null_fraction=(null_count or 0) / row_count if row_count > 0 else 0.0,
+            min_value=min_value,
+            max_value=max_value,
+            frequent_values=tuple((value, count) for value, count in frequent_values),
+            avg_text_length=avg_text_length
+        ))
+
+def profile_database(db: Database, db_sqlite_file: str, top_k: int = 10):
+    """
+    对库里的每张表做 profile_table，结果存在 Table 上，随 catalog 一起保存
+    SQLite 里查不了的表（比如 schema 和数据对不上）跳过，统计保持为空
+    """
+    conn = sqlite3.connect(f"file:{db_sqlite_file}?mode=ro", uri=True)
+    # 有些库里有非法的 UTF-8
+    conn.text_factory = lambda b: b.decode(errors="ignore")
+    try:
+        for table in db.tables.values():
+            try:
+                profile_table(table, conn, top_k)
+            except sqlite3.Error:
+                pass
+    finally:
+        conn.close()
+
 if __name__ == "__main__":
     import argparse
     import json
@@ -1,24 +1,83 @@
 import argparse
+import numpy as np
 from transformers import AutoModelForCausalLM, AutoTokenizer, AutoModel, pipeline
 import torch
 import json
 from jinja2 import Template
 from tqdm import tqdm
 import re
+import hashlib
+import sqlite3
 
 from llm.glm4 import GLM4
 from llm.llama import Llama
 from llm.llm import LLM
 from llm.qwen import Qwen
-from schema import Database, Table, build_db_from_spider
+from schema import Database, Table
+from catalog import load_catalog
+from embedding import encode_texts
 
-def schema_linking(question: str, db: Database, llm: LLM, template: Template) -> list[Table]:
+# LLM schema linking 的生成参数，改了要同时改 SL_CACHE_VERSION
+SL_GENERATE_KWARGS = {"max_new_tokens": 256, "do_sample": False, "num_beams": 5, "top_p": None, "top_k": None, "temperature": None}
+
+# 缓存的内容或生成参数变了就改这个，老缓存会自动失效
+SL_CACHE_VERSION = 1
+
+class SchemaLinkingCache(object):
     """
-    使用 LLM 进行 schema linking
+    LLM schema linking 结果的磁盘缓存，存在一个 SQLite 文件里
+    key 是 (模型, prompt 模板的 hash, 库结构的 hash, 问题) 的 hash，value 是 LLM 的原始回答
+    存原始回答，解析表名的逻辑改了也不用重新生成
+    """
+    def __init__(self, path: str, model: str, template_source: str, commit_interval: int = 100):
+        self.path = path
+        self.prefix = f"{SL_CACHE_VERSION}\0{model}\0{hashlib.sha1(template_source.encode()).hexdigest()}"
+        self.commit_interval = commit_interval
+        self.pending = 0
+        self.hits = 0
+        self.misses = 0
+
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = OFF")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS linked (key BLOB PRIMARY KEY, value TEXT) WITHOUT ROWID")
+        self.conn.commit()
+
+    def key(self, db: Database, question: str) -> bytes:
+        return hashlib.sha1(f"{self.prefix}\0{db.schema_hash()}\0{question}".encode()).digest()
+
+    def get(self, db: Database, question: str) -> str | None:
+        row = self.conn.execute("SELECT value FROM linked WHERE key = ?", (self.key(db, question),)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def put(self, db: Database, question: str, answer: str):
+        self.conn.execute("INSERT OR REPLACE INTO linked (key, value) VALUES (?, ?)", (self.key(db, question), answer))
+        self.pending += 1
+        if self.pending >= self.commit_interval:
+            self.flush()
+
+    def flush(self):
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def __enter__(self) -> "SchemaLinkingCache":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def parse_linked_tables(answer: str, db: Database) -> list[Table]:
+    """
+    把 LLM 的回答解析成 db 里的表
     """
-    ddls = [table.to_ddl() for table in db.tables.values()]
-    prompt = template.render(ddls=ddls, question=question)
-    answer = llm.infer(prompt, max_new_tokens=256, do_sample=False, num_beams=5, top_p=None, top_k=None, temperature=None)
     answer = answer.strip()
     # 用 \n 分割，每行一个表名
     answer = answer.split("\n")
@@ -39,55 +98,165 @@ def schema_linking(question: str, db: Database, llm: LLM, template: Template) ->
 
     return real_answer
 
+def schema_linking(question: str, db: Database, llm: LLM, template: Template, cache: SchemaLinkingCache | None = None) -> list[Table]:
+    """
+    使用 LLM 进行 schema linking
+    """
+    return schema_linking_batch([question], db, llm, template, cache)[0]
+
+def schema_linking_batch(questions: list[str], db: Database, llm: LLM, template: Template, cache: SchemaLinkingCache | None = None, batch_size: int = 8) -> list[list[Table]]:
+    """
+    同一个库的多个问题一起做 schema linking，返回顺序和 questions 一致
+    先查缓存，没命中的问题去重后每 batch_size 个拼成一次补齐的 generate
+    """
+    answers = {}
+    if cache is not None:
+        for question in questions:
+            if question not in answers:
+                answer = cache.get(db, question)
+                if answer is not None:
+                    answers[question] = answer
+
+    missing = list(dict.fromkeys(question for question in questions if question not in answers))
+    if len(missing) > 0:
+        ddls = db.ddls()
+        for begin in range(0, len(missing), batch_size):
+            batch = missing[begin:begin + batch_size]
+            prompts = [template.render(ddls=ddls, question=question) for question in batch]
+            if len(prompts) == 1:
+                outputs = [llm.infer(prompts[0], system_prompt=None, **SL_GENERATE_KWARGS)]
+            else:
+                outputs = llm.infer_batch(prompts, system_prompt=None, **SL_GENERATE_KWARGS)
+            for question, answer in zip(batch, outputs):
+                answers[question] = answer
+                if cache is not None:
+                    cache.put(db, question, answer)
+
+    return [parse_linked_tables(answers[question], db) for question in questions]
+
+class EmbeddingSchemaLinker(object):
+    """
+    用 BGE 做 schema linking，代替再调一次 LLM
+    每个库的表和列描述只在第一次用到时 embedding 一次，之后每个问题只做一次矩阵乘法
+    取得分最高的 top_tables 张表，再补上把它们用外键连起来所需的中间表
+    """
+    def __init__(self, tokenizer, model, top_tables: int = 3, batch_size: int = 64):
+        self.tokenizer = tokenizer
+        self.model = model
+        self.top_tables = top_tables
+        self.batch_size = batch_size
+        self.indexes = {} # {db_name: (descriptor embeddings, 每行对应的表在 db.tables 里的序号)}
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        return encode_texts(self.tokenizer, self.model, texts, batch_size=self.batch_size)
+
+    def _index(self, db: Database) -> tuple[np.ndarray, np.ndarray]:
+        if db.name not in self.indexes:
+            descriptors = []
+            owners = []
+            for table_index, table in enumerate(db.tables.values()):
+                # 表本身一条，每列一条，下划线换成空格更接近自然语言
+                table_text = table.name.replace("_", " ")
+                descriptors.append(f"table {table_text}")
+                owners.append(table_index)
+                for col, col_type in table.columns:
+                    descriptors.append(f"{table_text} {col.replace('_', ' ')} ({col_type})")
+                    owners.append(table_index)
+            self.indexes[db.name] = (self.encode(descriptors), np.array(owners))
+        return self.indexes[db.name]
+
+    def link(self, question_embeddings: np.ndarray, db: Database) -> list[Table]:
+        embeddings, owners = self._index(db)
+        question_embeddings = question_embeddings / np.linalg.norm(question_embeddings)
+        scores = embeddings @ question_embeddings
+
+        # 表的得分取它所有描述里最高的
+        table_scores = np.full(len(db.tables), -np.inf)
+        np.maximum.at(table_scores, owners, scores)
+        all_tables = list(db.tables.values())
+        top = [all_tables[i].name for i in np.argsort(-table_scores, kind="stable")[:self.top_tables]]
+
+        # 用最短 join 路径把其余的表连到得分最高的表上，不连通的就不补
+        linked = set(top)
+        for table_name in top[1:]:
+            path = db.join_path(top[0], table_name)
+            if path is not None:
+                for table_a, _, table_b, _ in path:
+                    linked.add(table_a)
+                    linked.add(table_b)
+
+        return [table for table in all_tables if table.name in linked]
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--sl-set", dest="sl_set", type=str, required=True)
     parser.add_argument("--table", dest="table", type=str, required=True)
-    parser.add_argument("--base-model", dest="base_model", type=str, required=True)
+    parser.add_argument("--base-model", dest="base_model", type=str, required=False)
     parser.add_argument("--output-result", dest="output_result", type=str, required=True)
     parser.add_argument("--save-interval", dest="save_interval", type=int, default=10)
+    # llm 是原来的 LLM schema linking，embedding 用 BGE 打分，不需要 --base-model
+    parser.add_argument("--method", dest="method", type=str, choices=["llm", "embedding"], default="llm")
+    parser.add_argument("--bge-model", dest="bge_model", type=str, required=False)
+    parser.add_argument("--top-tables", dest="top_tables", type=int, default=3)
+    # llm 方法的结果缓存和批量大小
+    parser.add_argument("--sl-cache", dest="sl_cache", type=str, required=False)
+    parser.add_argument("--sl-batch-size", dest="sl_batch_size", type=int, default=8)
     args = parser.parse_args()
 
     input_template_file =  "llm_templates/schema_linking_input.j2"
 
     with open(input_template_file, "r") as f:
-        input_template = Template(f.read())
-
-    # 加载 LLM
-    llm = Qwen(args.base_model, "sl-model")
+        input_template_source = f.read()
+        input_template = Template(input_template_source)
+
+    if args.method == "llm":
+        # 加载 LLM
+        llm = Qwen(args.base_model, "sl-model")
+        sl_cache = SchemaLinkingCache(args.sl_cache, llm.model_path, input_template_source) if args.sl_cache is not None else None
+    else:
+        bge_model = AutoModel.from_pretrained(args.bge_model)
+        bge_model.eval()
+        linker = EmbeddingSchemaLinker(AutoTokenizer.from_pretrained(args.bge_model), bge_model, top_tables=args.top_tables)
 
     # 读数据
     with open(args.sl_set, 'r') as f:
         data = json.load(f)
 
     # 读取数据库 schema 信息
-    with open(args.table, "r") as f:
-        table = json.load(f)
-
-    dbs = {}
-    for db in table:
-        dbs[db["db_id"]] = build_db_from_spider(db)
+    dbs = load_catalog(args.table)
+    used_dbs = set(sample["db"] for sample in data)
 
     tables = {}
     ddls = {}
     fks = {}
     ref_datasets = {}
 
-    for db in dbs.values():
-        my_tables = []
-        my_fks = []
-        my_ddls = []
-
-        for table in db.tables.values():
-            my_tables.append(str(table))
-            my_ddls.append(table.to_ddl())
-            for fk in table.foreign_keys:
-                my_fks.append(f"{table.name}.{fk[0]} references {fk[1].name}.{fk[2]}")
-
-        tables[db.name] = my_tables
-        fks[db.name] = my_fks
-        ddls[db.name] = my_ddls
-
+    for db_name in dbs:
+        # 只处理用到的库，其余的不用反序列化
+        if db_name not in used_dbs:
+            continue
+        db = dbs[db_name]
+        tables[db.name] = db.signatures()
+        fks[db.name] = db.fk_lines("{table}.{column} references {ref_table}.{ref_column}")
+        ddls[db.name] = db.ddls()
+
+
+    if args.method == "embedding":
+        # 所有问题的 embedding 一次算好，第 i 行对应 data[i]
+        question_embeddings = linker.encode([sample["question"] for sample in data])
+    else:
+        # 同一个库的问题一起做 schema linking，第 i 个对应 data[i]
+        by_db = {}
+        for index, sample in enumerate(data):
+            by_db.setdefault(sample["db"], []).append(index)
+        linked = [None] * len(data)
+        for db_name, indexes in tqdm(by_db.items(), desc="Schema Linking"):
+            results = schema_linking_batch([data[i]["question"] for i in indexes], dbs[db_name], llm, input_template, sl_cache, args.sl_batch_size)
+            for i, result in zip(indexes, results):
+                linked[i] = result
+        if sl_cache is not None:
+            print(f"Schema linking cache hits: {sl_cache.hits}, misses: {sl_cache.misses}")
+            sl_cache.close()
 
     output = []
     total = len(data)
@@ -99,11 +268,14 @@ if __name__ == "__main__":
     with tqdm(data) as bar:
         for index, sample in enumerate(data):
             db = dbs[sample["db"]]
-            ddls = [table.to_ddl() for table in db.tables.values()]
+            ddls = db.ddls()
             question = sample["question"]
             reference_tables = sample["used_tables"]
 
-            answer = schema_linking(question, db, llm, input_template)
+            if args.method == "llm":
+                answer = linked[index]
+            else:
+                answer = linker.link(question_embeddings[index], db)
             answer = [table.name for table in answer]
 
             lower_ref = [table.lower() for table in reference_tables]
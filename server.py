@@ -0,0 +1,328 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from jinja2 import Template
+from sse_starlette.sse import EventSourceResponse
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from infer import DECODE_KWARGS, extract_sql, flatten_sql, generate_answers, generate_prompt
+from llm.llm import LLM
+from llm.streaming import BatchTextStreamer
+from embedding import encode_texts
+
+class MicroBatcher(object):
+    """
+    把并发到达的请求攒成一批再交给 process_batch，第一条请求到达后最多再等 max_wait 秒或攒满 max_batch_size 条
+    process_batch 在唯一的一个推理线程里执行，模型不会被并发调用，事件循环也不会被 generate 卡住
+    """
+    def __init__(self, process_batch: Callable[[list[dict]], list[dict]], max_batch_size: int = 8, max_wait: float = 0.02):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.executor = ThreadPoolExecutor(1)
+        self.queue = None
+        self.batches = 0
+        self.requests = 0
+
+    async def submit(self, request: dict) -> dict:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((request, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            self.batches += 1
+            self.requests += len(batch)
+            try:
+                results = await loop.run_in_executor(self.executor, self.process_batch, [request for request, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                # 客户端断开后 future 已被取消
+                if not future.done():
+                    future.set_result(result)
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        self.task.cancel()
+        self.executor.shutdown(wait=False)
+
+class TextToSQLService(object):
+    """
+    常驻的模型、schema catalog、参考池，一批 (db_id, question) 一起拼 prompt、一起生成
+    请求按库分组，同一个库的 prompt 共用前缀，开了 prefix_cache 时前缀的 KV 缓存跨批复用
+    num_beams 为 1 且模型有 tokenizer 时逐 token 回调 on_text；beam search 只在最后给出 SQL
+    """
+    def __init__(
+        self,
+        llm: LLM,
+        dbs,
+        input_template: Template,
+        reference_shot: int = 0,
+        ref_pools: dict | None = None,
+        bge_tokenizer=None,
+        bge_model=None,
+        sl: bool = False,
+        sl_model: LLM | None = None,
+        sl_template: Template | None = None,
+        sl_linker=None,
+        num_beams: int = 1,
+        prefix_cache: bool = False,
+        stop_mode: str = "none",
+    ):
+        self.llm = llm
+        self.dbs = dbs
+        self.input_template = input_template
+        self.reference_shot = reference_shot
+        self.ref_pools = ref_pools
+        self.bge_tokenizer = bge_tokenizer
+        self.bge_model = bge_model
+        self.sl = sl
+        self.sl_model = sl_model if sl_model is not None else llm
+        self.sl_template = sl_template
+        self.sl_linker = sl_linker
+        self.num_beams = num_beams
+        self.prefix_cache = prefix_cache
+        self.stop_mode = stop_mode
+
+    def answer_batch(self, requests: list[dict]) -> list[dict]:
+        """
+        requests 里每条是 {"db_id", "question", "on_text"（可以没有）}，返回顺序一致的 {"db_id", "question", "sql"}
+        """
+        start_time = time.perf_counter()
+        questions = [request["question"] for request in requests]
+        if self.bge_model is not None:
+            all_question_embeddings = encode_texts(self.bge_tokenizer, self.bge_model, questions)
+        else:
+            all_question_embeddings = [None] * len(requests)
+
+        prompts = []
+        for request, question_embeddings in zip(requests, all_question_embeddings):
+            prompts.append(generate_prompt(
+                db=self.dbs[request["db_id"]],
+                question=request["question"],
+                question_embeddings=question_embeddings,
+                reference_shot=self.reference_shot,
+                reference_datasets_dict=self.ref_pools,
+                sl=self.sl,
+                sl_model=self.sl_model,
+                sl_template=self.sl_template,
+                input_template=self.input_template,
+                sl_linker=self.sl_linker
+            ))
+
+        groups = {}
+        for i, request in enumerate(requests):
+            groups.setdefault(request["db_id"], []).append(i)
+
+        sqls = [None] * len(requests)
+        tokenizer = getattr(self.llm, "tokenizer", None)
+        for indexes in groups.values():
+            group_prompts = [prompts[i] for i in indexes]
+            prefix = os.path.commonprefix(group_prompts) if self.prefix_cache else None
+            kwargs = dict(DECODE_KWARGS, num_beams=self.num_beams, stop_mode=self.stop_mode)
+            callbacks = [requests[i].get("on_text") for i in indexes]
+            if self.num_beams == 1 and tokenizer is not None and any(callback is not None for callback in callbacks):
+                kwargs["streamer"] = BatchTextStreamer(tokenizer, callbacks)
+            answers = generate_answers(self.llm, group_prompts, prefix, **kwargs)
+            for i, answer in zip(indexes, answers):
+                sqls[i] = flatten_sql(extract_sql(answer))
+
+        seconds = time.perf_counter() - start_time
+        return [{"db_id": request["db_id"], "question": request["question"], "sql": sql, "batch_size": len(requests), "seconds": seconds} for request, sql in zip(requests, sqls)]
+
+def create_app(service: TextToSQLService, max_batch_size: int = 8, max_wait: float = 0.02) -> Starlette:
+    """
+    POST /sql        {"db_id", "question"} -> {"db_id", "question", "sql", ...}
+    POST /sql/stream 同样的请求，SSE 返回：token 事件是生成的文本增量，sql 事件是最终结果
+    GET  /health     批处理的统计
+    """
+    batcher = MicroBatcher(service.answer_batch, max_batch_size, max_wait)
+
+    async def parse_request(request: Request) -> dict | JSONResponse:
+        try:
+            body = await request.json()
+        except ValueError: # JSONDecodeError 和不是 UTF-8 的 UnicodeDecodeError 都是 ValueError
+            return JSONResponse({"error": "invalid JSON"}, status_code=400)
+        if not isinstance(body, dict) or not isinstance(body.get("db_id"), str) or not isinstance(body.get("question"), str):
+            return JSONResponse({"error": "db_id and question are required"}, status_code=400)
+        if body["db_id"] not in service.dbs:
+            return JSONResponse({"error": f"unknown db_id: {body['db_id']}"}, status_code=404)
+        return {"db_id": body["db_id"], "question": body["question"]}
+
+    async def sql(request: Request):
+        parsed = await parse_request(request)
+        if isinstance(parsed, JSONResponse):
+            return parsed
+        try:
+            return JSONResponse(await batcher.submit(parsed))
+        except Exception as e:
+            return JSONResponse({"error": str(e)}, status_code=500)
+
+    async def sql_stream(request: Request):
+        parsed = await parse_request(request)
+        if isinstance(parsed, JSONResponse):
+            return parsed
+
+        # 推理线程里的回调通过事件循环把增量放进这个请求自己的队列
+        loop = asyncio.get_running_loop()
+        deltas = asyncio.Queue()
+        parsed["on_text"] = lambda delta: loop.call_soon_threadsafe(deltas.put_nowait, delta)
+
+        async def events():
+            task = asyncio.ensure_future(batcher.submit(parsed))
+            try:
+                while not task.done() or not deltas.empty():
+                    get = asyncio.ensure_future(deltas.get())
+                    await asyncio.wait({get, task}, return_when=asyncio.FIRST_COMPLETED)
+                    if get.done():
+                        yield {"event": "token", "data": json.dumps(get.result(), ensure_ascii=False)}
+                    else:
+                        get.cancel()
+                try:
+                    result = await task
+                except Exception as e:
+                    yield {"event": "error", "data": json.dumps({"error": str(e)}, ensure_ascii=False)}
+                    return
+                yield {"event": "sql", "data": json.dumps(result, ensure_ascii=False)}
+            finally:
+                task.cancel()
+
+        return EventSourceResponse(events())
+
+    async def health(request: Request):
+        return JSONResponse({"status": "ok", "batches": batcher.batches, "requests": batcher.requests, "queued": batcher.queue.qsize()})
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app: Starlette):
+        batcher.start()
+        yield
+        batcher.stop()
+
+    return Starlette(
+        routes=[
+            Route("/sql", sql, methods=["POST"]),
+            Route("/sql/stream", sql_stream, methods=["POST"]),
+            Route("/health", health, methods=["GET"]),
+        ],
+        lifespan=lifespan,
+    )
+
+if __name__ == "__main__":
+    import uvicorn
+    from transformers import AutoModel, AutoTokenizer
+
+    from catalog import load_catalog
+    from llm.glm4 import GLM4
+    from llm.llama import Llama
+    from llm.qwen import Qwen
+    from llm.stub import StubLLM
+    from llm.stopping import STOP_MODES, template_stop_mode
+    from pool import load_reference_pools
+    from schema_linking import EmbeddingSchemaLinker
+
+    parser = argparse.ArgumentParser(description="Serve text-to-SQL over HTTP, batching concurrent requests")
+    parser.add_argument("--host", dest="host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", dest="port", type=int, default=8000)
+    parser.add_argument("--model-type", dest="model_type", type=str, required=True, help="glm4, llama, qwen, or stub (no model, always answers --stub-answer)")
+    parser.add_argument("--base-model", dest="base_model", type=str, required=False)
+    parser.add_argument("--stub-answer", dest="stub_answer", type=str, default="```sql\nSELECT 1\n```")
+    parser.add_argument("--table", dest="table", type=str, required=True)
+    parser.add_argument("--db-name", dest="db_name", type=str, required=False, nargs="*", help="only serve these databases")
+    parser.add_argument("--input-template", dest="input_template", type=str, default="llm_templates/infer_cr_ddl_input.j2")
+    parser.add_argument("--reference-datasets-prefix", dest="reference_datasets_prefix", type=str, required=False)
+    parser.add_argument("--reference-shot", dest="reference_shot", type=int, default=0)
+    parser.add_argument("--pool-nprobe", dest="pool_nprobe", type=int, default=8)
+    parser.add_argument("--pool-exact-below", dest="pool_exact_below", type=int, default=4096)
+    parser.add_argument("--bge-model", dest="bge_model", type=str, required=False)
+    parser.add_argument("--sl", dest="sl", action="store_true", default=False)
+    parser.add_argument("--sl-method", dest="sl_method", type=str, choices=["llm", "embedding"], default="llm")
+    parser.add_argument("--sl-top-tables", dest="sl_top_tables", type=int, default=3)
+    parser.add_argument("--num-beams", dest="num_beams", type=int, default=1, help="tokens are only streamed when 1")
+    parser.add_argument("--prefix-cache", dest="prefix_cache", action="store_true", default=False)
+    parser.add_argument("--stop-mode", dest="stop_mode", type=str, choices=["auto"] + STOP_MODES, default="none")
+    parser.add_argument("--max-batch-size", dest="max_batch_size", type=int, default=8)
+    parser.add_argument("--max-wait-ms", dest="max_wait_ms", type=float, default=20, help="how long the first request of a batch waits for others")
+    args = parser.parse_args()
+
+    need_bge = args.reference_shot > 0 or (args.sl and args.sl_method == "embedding")
+    if need_bge and args.bge_model is None:
+        parser.error("--bge-model is needed by --reference-shot > 0 and --sl-method embedding")
+    if args.reference_shot > 0 and args.reference_datasets_prefix is None:
+        parser.error("--reference-shot > 0 needs --reference-datasets-prefix")
+
+    if args.model_type != "stub" and args.base_model is None:
+        parser.error("--base-model is required")
+
+    if args.model_type == "stub":
+        llm = StubLLM(args.stub_answer)
+    elif args.model_type == "glm4":
+        llm = GLM4(args.base_model, "base-model")
+    elif args.model_type == "llama":
+        llm = Llama(args.base_model, "base-model")
+    elif args.model_type == "qwen":
+        llm = Qwen(args.base_model, "base-model")
+    else:
+        parser.error(f"Unknown model type: {args.model_type}")
+
+    catalog = load_catalog(args.table)
+    dbs = {db_id: catalog[db_id] for db_id in args.db_name} if args.db_name is not None else catalog
+
+    bge_tokenizer, bge_model = None, None
+    if need_bge:
+        bge_tokenizer = AutoTokenizer.from_pretrained(args.bge_model)
+        bge_model = AutoModel.from_pretrained(args.bge_model)
+        bge_model.eval()
+
+    ref_pools = None
+    if args.reference_shot > 0:
+        ref_pools = load_reference_pools(args.reference_datasets_prefix, list(dbs), nprobe=args.pool_nprobe, exact_below=args.pool_exact_below)
+
+    with open(args.input_template, "r") as f:
+        input_template_source = f.read()
+    with open("llm_templates/schema_linking_input.j2", "r") as f:
+        sl_template = Template(f.read())
+
+    service = TextToSQLService(
+        llm=llm,
+        dbs=dbs,
+        input_template=Template(input_template_source),
+        reference_shot=args.reference_shot,
+        ref_pools=ref_pools,
+        bge_tokenizer=bge_tokenizer,
+        bge_model=bge_model,
+        sl=args.sl,
+        sl_template=sl_template,
+        sl_linker=EmbeddingSchemaLinker(bge_tokenizer, bge_model, top_tables=args.sl_top_tables) if args.sl and args.sl_method == "embedding" else None,
+        num_beams=args.num_beams,
+        prefix_cache=args.prefix_cache,
+        stop_mode=template_stop_mode(input_template_source) if args.stop_mode == "auto" else args.stop_mode,
+    )
+    uvicorn.run(create_app(service, args.max_batch_size, args.max_wait_ms / 1000), host=args.host, port=args.port)
@@ -0,0 +1,98 @@
+import os
+import sqlite3
+import time
+from typing import Any
+
+# 检查方式：explain 只编译不执行；execute 真正执行并取第一行
+CHECK_MODES = ["explain", "execute"]
+
+def get_db_path(db_dir: str, db_id: str) -> str:
+    """
+    和 test-suite-sql-eval 一样的目录结构：{db_dir}/{db_id}/{db_id}.sqlite
+    """
+    return os.path.join(db_dir, db_id, db_id + ".sqlite")
+
+def open_readonly(db_path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+    # 和 exec_eval 一样，非 UTF-8 的文本不报错
+    conn.text_factory = lambda b: b.decode(errors="ignore")
+    return conn
+
+def execute_sql(db_path: str, sql: str, timeout: float = 10.0) -> tuple[str, Any]:
+    """
+    在只读连接上执行，返回值和 exec_eval.exec_on_db 一样：("result", 所有行) 或 ("exception", 异常)
+    超过 timeout 秒由 SQLite 自己中断，不会像 exec_on_db 那样留下还在跑的线程
+    每次新开连接，可以在多个线程里同时调用
+    """
+    deadline = time.monotonic() + timeout
+    conn = open_readonly(db_path)
+    conn.set_progress_handler(lambda: time.monotonic() > deadline, 1000)
+    try:
+        return "result", conn.execute(sql).fetchall()
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        if time.monotonic() > deadline:
+            return "exception", TimeoutError()
+        return "exception", e
+    finally:
+        conn.close()
+
+class SQLChecker(object):
+    """
+    用 SQLite 自己的解析器检查生成的 SQL，语法错误、表名列名写错在编译阶段就会报错
+    explain 模式只做 EXPLAIN，不读数据，几乎没有开销
+    execute 模式再执行到第一行，能查出运行时错误；超过 timeout 秒就中断，能编译通过的慢查询算通过
+    每个库只开一个只读连接，反复使用
+    """
+    def __init__(self, db_dir: str, mode: str = "explain", timeout: float = 1.0):
+        if mode not in CHECK_MODES:
+            raise ValueError(f"Unknown check mode: {mode}")
+        self.db_dir = db_dir
+        self.mode = mode
+        self.timeout = timeout
+        self.connections = {}
+
+    def _connection(self, db_id: str) -> sqlite3.Connection:
+        if db_id not in self.connections:
+            self.connections[db_id] = open_readonly(get_db_path(self.db_dir, db_id))
+        return self.connections[db_id]
+
+    def check(self, db_id: str, sql: str) -> str | None:
+        """
+        返回失败原因（extract / sqlite 的报错信息），通过时返回 None
+        """
+        if sql == "ERROR":
+            return "extract"
+        conn = self._connection(db_id)
+        deadline = time.monotonic() + self.timeout
+        interrupted = False
+        def progress():
+            nonlocal interrupted
+            interrupted = time.monotonic() > deadline
+            return interrupted
+        conn.set_progress_handler(progress, 1000)
+        try:
+            if self.mode == "explain":
+                conn.execute("EXPLAIN " + sql).fetchall()
+            else:
+                conn.execute(sql).fetchone()
+        except sqlite3.Warning as e:
+            # 一次执行了多条语句
+            return str(e)
+        except sqlite3.Error as e:
+            if interrupted:
+                return None
+            return str(e)
+        finally:
+            conn.set_progress_handler(None, 0)
+        return None
+
+    def close(self):
+        for conn in self.connections.values():
+            conn.close()
+        self.connections.clear()
+
+    def __enter__(self) -> "SQLChecker":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -1,12 +1,17 @@
 import re
 from typing import Callable
 from tqdm import tqdm
-from schema import Database, build_db_from_spider
-from parser.parse import BaseConstraintExpr, ParsedSQL, parse_sql
+from schema import Database
+from catalog import load_catalog
+from parser.parse import GRAMMAR_MODULES, BaseConstraintExpr, ParseBudget, ParseBudgetExceeded, ParsedSQL, failure_reason, parse_sql, set_grammar
+from parser.cache import ParseCache
+from collections import Counter
 import argparse
+import heapq
 import random
 import json
 import pickle
+import time
 
 def to_upper_snake_case(s: str) -> str:
     return "_".join(s.upper().split())
@@ -314,38 +319,73 @@ if __name__ == "__main__":
     parser.add_argument("--table-json", dest="spider_table_json", type=str, default="./data/spider/tables.json")
     parser.add_argument("--output", dest="output", type=str)
     parser.add_argument("--limit", dest="limit", type=int, default=100)
+    parser.add_argument("--parse-cache", dest="parse_cache", type=str, required=False)
+    parser.add_argument("--fast-parser", dest="fast_parser", action="store_true", default=False)
+    parser.add_argument("--grammar", dest="grammar", type=str, choices=list(GRAMMAR_MODULES), default="full")
+    # 单条 SQL 的解析预算，-1 表示不限制
+    parser.add_argument("--max-tokens", dest="max_tokens", type=int, default=1000)
+    parser.add_argument("--max-depth", dest="max_depth", type=int, default=100)
+    parser.add_argument("--parse-timeout", dest="parse_timeout", type=float, default=1.0)
+    parser.add_argument("--report-top", dest="report_top", type=int, default=10)
     args = parser.parse_args()
 
+    budget = ParseBudget(
+        max_tokens=args.max_tokens if args.max_tokens != -1 else None,
+        max_depth=args.max_depth if args.max_depth != -1 else None,
+        max_seconds=args.parse_timeout if args.parse_timeout != -1 else None
+    )
+
+    set_grammar(args.grammar)
+
+    parse_cache = ParseCache(args.parse_cache) if args.parse_cache else None
+
     sql_data = []
     for sql_json in args.spider_sql_json:
         with open(sql_json, "r") as f:
             sql_data.extend(json.load(f))
 
-    with open(args.spider_table_json, "r") as f:
-        db_data = json.load(f)
-
-    dbs = dict()
-    for item in tqdm(db_data):
-        db = build_db_from_spider(item)
-        dbs[db.name] = db
+    dbs = load_catalog(args.spider_table_json)
 
     templates = dict()
+    # 失败原因计数，预算超限单独按 tokens/depth/time 统计
+    failures = Counter()
+    budget_hits = []
+    parse_times = []
     with tqdm(total=len(sql_data)) as pbar:
         cnt = 0
         for item in sql_data:
+            start_time = time.perf_counter()
             try:
                 db = dbs[item["db_id"]]
-                sql = parse_sql(item["query"])
+                sql = parse_sql(item["query"], parse_cache, fast_path=args.fast_parser, budget=budget)
+                parse_times.append((time.perf_counter() - start_time, item["query"]))
                 template = SQLTemplate(db, sql)
 
                 templates.setdefault(hash(template), [template, 0])
                 templates[hash(template)][1] += 1
-            except:
-                pass
+            except ParseBudgetExceeded as e:
+                failures[f"budget:{e.kind}"] += 1
+                budget_hits.append((time.perf_counter() - start_time, e.kind, item["query"]))
+            except Exception as e:
+                failures[failure_reason(e)] += 1
             cnt += 1
-            pbar.set_postfix_str(f"Templates: {len(templates)}, Processed: {cnt}")
+            pbar.set_postfix_str(f"Templates: {len(templates)}, Processed: {cnt}, Failed: {sum(failures.values())}")
             pbar.update(1)
 
+    print(f"Processed: {cnt}, Parsed: {len(parse_times)}, Templates: {len(templates)}")
+    for reason, count in failures.most_common():
+        print(f"  {reason}: {count}")
+    if budget_hits:
+        print(f"Parse budget exceeded ({len(budget_hits)}):")
+        for elapsed, kind, query in budget_hits[:args.report_top]:
+            print(f"  [{kind}, {elapsed:.3f}s] {query}")
+    print("Slowest parses:")
+    for elapsed, query in heapq.nlargest(args.report_top, parse_times):
+        print(f"  [{elapsed:.3f}s] {query}")
+
+    if parse_cache is not None:
+        parse_cache.close()
+
     # 按照出现次数排序
     sorted_templates = sorted(templates.items(), key=lambda x: x[1][1], reverse=True)
 
@@ -10,7 +10,8 @@ from llm.glm4 import GLM4
 from llm.internlm import InternLM
 from llm.llama import Llama
 from llm.qwen import Qwen
-from schema import build_db_from_spider
+from catalog import load_catalog
+from embedding import encode_texts
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--test-set", dest="test_set", type=str, required=True)
@@ -51,12 +52,10 @@ with open(args.test_set, 'r') as f:
     test_set = json.load(f)
 
 # 读取数据库 schema 信息
-with open(args.table, "r") as f:
-    table = json.load(f)
+dbs = load_catalog(args.table)
 
-dbs = {}
-for db in table:
-    dbs[db["db_id"]] = build_db_from_spider(db)
+# 原问题的 embedding 一次算好（已归一化），生成的问题要等 LLM 出结果才能算
+original_embeddings = torch.from_numpy(encode_texts(bge_tokenizer, bge_model, [sample["question"] for sample in test_set]))
 
 output = []
 similarities = []
@@ -70,7 +69,7 @@ with tqdm(test_set) as bar:
         db = dbs[sample["db_id"]]
 
 
-        ddls = [table.to_ddl() for table in db.tables.values()]
+        ddls = db.ddls()
 
         input = input_template.render(
             sql=sql, ddls=ddls)
@@ -82,7 +81,7 @@ with tqdm(test_set) as bar:
         answer = re.sub(r"\s+", " ", mo).strip()
         answer = answer.strip()
 
-        oe = encode(original)
+        oe = original_embeddings[index:index + 1]
         ae = encode(answer)
         similarity = oe @ ae.T
 
@@ -0,0 +1,57 @@
+import os
+import sys
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+# test-suite-sql-eval 不是包，里面的模块按顶层模块名互相导入
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "test-suite-sql-eval"))
+from exec_eval import result_eq # type: ignore
+
+from sql_check import execute_sql
+
+def execute_candidates(db_path: str, sqls: list[str], timeout: float = 10.0, executor: ThreadPoolExecutor | None = None) -> dict[str, tuple[str, Any]]:
+    """
+    去重后执行候选 SQL，返回 {SQL: execute_sql 的结果}，抽不出 SQL 的候选不执行
+    给了 executor 时并发执行，每条用自己的只读连接，SQLite 执行时会释放 GIL
+    """
+    distinct = list(dict.fromkeys(sql for sql in sqls if sql != "ERROR"))
+    if executor is None:
+        executions = [execute_sql(db_path, sql, timeout) for sql in distinct]
+    else:
+        executions = list(executor.map(lambda sql: execute_sql(db_path, sql, timeout), distinct))
+    return dict(zip(distinct, executions))
+
+def vote(sqls: list[str], executions: dict[str, tuple[str, Any]]) -> tuple[str, dict]:
+    """
+    按执行结果把候选聚类（判等用 exec_eval.result_eq），返回 (票数最多的类里出现最多的 SQL, 投票统计)
+    一个类的结果是否看顺序由这个类第一条 SQL 有没有 ORDER BY 决定，和 exec_eval 里以标准答案为准一样
+    票数相同时取先出现的类；所有候选都执行失败时退回第一个抽得出的 SQL
+    """
+    clusters = [] # [(结果, 是否看顺序, [候选下标])]
+    for i, sql in enumerate(sqls):
+        flag, rows = executions.get(sql, ("exception", None))
+        if flag != "result":
+            continue
+        for cluster_rows, order_matters, members in clusters:
+            if result_eq(cluster_rows, rows, order_matters=order_matters):
+                members.append(i)
+                break
+        else:
+            clusters.append((rows, "order by" in sql.lower(), [i]))
+
+    stats = {
+        "candidates": len(sqls),
+        "distinct": len(executions),
+        "executed": sum(1 for flag, _ in executions.values() if flag == "result"),
+        "clusters": len(clusters),
+        "votes": 0,
+    }
+    if not clusters:
+        return next((sql for sql in sqls if sql != "ERROR"), "ERROR"), stats
+
+    # max 遇到票数相同时返回第一个
+    members = max(clusters, key=lambda cluster: len(cluster[2]))[2]
+    stats["votes"] = len(members)
+    # Counter.most_common 在次数相同时保持先出现的顺序
+    return Counter(sqls[i] for i in members).most_common(1)[0][0], stats